@@ -32,6 +32,14 @@ class TrademarkNationDataTable(ModelDataTable):
             'country__name_chs': '进入国家',
         }
         detail_url_format = '/trademark/nation/{}'
+        column_search = True
+        column_lookups = {
+            'app_no': 'istartswith',
+            'register_no': 'istartswith',
+        }
+        # 全局搜索跨越了trademark, client, country三个表，使用search index
+        search_index = True
+        approximate_count = True
 
 
 class TrademarkNationNiceDataTable(ModelDataTable):
@@ -61,3 +69,10 @@ class PatternNationDataTable(ModelDataTable):
             'country__name_chs': '进入国家',
         }
         detail_url_format = '/pattern/nation/{}'
+        column_search = True
+        column_lookups = {
+            'app_no': 'istartswith',
+            'publication_no': 'istartswith',
+            'publish_no': 'istartswith',
+            'pattern_no': 'istartswith',
+        }
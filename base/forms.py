@@ -4,6 +4,7 @@ from django import forms
 from django.core.exceptions import ValidationError
 
 from . import models
+from utils.widgets import RemoteSelect, register_scope, set_scope
 
 
 class ClientModelForm(forms.ModelForm):
@@ -18,14 +19,23 @@ class ClientModelForm(forms.ModelForm):
         self.fields['country'].queryset = models.Country.enabled_objects
 
 
+register_scope(models.Client)
+
+
 class TrademarkModelForm(forms.ModelForm):
     class Meta:
         model = models.Trademark
         fields = ['name', 'client', 'desc']
+        widgets = {
+            'client': RemoteSelect,
+        }
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.fields['client'].queryset = models.Client.enabled_objects
+        set_scope(self.fields['client'])
+
+
+register_scope(models.Trademark)
 
 
 class TrademarkNationModelForm(forms.ModelForm):
@@ -35,6 +45,7 @@ class TrademarkNationModelForm(forms.ModelForm):
                   'app_no', 'app_date', 'applicant',
                   'register_no', 'register_date', 'state', 'desc']
         widgets = {
+            'trademark': RemoteSelect,
             'app_date': forms.TextInput(attrs={
                 'data-provide': 'datepicker',
                 'data-date-format': 'yyyy-mm-dd',
@@ -47,7 +58,7 @@ class TrademarkNationModelForm(forms.ModelForm):
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.fields['trademark'].queryset = models.Trademark.enabled_objects
+        set_scope(self.fields['trademark'])
         self.fields['country'].queryset = models.Country.enabled_objects
 
     def clean(self):
@@ -73,10 +84,16 @@ class PatternModelForm(forms.ModelForm):
     class Meta:
         model = models.Pattern
         fields = ['name', 'client', 'desc']
+        widgets = {
+            'client': RemoteSelect,
+        }
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        set_scope(self.fields['client'])
+
 
-        def __init__(self, *args, **kwargs):
-            super().__init__(*args, **kwargs)
-            self.fields['client'].queryset = models.Client.enabled_objects
+register_scope(models.Pattern)
 
 
 class PatternNationModelForm(forms.ModelForm):
@@ -87,6 +104,7 @@ class PatternNationModelForm(forms.ModelForm):
                   'publish_no', 'publish_date', 'pattern_no', 'granted_date',
                   'state', 'desc']
         widgets = {
+            'pattern': RemoteSelect,
             'app_date': forms.TextInput(attrs={
                 'data-provide': 'datepicker',
                 'data-date-format': 'yyyy-mm-dd'
@@ -107,7 +125,7 @@ class PatternNationModelForm(forms.ModelForm):
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.fields['pattern'].queryset = models.Pattern.enabled_objects
+        set_scope(self.fields['pattern'])
         self.fields['country'].queryset = models.Country.enabled_objects
 
     def clean(self):
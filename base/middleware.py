@@ -1,15 +1,26 @@
 # -*- coding: utf-8 -*-
 
 import re
+import json
+import logging
+import time
+from collections import Counter, deque
+
 from django.conf import settings
+from django.db import connections
 from django.utils.deprecation import MiddlewareMixin
 from django.contrib.auth.decorators import login_required
 
+from utils import profiling
+from utils.models import RequestProfile
+
 LOGIN_REQUIRED_EXCEPTIONS = [re.compile(settings.LOGIN_URL.strip('/'))]
 if hasattr(settings, 'LOGIN_REQUIRED_EXCEPTIONS') and \
         isinstance(settings.LOGIN_REQUIRED_EXCEPTIONS, list):
     LOGIN_REQUIRED_EXCEPTIONS += [re.compile(exc) for exc in settings.LOGIN_REQUIRED_EXCEPTIONS]
 
+logger = logging.getLogger(__name__)
+
 
 class LoginRequiredMiddleware(MiddlewareMixin):
 
@@ -22,3 +33,247 @@ class LoginRequiredMiddleware(MiddlewareMixin):
             return login_required(view_func)(request, *view_args, **view_kwargs)
 
         return None
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+def query_budget(budget):
+    """
+    : 为function view设置query_budget，class-based view直接设置query_budget类属性
+    :param budget: int，或者dict, HTTP method -> int，例如{'GET': 10}，不在dict中的method不做限制
+    """
+    def decorator(view_func):
+        view_func.query_budget = budget
+        return view_func
+    return decorator
+
+
+def set_query_budget(request, budget):
+    """
+    : 在view中根据请求的内容修改当前请求的query_budget，
+    : 例如RelatedEntityView中不同action的页面的查询数量不同
+    :param budget: int, 为None时不做限制
+    """
+    instrumentation = getattr(request, '_instrumentation', None)
+    if instrumentation is not None:
+        instrumentation['budget'] = budget
+
+
+_NUMBER_RE = re.compile(r'\b\d+(\.\d+)?\b')
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_IN_LIST_RE = re.compile(r'\bIN \((?:\?, )*\?\)')
+
+
+def get_fingerprint(sql):
+    """
+    : 将SQL中的常量替换为?，用于识别参数不同的重复查询(N+1)
+    """
+    sql = _STRING_RE.sub('?', sql)
+    sql = _NUMBER_RE.sub('?', sql)
+    return _IN_LIST_RE.sub('IN (...)', sql)
+
+
+class QueryInstrumentationMiddleware(MiddlewareMixin):
+    """
+    : 记录每个请求的查询数量，SQL总时间，重复的查询以及模板渲染时间，
+    : 添加到Server-Timing header，并输出一行json格式的日志(logger: base.middleware)
+    : view的query_budget属性(参考query_budget())为查询数量上限，
+    : 超出时记录warning，settings.QUERY_BUDGET_STRICT为True时抛出QueryBudgetExceeded
+    : 需要放在MIDDLEWARE的第一位，以记录其他middleware产生的查询
+    : 模板渲染时间只包括TemplateResponse，render()等在view中渲染的时间计入view
+    """
+
+    def process_request(self, request):
+        request._instrumentation = {
+            'started': time.time(),
+            'logs': {},
+            'budget': None,
+            'view': None,
+            'template_time': 0,
+        }
+        for alias in connections:
+            connection = connections[alias]
+            # 与django.test.utils.CaptureQueriesContext相同，使用debug cursor记录查询
+            # 使用新的queries_log，结束时合并回原来的queries_log
+            request._instrumentation['logs'][alias] = (connection.force_debug_cursor, connection.queries_log)
+            connection.force_debug_cursor = True
+            connection.queries_log = deque(maxlen=connection.queries_log.maxlen)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if not hasattr(request, '_instrumentation'):
+            return None
+        view = getattr(view_func, 'view_class', view_func)
+        request._instrumentation['view'] = '{}.{}'.format(view.__module__, view.__name__)
+        budget = getattr(view, 'query_budget', None)
+        if isinstance(budget, dict):
+            budget = budget.get(request.method)
+        request._instrumentation['budget'] = budget
+        return None
+
+    def process_template_response(self, request, response):
+        instrumentation = getattr(request, '_instrumentation', None)
+        if instrumentation is None:
+            return response
+        started = time.time()
+
+        def rendered(response):
+            instrumentation['template_time'] += time.time() - started
+        response.add_post_render_callback(rendered)
+        return response
+
+    def _collect_queries(self, instrumentation):
+        queries = []
+        for alias, (force_debug_cursor, queries_log) in instrumentation['logs'].items():
+            connection = connections[alias]
+            queries.extend(connection.queries_log)
+            queries_log.extend(connection.queries_log)
+            connection.queries_log = queries_log
+            connection.force_debug_cursor = force_debug_cursor
+        return queries
+
+    def process_response(self, request, response):
+        instrumentation = getattr(request, '_instrumentation', None)
+        if instrumentation is None:
+            return response
+        del request._instrumentation
+        queries = self._collect_queries(instrumentation)
+
+        sql_time = sum(float(q['time']) for q in queries) * 1000
+        template_time = instrumentation['template_time'] * 1000
+        total_time = (time.time() - instrumentation['started']) * 1000
+        fingerprints = Counter(get_fingerprint(q['sql']) for q in queries)
+        duplicates = [(sql, count) for sql, count in fingerprints.most_common() if count > 1]
+
+        budget = instrumentation['budget']
+        timings = [
+            'db;dur={:.1f};desc="{} queries"'.format(sql_time, len(queries)),
+            'dup;desc="{} duplicated"'.format(sum(count - 1 for sql, count in duplicates)),
+            'tpl;dur={:.1f}'.format(template_time),
+            'total;dur={:.1f}'.format(total_time),
+        ]
+        if budget is not None:
+            # 例如benchmark command根据db与budget判断是否超出预算
+            timings.append('budget;desc="{} queries"'.format(budget))
+        response['Server-Timing'] = ', '.join(timings)
+        record = {
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'view': instrumentation['view'],
+            'queries': len(queries),
+            'budget': budget,
+            'sql_ms': round(sql_time, 1),
+            'template_ms': round(template_time, 1),
+            'total_ms': round(total_time, 1),
+            'duplicates': [{'sql': sql[:200], 'count': count} for sql, count in duplicates[:5]],
+        }
+        logger.info(json.dumps(record))
+
+        if budget is not None and len(queries) > budget:
+            message = '{} executed {} queries, exceeding query_budget {}'.format(
+                instrumentation['view'], len(queries), budget
+            )
+            logger.warning(message, extra={'instrumentation': record})
+            if getattr(settings, 'QUERY_BUDGET_STRICT', False):
+                raise QueryBudgetExceeded(message)
+        return response
+
+
+class _DeferredSave:
+    """
+    : 在response.close()时保存，此时所有middleware都已经完成，
+    : 保存产生的查询不会计入当前请求(QueryInstrumentationMiddleware)
+    """
+    def __init__(self, obj, keep):
+        self.obj = obj
+        self.keep = keep
+
+    def close(self):
+        try:
+            self.obj.save()
+            type(self.obj).objects.prune(self.keep)
+        except Exception:
+            logger.exception('failed to save request profile')
+
+
+class ProfilingMiddleware(MiddlewareMixin):
+    """
+    : 请求的profile，保存到utils.models.RequestProfile，可以在utils:profile_list页面下载
+    : staff用户在url中添加settings.PROFILE_QUERY_PARAM(例如?_profile)时，使用cProfile记录这个请求
+    : 设置了settings.PROFILE_SLOW_REQUEST_THRESHOLD(ms)时，对所有请求采样，保存超过阈值的请求
+    : profile包括之后的middleware，view以及模板渲染，需要放在AuthenticationMiddleware之后
+    """
+
+    def process_request(self, request):
+        param = getattr(settings, 'PROFILE_QUERY_PARAM', '_profile')
+        threshold = getattr(settings, 'PROFILE_SLOW_REQUEST_THRESHOLD', None)
+        user = getattr(request, 'user', None)
+        if param in request.GET and user is not None and user.is_staff:
+            profiler, trigger = profiling.CallProfiler(), 'flag'
+        elif threshold is not None:
+            interval = getattr(settings, 'PROFILE_SAMPLE_INTERVAL', 0.005)
+            profiler, trigger = profiling.SamplingProfiler(interval), 'slow'
+        else:
+            return None
+
+        logs = {}
+        for alias in connections:
+            connection = connections[alias]
+            # 与CaptureQueriesContext相同，记录开始时queries_log的位置
+            logs[alias] = (connection.force_debug_cursor, len(connection.queries_log))
+            connection.force_debug_cursor = True
+        request._profiling = {
+            'profiler': profiler,
+            'trigger': trigger,
+            'threshold': threshold,
+            'logs': logs,
+            'view': '',
+            'started': time.time(),
+        }
+        profiler.start()
+        return None
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if hasattr(request, '_profiling'):
+            view = getattr(view_func, 'view_class', view_func)
+            request._profiling['view'] = '{}.{}'.format(view.__module__, view.__name__)
+        return None
+
+    def _collect_queries(self, profiling_state):
+        queries = []
+        for alias, (force_debug_cursor, start) in profiling_state['logs'].items():
+            connection = connections[alias]
+            connection.force_debug_cursor = force_debug_cursor
+            queries.extend(dict(q, alias=alias) for q in list(connection.queries_log)[start:])
+        return queries
+
+    def process_response(self, request, response):
+        profiling_state = getattr(request, '_profiling', None)
+        if profiling_state is None:
+            return response
+        del request._profiling
+        profiler = profiling_state['profiler']
+        profiler.stop()
+        duration = (time.time() - profiling_state['started']) * 1000
+        queries = self._collect_queries(profiling_state)
+        if profiling_state['trigger'] == 'slow' and duration < profiling_state['threshold']:
+            return response
+
+        user = getattr(request, 'user', None)
+        profile = RequestProfile(
+            method=request.method,
+            path=request.get_full_path()[:2000],
+            view=profiling_state['view'],
+            status_code=response.status_code,
+            duration=duration,
+            query_count=len(queries),
+            queries=json.dumps(queries),
+            trigger=profiling_state['trigger'],
+            profile_format=profiler.format,
+            profile=profiler.dumps(),
+            user=user if user is not None and user.is_authenticated() else None,
+        )
+        response._closable_objects.append(_DeferredSave(profile, getattr(settings, 'PROFILE_KEEP', 200)))
+        return response
@@ -67,13 +67,72 @@ class DescriptionFieldMixin(models.Model):
 
 
 class FakerMixin:
-    # todo:
-    # 1. one to one relationship: 有添加重复外键的可能
+    """
+    : 生成测试数据
+    : faker_fields: dict, field name -> fake type，fake type可以是:
+    :   faker的provider名，例如'company'
+    :   (provider名, kwargs)，例如('pydecimal', {'left_digits': 5})
+    :   Model class，或者Model的import path，例如'base.models.Country'，从已有的记录中随机选择
+    : data_path: json文件，其中的记录直接写入数据库
+    : faker_ratio: initdb中生成数量相对于--count的比例
+    """
     faker_fields = None
     data_path = None
+    faker_ratio = 1
+
+    @classmethod
+    def _get_faker_related_model(cls, fake_type):
+        if isinstance(fake_type, type) and issubclass(fake_type, models.Model):
+            return fake_type
+        if isinstance(fake_type, str) and '.' in fake_type:
+            from django.utils.module_loading import import_string
+            return import_string(fake_type)
+        return None
+
+    @classmethod
+    def _get_faker_pk_pools(cls, rng):
+        """
+        : 一次性读取关联model的pk，one to one关系中已经被使用的pk被排除
+        : 作为收/付款(utils.ledger中的child)时，同时读取账单的unsettled_amount，
+        : 只从还有未结算金额的账单中选择
+        :return: dict, field name -> (attname, list of pk, 是否为one to one, (ledger, pk -> 未结算金额)或None)
+        """
+        from utils import ledger
+
+        ledgers = {l.parent_field: l for l in ledger.get_ledgers() if l.child_model is cls}
+        pools = {}
+        for field_name, fake_type in cls.faker_fields.items():
+            related_model = cls._get_faker_related_model(fake_type)
+            if related_model is None:
+                continue
+            field = cls._meta.get_field(field_name)
+            balances = None
+            if field_name in ledgers:
+                l = ledgers[field_name]
+                remaining = dict(related_model._default_manager.filter(
+                    **{'{}__gt'.format(l.balance_field): 0}
+                ).values_list('pk', l.balance_field))
+                pks = sorted(remaining)
+                balances = (l, remaining)
+            else:
+                pks = list(related_model._default_manager.order_by('pk').values_list('pk', flat=True))
+            if field.one_to_one:
+                used = set(cls._default_manager.exclude(
+                    **{field.attname: None}
+                ).values_list(field.attname, flat=True))
+                pks = [pk for pk in pks if pk not in used]
+                rng.shuffle(pks)
+            pools[field_name] = (field.attname, pks, field.one_to_one, balances)
+        return pools
 
     @classmethod
-    def populate(cls, count=100, locale='en_US'):
+    def populate(cls, count=100, locale='en_US', seed=None, batch_size=1000):
+        """
+        : 使用bulk_create批量写入count条测试数据
+        :param seed: 相同的seed和相同的数据库内容生成相同的数据
+        :param batch_size: 每次bulk_create写入的数量
+        :return: int, 写入的数量
+        """
         if cls.data_path:
             import json
             items = json.load(open(cls.data_path))
@@ -82,50 +141,83 @@ class FakerMixin:
                     cls.objects.create(**item)
                 except IntegrityError:
                     pass
-            return
+            return len(items)
         if not cls.faker_fields:
             raise ValueError('You must specify faker_fiedls or data_path.')
         for fake_type in cls.faker_fields.values():
             if isinstance(fake_type, str):
                 continue
+            if isinstance(fake_type, tuple) and len(fake_type) == 2:
+                continue
             if isinstance(fake_type, type) and issubclass(fake_type, models.Model):
                 continue
-            raise ValueError('fake type must be a str or a Model class inherited from models.Model')
+            raise ValueError('fake type must be a str, a (str, dict) tuple '
+                             'or a Model class inherited from models.Model')
         try:
             import faker
         except ImportError:
             print('Faker is not installed')
-        else:
-            fake = faker.Factory.create(locale)
-            fake_objs = []
-            for i in range(count):
-                data = {}
-
-                for field_name, fake_type in cls.faker_fields.items():
-                    is_model_class = not isinstance(fake_type, str)
-                    if is_model_class or '.' in fake_type:
-                        from random import randint
-                        if is_model_class:
-                            related_model = fake_type
-                        else:
-                            from django.utils.module_loading import import_string
-                            try:
-                                related_model = import_string(fake_type)
-                            except ImportError:
-                                raise
-                        related_obj_count = related_model.objects.count()
-                        if related_obj_count == 0:
-                            data[field_name] = None
-                        else:
-                            data[field_name] = related_model.objects.all()[randint(0, related_obj_count-1)]
+            return 0
+
+        import random
+        from django.db import transaction
+        from utils import caching, ledger
+
+        # 每个model使用不同的随机序列，与populate的调用顺序无关
+        rng = random.Random('{}:{}'.format(seed, cls._meta.label_lower) if seed is not None else None)
+        fake = faker.Factory.create(locale)
+        fake.seed_instance(rng.getrandbits(32))
+        pools = cls._get_faker_pk_pools(rng)
+
+        def settle(data, pks, index, balances):
+            """
+            : 收/付款金额不超过账单剩余的未结算金额，账单结清后从pool中移除
+            """
+            l, remaining = balances
+            parent_id = pks[index]
+            amount = min(data[l.amount_field], remaining[parent_id])
+            data[l.amount_field] = amount
+            remaining[parent_id] -= amount
+            if not remaining[parent_id]:
+                pks[index] = pks[-1]
+                pks.pop()
+
+        def build():
+            data = {}
+            settlements = []
+            for field_name, fake_type in cls.faker_fields.items():
+                if field_name in pools:
+                    attname, pks, one_to_one, balances = pools[field_name]
+                    if not pks:
+                        data[attname] = None
+                    elif one_to_one:
+                        data[attname] = pks.pop()
                     else:
-                        data[field_name] = getattr(fake, fake_type)()
-                try:
-                    cls.objects.create(**data)
-                except IntegrityError:
-                    continue
-            #     fake_objs.append(cls(**data))
-            # cls.objects.bulk_create(fake_objs)
+                        index = rng.randrange(len(pks))
+                        data[attname] = pks[index]
+                        if balances is not None:
+                            settlements.append((pks, index, balances))
+                elif isinstance(fake_type, tuple):
+                    provider, kwargs = fake_type
+                    data[field_name] = getattr(fake, provider)(**kwargs)
+                else:
+                    data[field_name] = getattr(fake, fake_type)()
+            # amount可能在关联字段之后生成，所以在所有字段生成之后处理
+            for settlement in settlements:
+                settle(data, *settlement)
+            return cls(**data)
+
+        created = 0
+        while created < count:
+            objs = [build() for _ in range(min(batch_size, count - created))]
+            with transaction.atomic():
+                # bulk_create不发送signal，由ledger设置unsettled_amount
+                for l in ledger.get_ledgers():
+                    l.prepare_bulk_create(cls, objs)
+                cls.objects.bulk_create(objs)
+            created += len(objs)
+        caching.bump_version(cls)
+        return created
 
 
 class Continent(FakerMixin, CommonFieldMixin):
@@ -237,6 +329,7 @@ class Client(FakerMixin, CommonFieldMixin, DescriptionFieldMixin):
 
     modelform_class = 'base.forms.ClientModelForm'
     datatables_class = 'base.datatables.ClientDataTable'
+    detail_select_related = ('country',)
     related_entity_config = {
         'case.case': {
             'query_path': 'client',
@@ -323,6 +416,7 @@ class Trademark(CommonFieldMixin, DescriptionFieldMixin):
 
     modelform_class = 'base.forms.TrademarkModelForm'
     datatables_class = 'base.datatables.TrademarkDataTable'
+    detail_select_related = ('client',)
     related_entity_config = {
         'base.trademarknation': {
             'query_path': 'trademark',
@@ -395,6 +489,7 @@ class TrademarkNation(CommonFieldMixin, DescriptionFieldMixin):
 
     modelform_class = 'base.forms.TrademarkNationModelForm'
     datatables_class = 'base.datatables.TrademarkNationDataTable'
+    detail_select_related = ('trademark__client', 'country')
     related_entity_config = {
         'case.subcase': {
             'query_path': 'trademarknation',
@@ -489,6 +584,7 @@ class TrademarkNationNice(CommonFieldMixin, DescriptionFieldMixin):
 
     modelform_class = 'base.forms.TrademarkNationNiceModelForm'
     datatables_class = 'base.datatables.TrademarkNationNiceDataTable'
+    detail_select_related = ('nice_class', 'trademarknation__trademark', 'trademarknation__country')
     related_entity_config = {}
 
     class Meta:
@@ -496,7 +592,7 @@ class TrademarkNationNice(CommonFieldMixin, DescriptionFieldMixin):
         verbose_name_plural = '分类商品/服务指定'
 
     def __str__(self):
-        return '{}-{}'.format(self.nice_class, self.trademark_nation)
+        return '{}-{}'.format(self.nice_class, self.trademarknation)
 
     def get_absolute_url(self):
         return reverse('trademarknation:detail', kwargs={'trademarknation_id': self.id})
@@ -544,6 +640,7 @@ class Pattern(CommonFieldMixin, DescriptionFieldMixin):
 
     modelform_class = 'base.forms.PatternModelForm'
     datatables_class = 'base.datatables.PatternDataTable'
+    detail_select_related = ('client',)
     related_entity_config = {
         'base.patternnation': {
             'query_path': 'pattern',
@@ -620,6 +717,7 @@ class PatternNation(CommonFieldMixin, DescriptionFieldMixin):
 
     modelform_class = 'base.forms.PatternNationModelForm'
     datatables_class = 'base.datatables.PatternNationDataTable'
+    detail_select_related = ('pattern__client', 'country')
     related_entity_config = {
         'case.subcase': {
             'query_path': 'patternnation',
@@ -32,8 +32,95 @@ $.fn.dataTable.ext.buttons.cms_colvis = {
     text: '选择显示列',
 };
 
+// 按照当前的搜索，排序以及show_disabled条件导出全部数据
+function _export_action(format) {
+    return function(e, dt, node, config) {
+        var params = $.extend({}, dt.ajax.params(), {"export": format});
+        var url = dt.ajax.url() || window.location.pathname;
+        window.location.href = url + (url.indexOf('?') < 0 ? '?' : '&') + $.param(params);
+    };
+}
+
+$.fn.dataTable.ext.buttons.cms_export_csv = {
+    "text": '导出CSV',
+    "action": _export_action('csv'),
+    "className": 'btn-datatables'
+};
+
+$.fn.dataTable.ext.buttons.cms_export_xlsx = {
+    "text": '导出Excel',
+    "action": _export_action('xlsx'),
+    "className": 'btn-datatables'
+};
+
 $.fn.select2.defaults.set("theme", "bootstrap");
 
+// 带有data-remote-url属性的select(utils.widgets.RemoteSelect)通过ajax分页加载选项
+function _select2_options(select) {
+    var url = $(select).data('remote-url');
+    if (!url) {
+        return {};
+    }
+    return {
+        "ajax": {
+            "url": url,
+            "dataType": 'json',
+            "delay": 250,
+            "cache": true,
+            "data": function(params) {
+                return {"term": params.term || '', "page": params.page || 1};
+            }
+        }
+    };
+}
+
 $(document).ready(function() {
-    $("select").select2();
-});
\ No newline at end of file
+    $("select").each(function() {
+        $(this).select2(_select2_options(this));
+    });
+});
+function _get_cookie(name) {
+    var match = document.cookie.match(new RegExp('(?:^|; )' + name + '=([^;]*)'));
+    return match ? decodeURIComponent(match[1]) : null;
+}
+
+// 批量删除，url为各model的bulk_disable url，pks为DataTables中选中行的id
+// 返回{"disabled": [pk], "errors": [{"pk": pk, "message": 错误信息}]}
+function cms_bulk_disable(url, pks) {
+    return $.ajax({
+        "url": url,
+        "type": 'POST',
+        "traditional": true,
+        "data": {"pk": pks},
+        "dataType": 'json',
+        "headers": {"X-CSRFToken": _get_cookie('csrftoken')}
+    });
+}
+
+// 批量删除选中行，选中行由dt_jsscript.html中的Ctrl+点击设置
+// 在按钮config中指定url: {"extend": 'cms_bulk_disable', "url": bulk_disable url}
+$.fn.dataTable.ext.buttons.cms_bulk_disable = {
+    "text": '删除选中项',
+    "action": function(e, dt, node, config) {
+        var pks = dt.rows('.selected').ids().toArray();
+        if (pks.length === 0) {
+            alert('请按住Ctrl点击选择要删除的行');
+            return;
+        }
+        if (!confirm('确定删除选中的' + pks.length + '项?')) {
+            return;
+        }
+        cms_bulk_disable(config.url, pks).done(function(result) {
+            if (result.errors.length > 0) {
+                alert($.map(result.errors, function(error) {
+                    return error.pk + ': ' + error.message;
+                }).join('\n'));
+            }
+            // 保持当前页
+            dt.ajax.reload(null, false);
+        }).fail(function(xhr) {
+            alert('删除失败: ' + xhr.status);
+        });
+    },
+    "className": 'btn-datatables'
+};
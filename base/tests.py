@@ -15,3 +15,148 @@ class ProfileModelTestCase(TestCase):
         )
         profile = Profile.objects.get(user_id=user.id)
         self.assertIsNotNone(profile)
+
+
+class ClientDisableViewTestCase(TestCase):
+    def setUp(self):
+        from base.models import Client
+        self.client_obj = Client.objects.create(name='client')
+
+    def _validate(self):
+        from django.core.exceptions import ValidationError
+        from base.views import ClientDisableView
+        view = ClientDisableView()
+        view.object = self.client_obj
+        try:
+            with self.assertNumQueries(1):
+                view.validate()
+        except ValidationError as e:
+            return e.messages
+        return []
+
+    def test_disabled_dependents_are_ignored(self):
+        from case.models import Case
+        Case.objects.create(name='disabled', client=self.client_obj, enabled=False)
+        self.assertEqual(self._validate(), [])
+
+    def test_first_guard_with_enabled_dependent(self):
+        from case.models import Case, SubCase
+        SubCase.objects.create(name='subcase', agent=self.client_obj)
+        self.assertEqual(self._validate(), ['不能删除该客户：该客户具有关联的代理分案'])
+        Case.objects.create(name='case', client=self.client_obj)
+        self.assertEqual(self._validate(), ['不能删除该客户：该客户具有关联的案件'])
+
+
+class ClientListBulkDisableTestCase(TestCase):
+    def test_bulk_disable_button(self):
+        from django.contrib.auth.models import User
+        from django.urls import reverse
+        self.client.force_login(User.objects.create_user('test_user', 'test_user@test.com', 'testpassword'))
+        response = self.client.get(reverse('client:list'), HTTP_HOST='localhost')
+        self.assertEqual(response.context['bulk_disable_url'], reverse('client:bulk_disable'))
+        self.assertContains(response, "\"extend\": 'cms_bulk_disable', \"url\": \"{}\"".format(
+            reverse('client:bulk_disable')))
+
+
+class QueryInstrumentationMiddlewareTestCase(TestCase):
+    def _request(self, view, **settings):
+        from django.test import RequestFactory, override_settings
+        from base.middleware import QueryInstrumentationMiddleware
+        request = RequestFactory().get('/')
+        middleware = QueryInstrumentationMiddleware()
+        with override_settings(**settings):
+            middleware.process_request(request)
+            middleware.process_view(request, view, (), {})
+            return middleware.process_response(request, view(request))
+
+    def _view(self, count):
+        from django.http import HttpResponse
+        from base.models import Client
+
+        def view(request):
+            for i in range(count):
+                list(Client.objects.filter(pk=i))
+            return HttpResponse()
+        return view
+
+    def test_server_timing(self):
+        with self.assertLogs('base.middleware', 'INFO') as logs:
+            response = self._request(self._view(3))
+        self.assertIn('db;dur=', response['Server-Timing'])
+        self.assertIn('desc="3 queries"', response['Server-Timing'])
+        self.assertIn('dup;desc="2 duplicated"', response['Server-Timing'])
+        self.assertIn('"queries": 3', logs.output[0])
+
+    def test_query_budget(self):
+        from base.middleware import query_budget, QueryBudgetExceeded
+        view = query_budget(2)(self._view(3))
+        with self.assertLogs('base.middleware', 'WARNING'):
+            self._request(view, QUERY_BUDGET_STRICT=False)
+        with self.assertRaises(QueryBudgetExceeded):
+            self._request(view, QUERY_BUDGET_STRICT=True)
+        self._request(query_budget({'POST': 2})(self._view(3)), QUERY_BUDGET_STRICT=True)
+
+
+class ProfilingMiddlewareTestCase(TestCase):
+    def setUp(self):
+        from django.contrib.auth.models import User
+        self.staff = User.objects.create_user('staff', 'staff@test.com', 'testpassword', is_staff=True)
+        self.user = User.objects.create_user('user', 'user@test.com', 'testpassword')
+
+    def _request(self, user, path='/', **settings):
+        from django.test import RequestFactory, override_settings
+        from django.http import HttpResponse
+        from base.middleware import ProfilingMiddleware
+        from base.models import Client
+
+        def view(request):
+            list(Client.objects.all())
+            return HttpResponse()
+        request = RequestFactory().get(path)
+        request.user = user
+        middleware = ProfilingMiddleware()
+        with override_settings(**settings):
+            middleware.process_request(request)
+            middleware.process_view(request, view, (), {})
+            response = middleware.process_response(request, view(request))
+        # 与WSGI server相同，response.close()时保存
+        response.close()
+
+    def test_staff_flag(self):
+        import marshal
+        from utils.models import RequestProfile
+        self._request(self.user, '/?_profile')
+        self.assertFalse(RequestProfile.objects.exists())
+        self._request(self.staff, '/?_profile')
+        profile = RequestProfile.objects.get()
+        self.assertEqual(profile.trigger, 'flag')
+        self.assertEqual(profile.path, '/?_profile')
+        self.assertTrue(profile.view.endswith('.view'))
+        self.assertEqual(profile.query_count, 1)
+        self.assertEqual(profile.user, self.staff)
+        # pstats格式
+        self.assertIsInstance(marshal.loads(bytes(profile.profile)), dict)
+
+    def test_slow_request_sampling(self):
+        from utils.models import RequestProfile
+        self._request(self.user, PROFILE_SLOW_REQUEST_THRESHOLD=60000)
+        self.assertFalse(RequestProfile.objects.exists())
+        self._request(self.user, PROFILE_SLOW_REQUEST_THRESHOLD=0, PROFILE_KEEP=1)
+        self._request(self.user, PROFILE_SLOW_REQUEST_THRESHOLD=0, PROFILE_KEEP=1)
+        profile = RequestProfile.objects.get()
+        self.assertEqual((profile.trigger, profile.profile_format), ('slow', 'collapsed'))
+
+    def test_download_staff_only(self):
+        from django.urls import reverse
+        from utils.models import RequestProfile
+        self._request(self.staff, '/?_profile')
+        profile = RequestProfile.objects.get()
+        url = reverse('utils:profile_download', args=[profile.pk])
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(url, HTTP_HOST='localhost').status_code, 403)
+        self.client.force_login(self.staff)
+        response = self.client.get(url, HTTP_HOST='localhost')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="{}"'.format(profile.get_filename()))
+        self.assertTrue(profile.get_filename().endswith('.prof'))
+        response = self.client.get(reverse('utils:profile_list'), HTTP_HOST='localhost')
+        self.assertContains(response, url)
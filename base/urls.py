@@ -8,7 +8,8 @@ client_urlpatterns = [
     url(r'^$', views.ClientListView.as_view(), name='list'),
     url(r'^(?P<client_id>\d+)/$', views.ClientRelatedEntityView.as_view(), name='detail'),
     url(r'^create/$', views.ClientCreateView.as_view(), name='create'),
-    url(r'^disable/(?P<client_id>\d+)/$', views.ClientDisableView.as_view(), name='disable')
+    url(r'^disable/(?P<client_id>\d+)/$', views.ClientDisableView.as_view(), name='disable'),
+    url(r'^disable/$', views.ClientDisableView.as_view(), name='bulk_disable'),
 ]
 
 trademark_urlpatterns = [
@@ -16,6 +17,7 @@ trademark_urlpatterns = [
     url(r'^(?P<trademark_id>\d+)/$', views.TrademarkRelatedEntityView.as_view(), name='detail'),
     url(r'^create/$', views.TrademarkCreateView.as_view(), name='create'),
     url(r'^disable/(?P<trademark_id>\d+)/$', views.TrademarkDisableView.as_view(), name='disable'),
+    url(r'^disable/$', views.TrademarkDisableView.as_view(), name='bulk_disable'),
 ]
 
 trademarknation_urlpatterns = [
@@ -23,6 +25,7 @@ trademarknation_urlpatterns = [
     url(r'^(?P<trademarknation_id>\d+)/$', views.TrademarkNationRelatedEntityView.as_view(), name='detail'),
     url(r'^create/$', views.TrademarkNationCreateView.as_view(), name='create'),
     url(r'^disable/(?P<trademarknation_id>\d+)/$', views.TrademarkNationDisableView.as_view(), name='disable'),
+    url(r'^disable/$', views.TrademarkNationDisableView.as_view(), name='bulk_disable'),
 ]
 
 trademarknationnice_urlpatterns = [
@@ -36,6 +39,7 @@ trademarknationnice_urlpatterns = [
         views.TrademarkNationNiceDisableView.as_view(),
         name='disable'
     ),
+    url(r'^disable/$', views.TrademarkNationNiceDisableView.as_view(), name='bulk_disable'),
 ]
 
 pattern_urlpatterns = [
@@ -43,6 +47,7 @@ pattern_urlpatterns = [
     url(r'^(?P<pattern_id>\d+)/$', views.PatternRelatedEntityView.as_view(), name='detail'),
     url(r'^create/$', views.PatternCreateView.as_view(), name='create'),
     url(r'^disable/(?P<pattern_id>\d+)/$', views.PatternDisableView.as_view(), name='disable'),
+    url(r'^disable/$', views.PatternDisableView.as_view(), name='bulk_disable'),
 ]
 
 patternnation_urlpatterns = [
@@ -50,6 +55,7 @@ patternnation_urlpatterns = [
     url(r'^(?P<patternnation_id>\d+)/$', views.PatternNationRelatedEntityView.as_view(), name='detail'),
     url(r'^create/$', views.PatternNationCreateView.as_view(), name='create'),
     url(r'^disable/(?P<patternnation_id>\d+)/$', views.PatternNationDisableView.as_view(), name='disable'),
+    url(r'^disable/$', views.PatternNationDisableView.as_view(), name='bulk_disable'),
 ]
 
 urlpatterns = [
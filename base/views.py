@@ -1,9 +1,12 @@
+from collections import OrderedDict
+
 from django.views import generic
-from django.core.exceptions import ValidationError
 from django.apps import apps
 
+from utils import counts
 from utils.views import DataTablesListView, InfoboxMixin, ConfiguredModelFormMixin,\
     RelatedEntityView, DisablementView, FormMessageMixin
+from utils.widgets import set_scope
 
 from . import models, datatables
 from case import models as case_models
@@ -13,6 +16,7 @@ from case import models as case_models
 
 class IndexView(generic.TemplateView):
     template_name = 'base/index.html'
+    query_budget = 8
     # view_name = 'index'
     infobox_list = ['base.client', 'case.case', 'case.subcase',
                     'base.trademark', 'base.trademarknation',
@@ -23,11 +27,13 @@ class IndexView(generic.TemplateView):
 
     def get_context_data(self, **kwargs):
         info = dict()
-        for entity_name in self.infobox_list:
-            model = apps.get_model(entity_name)
-            model_name = model._meta.model_name
-            info[model_name] = dict()
-            info[model_name]['count'] = model.enabled_objects.count()
+        models = [apps.get_model(entity_name) for entity_name in self.infobox_list]
+        # 所有计数在一条查询中完成，并按照model的变化缓存
+        info_counts = counts.count_many(
+            OrderedDict((model._meta.model_name, model.enabled_objects) for model in models)
+        )
+        for model_name, count in info_counts.items():
+            info[model_name] = {'count': count}
 
         kwargs.update(info=info)
 
@@ -56,19 +62,10 @@ class ClientCreateView(FormMessageMixin, ConfiguredModelFormMixin, generic.Creat
 class ClientDisableView(DisablementView):
     model = models.Client
     pk_url_kwarg = 'client_id'
-
-    def validate(self):
-        if any(case.enabled for case in self.object.case_set.all()):
-            raise ValidationError(
-                '不能删除该客户：该客户具有关联的案件',
-                code='invalid'
-            )
-        if any(ac.enabled for ac in self.object.agent_subcase.all()):
-            raise ValidationError(
-                '不能删除该客户：该客户具有关联的代理分案',
-                code='invalid'
-            )
-        super().validate()
+    dependency_guards = (
+        ('case_set', '不能删除该客户：该客户具有关联的案件'),
+        ('agent_subcase', '不能删除该客户：该客户具有关联的代理分案'),
+    )
 
 
 class TrademarkListView(DataTablesListView):
@@ -110,19 +107,10 @@ class TrademarkCreateView(FormMessageMixin, ConfiguredModelFormMixin, generic.Cr
 class TrademarkDisableView(DisablementView):
     model = models.Trademark
     pk_url_kwarg = 'trademark_id'
-
-    def validate(self):
-        if any(case.enabled for case in self.object.case_set.all()):
-            raise ValidationError(
-                '不能删除该商标：该商标具有关联的案件',
-                code='invalid'
-            )
-
-        if any(tmn.enabled for tmn in self.object.trademarknation_set.all()):
-            raise ValidationError(
-                '不能删除该商标：该商标具有关联的商标国家注册',
-                code='invalid'
-            )
+    dependency_guards = (
+        ('case_set', '不能删除该商标：该商标具有关联的案件'),
+        ('trademarknation_set', '不能删除该商标：该商标具有关联的商标国家注册'),
+    )
 
 
 class TrademarkNationListView(DataTablesListView):
@@ -142,7 +130,7 @@ class TrademarkNationRelatedEntityView(RelatedEntityView):
         if self.current_entity_name == 'case.subcase':
             # 在subcase create form中
             # case的取值范围应该是trademarknation对应trademark的case_set
-            form.fields['case'].queryset = self.main_object.trademark.case_set
+            set_scope(form.fields['case'], trademark_id=self.main_object.trademark_id)
 
             # 将category范围限制在trademark相关category
             form.fields['category'].choices = case_models.Category.get_choices(parent=1)
@@ -158,20 +146,11 @@ class TrademarkNationCreateView(FormMessageMixin, ConfiguredModelFormMixin, gene
 class TrademarkNationDisableView(DisablementView):
     model = models.TrademarkNation
     pk_url_kwarg = 'trademarknation_id'
-
-    def validate(self):
-        if any(subcase.enabled for subcase in self.object.subcase_set.all()):
-            raise ValidationError(
-                '不能删除该商标-国家：该商标-国家具有关联的分案',
-                code='invalid'
-            )
-
-    def disable(self):
-        # 首先将所有相关联的trademarknationnice disable
-        for tmnn in self.object.trademarknationnice_set.filter(enabled=True).all():
-            tmnn.enabled = False
-            tmnn.save()
-        super().disable()
+    dependency_guards = (
+        ('subcase_set', '不能删除该商标-国家：该商标-国家具有关联的分案'),
+    )
+    # 将所有相关联的trademarknationnice一起disable
+    cascade_disable = ('trademarknationnice_set', )
 
 
 class TrademarkNationNiceRelatedEntityView(RelatedEntityView):
@@ -225,19 +204,10 @@ class PatternCreateView(FormMessageMixin, ConfiguredModelFormMixin, generic.Crea
 class PatternDisableView(DisablementView):
     model = models.Pattern
     pk_url_kwarg = 'pattern_id'
-
-    def validate(self):
-        if any(case.enabled for case in self.object.case_set.all()):
-            raise ValidationError(
-                '不能删除该专利：该专利具有关联的案件',
-                code='invalid'
-            )
-
-        if any(pn.enabled for pn in self.object.patternnation_set.all()):
-            raise ValidationError(
-                '不能删除该专利：该商标具有关联的专利国家注册',
-                code='invalid'
-            )
+    dependency_guards = (
+        ('case_set', '不能删除该专利：该专利具有关联的案件'),
+        ('patternnation_set', '不能删除该专利：该专利具有关联的专利国家注册'),
+    )
 
 
 class PatternNationListView(DataTablesListView):
@@ -257,7 +227,7 @@ class PatternNationRelatedEntityView(RelatedEntityView):
         if self.current_entity_name == 'case.subcase':
             # 在subcase create form中
             # case的取值范围应该是patternnation对应pattern的case_set
-            form.fields['case'].queryset = self.main_object.pattern.case_set
+            set_scope(form.fields['case'], pattern_id=self.main_object.pattern_id)
             # 将category范围限制在pattern相关category
             form.fields['category'].choices = case_models.Category.get_choices(parent=2)
 
@@ -272,10 +242,6 @@ class PatternNationCreateView(FormMessageMixin, ConfiguredModelFormMixin, generi
 class PatternNationDisableView(DisablementView):
     model = models.PatternNation
     pk_url_kwarg = 'patternnation_id'
-
-    def validate(self):
-        if any(subcase.enabled for subcase in self.object.subcase_set.all()):
-            raise ValidationError(
-                '不能删除该专利-国家：该专利-国家具有关联的分案',
-                code='invalid'
-            )
+    dependency_guards = (
+        ('subcase_set', '不能删除该专利-国家：该专利-国家具有关联的分案'),
+    )
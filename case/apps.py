@@ -1,5 +1,19 @@
 from django.apps import AppConfig
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete
+
+from utils.signals import post_bulk_disable
 
 
 class CaseConfig(AppConfig):
     name = 'case'
+
+    def ready(self):
+        from . import balance
+        # 维护SubCaseBalance
+        pre_save.connect(balance.collect_contributions, dispatch_uid='case.balance.pre_save')
+        post_save.connect(balance.update_contributions, dispatch_uid='case.balance.post_save')
+        pre_delete.connect(balance.collect_contributions, dispatch_uid='case.balance.pre_delete')
+        post_delete.connect(balance.update_contributions, dispatch_uid='case.balance.post_delete')
+        post_bulk_disable.connect(balance.update_bulk_disabled, dispatch_uid='case.balance.post_bulk_disable')
+        post_save.connect(balance.create_subcase_balance, sender=self.get_model('SubCase'),
+                          dispatch_uid='case.balance.create_subcase_balance')
@@ -0,0 +1,342 @@
+# -*- coding: utf-8 -*-
+
+"""
+分案件收支(人民币)汇总
+
+使用数据库的聚合查询，一次计算多个分案件的
+receipts_sum_cny, payment_sum_cny, paymentlink_sum_cny, income_sum_cny, expense_sum_cny，
+查询数量固定，与分案件以及收付款的数量无关
+
+SubCaseBalance的增量维护与utils.ledger相同:
+收付款等记录保存前后分别查询这一行对各分案件汇总的贡献，使用F()表达式更新两者的差值，
+不需要锁定SubCaseBalance行，也不需要重新汇总整个分案件
+"""
+
+from decimal import Decimal
+
+from django.apps import apps
+from django.core.exceptions import ObjectDoesNotExist
+from django.db.models import Case, When, F, Sum, Value, DecimalField, ExpressionWrapper
+from django.db.models.functions import Cast, Coalesce
+
+BALANCE_FIELDS = (
+    'receipts_sum_cny', 'payment_sum_cny', 'paymentlink_sum_cny',
+    'income_sum_cny', 'expense_sum_cny',
+)
+
+_DECIMAL = DecimalField(max_digits=20, decimal_places=6)
+_ZERO = Value(Decimal('0'), output_field=_DECIMAL)
+
+
+def _multiply(amount, rate):
+    return ExpressionWrapper(F(amount) * F(rate), output_field=_DECIMAL)
+
+
+def _amount_cny(amount='amount', rate='exchange_rate', currency='currency_id'):
+    """
+    : 与各model的amount_cny属性相同: 人民币直接使用amount，否则乘以汇率
+    """
+    return Case(
+        When(**{currency: 'CNY', 'then': F(amount)}),
+        default=_multiply(amount, rate),
+        output_field=_DECIMAL,
+    )
+
+
+def _sum(expression):
+    return Coalesce(Sum(expression, output_field=_DECIMAL), _ZERO)
+
+
+def _get_parts():
+    """
+    : 汇总的各个组成部分，每一部分的每一行只属于一个model实例，保存时可以单独查询这一行的贡献
+    : name -> (model, 分案件路径, 汇总字段, 符号, 金额, enabled条件, 来源)
+    :   enabled条件: model label -> 条件路径，这些model的实例被禁用时这一行不再计入
+    :   来源: model label -> 指向该model pk的路径，这些model的实例变化时这一行的金额或分案件可能变化
+    """
+    Receipts = apps.get_model('sale', 'Receipts')
+    Payment = apps.get_model('purchase', 'Payment')
+    PaymentLink = apps.get_model('purchase', 'PaymentLink')
+    Income = apps.get_model('income', 'Income')
+    Expense = apps.get_model('expense', 'Expense')
+    return {
+        # 收款金额(人民币)减去转账手续费
+        'receipts': (
+            Receipts, 'receivable__subcase_id', 'receipts_sum_cny', 1, _amount_cny(),
+            {'sale.receipts': 'enabled'},
+            {'sale.receipts': 'pk', 'sale.receivable': 'receivable_id'},
+        ),
+        'receipts_charge': (
+            Expense, 'receipts__receivable__subcase_id', 'receipts_sum_cny', -1, F('amount'),
+            {'sale.receipts': 'receipts__enabled'},
+            {'expense.expense': 'pk', 'sale.receipts': 'receipts_id', 'sale.receivable': 'receipts__receivable_id'},
+        ),
+        # 付款未转移金额乘以汇率，加上转账手续费
+        'payment': (
+            Payment, 'payable__subcase_id', 'payment_sum_cny', 1, _multiply('amount', 'exchange_rate'),
+            {'purchase.payment': 'enabled'},
+            {'purchase.payment': 'pk', 'purchase.payable': 'payable_id'},
+        ),
+        'payment_charge': (
+            Expense, 'payment__payable__subcase_id', 'payment_sum_cny', 1, F('amount'),
+            {'purchase.payment': 'payment__enabled'},
+            {'expense.expense': 'pk', 'purchase.payment': 'payment_id', 'purchase.payable': 'payment__payable_id'},
+        ),
+        # 已经转移到其他分案件的付款金额
+        'payment_linked': (
+            PaymentLink, 'payment__payable__subcase_id', 'payment_sum_cny', -1,
+            _multiply('amount', 'payment__exchange_rate'),
+            {'purchase.paymentlink': 'enabled', 'purchase.payment': 'payment__enabled'},
+            {'purchase.paymentlink': 'pk', 'purchase.payment': 'payment_id', 'purchase.payable': 'payment__payable_id'},
+        ),
+        'paymentlink': (
+            PaymentLink, 'subcase_id', 'paymentlink_sum_cny', 1,
+            _amount_cny(rate='payment__exchange_rate', currency='payment__currency_id'),
+            {'purchase.paymentlink': 'enabled'},
+            {'purchase.paymentlink': 'pk', 'purchase.payment': 'payment_id'},
+        ),
+        'income': (
+            Income, 'subcase_id', 'income_sum_cny', 1, _amount_cny(),
+            {'income.income': 'enabled'},
+            {'income.income': 'pk'},
+        ),
+        'expense': (
+            Expense, 'subcase_id', 'expense_sum_cny', 1, _amount_cny(),
+            {'expense.expense': 'enabled'},
+            {'expense.expense': 'pk'},
+        ),
+    }
+
+
+# 变化时会影响分案件收支汇总的model
+BALANCE_SOURCE_MODELS = (
+    'sale.receivable', 'sale.receipts', 'purchase.payable', 'purchase.payment', 'purchase.paymentlink',
+    'income.income', 'expense.expense',
+)
+
+
+def _empty_balance():
+    return {f: Decimal('0') for f in BALANCE_FIELDS}
+
+
+def _sum_parts(part_filters, exclude_enabled=None):
+    """
+    : 按照分案件汇总指定的组成部分，各部分的分组查询使用UNION ALL合并为一条查询
+    :param part_filters: dict, part name -> filter kwargs
+    :param exclude_enabled: model label, 不检查这个model的enabled条件(用于计算已被禁用的实例原来的贡献)
+    :return: dict, subcase pk -> {field: Decimal}, 只包含有记录的分案件
+    """
+    if not part_filters:
+        return {}
+    parts = _get_parts()
+    # 每一部分的查询结果为(分案件, 各部分的金额)，不属于这一部分的列为0
+    columns = ['part_{}'.format(name) for name in part_filters]
+    querysets = []
+    for name, filters in part_filters.items():
+        model, path, field, sign, amount, enabled, _ = parts[name]
+        conditions = {lookup: True for label, lookup in enabled.items() if label != exclude_enabled}
+        queryset = model.objects.filter(**conditions).filter(**filters).filter(**{path + '__isnull': False})
+        # sqlite中Decimal参数以字符串传递，使用CAST转换为数值
+        annotations = {column: Cast(Value(0), _DECIMAL) for column in columns}
+        annotations['part_{}'.format(name)] = _sum(amount)
+        querysets.append(queryset.order_by().values(path).annotate(**annotations).values_list(path, *columns))
+    rows = querysets[0].union(*querysets[1:], all=True) if len(querysets) > 1 else querysets[0]
+
+    balances = {}
+    for pk, *amounts in rows:
+        balance = balances.setdefault(pk, _empty_balance())
+        for name, value in zip(part_filters, amounts):
+            field, sign = parts[name][2], parts[name][3]
+            balance[field] += sign * Decimal(value)
+    return balances
+
+
+def get_subcase_balances(subcase_ids):
+    """
+    : 计算分案件的收支汇总
+    : 各项的计算方式与SubCase中原有的逐行计算相同:
+    :   receipts_sum_cny: 收款金额(人民币)减去转账手续费
+    :   payment_sum_cny: 付款未转移金额乘以汇率，加上转账手续费
+    :   paymentlink_sum_cny, income_sum_cny, expense_sum_cny: 金额(人民币)
+    :param subcase_ids: list of SubCase pk
+    :return: dict, subcase pk -> {field: Decimal}
+    """
+    subcase_ids = list(subcase_ids)
+    balances = {pk: _empty_balance() for pk in subcase_ids}
+    if not subcase_ids:
+        return balances
+    part_filters = {
+        name: {'{}__in'.format(part[1]): subcase_ids} for name, part in _get_parts().items()
+    }
+    balances.update(_sum_parts(part_filters))
+    return balances
+
+
+def attach_balances(subcases):
+    """
+    : 将汇总结果设置到SubCase实例的cached_property中
+    :param subcases: list of SubCase
+    :return: subcases
+    """
+    balances = get_subcase_balances(subcase.pk for subcase in subcases)
+    for subcase in subcases:
+        subcase.__dict__['balance_sums'] = balances[subcase.pk]
+    return subcases
+
+
+def get_net_amount(balance):
+    """
+    : 分案件的收支净额(人民币)
+    """
+    return (balance['receipts_sum_cny'] + balance['income_sum_cny']
+            - (balance['payment_sum_cny'] + balance['expense_sum_cny'] + balance['paymentlink_sum_cny']))
+
+
+def _get_transfer_charge_amount(obj):
+    # 没有指定手续费时为0，与聚合查询中的Coalesce相同
+    try:
+        return obj.transfer_charge.amount
+    except ObjectDoesNotExist:
+        return Decimal('0')
+
+
+def get_subcase_balances_by_rows(subcases):
+    """
+    : 逐行计算分案件的收支汇总，与SubCase中原有的*_sum_cny属性的计算方式相同
+    : 不使用get_subcase_balances()的聚合查询，用于subcase_balance verify检查汇总结果
+    :param subcases: SubCase queryset
+    :return: dict, subcase pk -> {field: Decimal}
+    """
+    balances = {}
+    subcases = subcases.prefetch_related(
+        'receivable_set__receipts_set__transfer_charge',
+        'payable_set__payment_set__transfer_charge',
+        'payable_set__payment_set__paymentlink_set',
+        'paymentlink_set__payment',
+        'income_set',
+        'expense_set',
+    )
+    for subcase in subcases:
+        balances[subcase.pk] = {
+            'receipts_sum_cny': sum(
+                (rt.amount_cny - _get_transfer_charge_amount(rt) for rt in subcase.receipts_iter), Decimal('0')
+            ),
+            'payment_sum_cny': sum(
+                (pm.unlinked_amount_cny + _get_transfer_charge_amount(pm) for pm in subcase.payment_iter),
+                Decimal('0')
+            ),
+            'paymentlink_sum_cny': sum(
+                (link.amount_cny for link in subcase.paymentlink_set.all() if link.enabled), Decimal('0')
+            ),
+            'income_sum_cny': sum(
+                (income.amount_cny for income in subcase.income_set.all() if income.enabled), Decimal('0')
+            ),
+            'expense_sum_cny': sum(
+                (expense.amount_cny for expense in subcase.expense_set.all() if expense.enabled), Decimal('0')
+            ),
+        }
+    return balances
+
+
+def get_contributions(label, pks, exclude_enabled=False):
+    """
+    : 查询model实例当前对各分案件收支汇总的贡献
+    :param label: model label, 例如'sale.receipts'
+    :param pks: list of model pk
+    :param exclude_enabled: 为True时只查询受该model enabled影响的部分，并且不检查其enabled，
+    :                       即被禁用之前的贡献
+    :return: dict, subcase pk -> {field: Decimal}
+    """
+    part_filters = {}
+    for name, part in _get_parts().items():
+        enabled, sources = part[5], part[6]
+        if label not in sources or (exclude_enabled and label not in enabled):
+            continue
+        part_filters[name] = {'{}__in'.format(sources[label]): pks}
+    return _sum_parts(part_filters, exclude_enabled=label if exclude_enabled else None)
+
+
+def apply_deltas(deltas):
+    """
+    : 使用一条UPDATE语句，以F()表达式更新各分案件的SubCaseBalance
+    : 没有SubCaseBalance行的分案件(例如bulk_create创建的分案件)重新汇总后创建
+    :param deltas: dict, subcase pk -> {field: 变化量}
+    """
+    SubCaseBalance = apps.get_model('case', 'SubCaseBalance')
+
+    deltas = {pk: delta for pk, delta in deltas.items() if any(delta.values())}
+    if not deltas:
+        return
+    for delta in deltas.values():
+        delta['net_amount_cny'] = get_net_amount(delta)
+    updates = {}
+    for field in BALANCE_FIELDS + ('net_amount_cny',):
+        changes = {pk: delta[field] for pk, delta in deltas.items() if delta[field]}
+        if not changes:
+            continue
+        if len(deltas) == 1:
+            expression = Value(changes[next(iter(deltas))], output_field=_DECIMAL)
+        else:
+            expression = Case(
+                *[When(subcase_id=pk, then=Value(change)) for pk, change in changes.items()],
+                default=_ZERO, output_field=_DECIMAL
+            )
+        updates[field] = F(field) + expression
+    updated = SubCaseBalance.objects.filter(subcase_id__in=list(deltas)).update(**updates)
+    if updated < len(deltas):
+        existing = set(SubCaseBalance.objects.filter(subcase_id__in=list(deltas)).values_list('subcase_id', flat=True))
+        missing = [pk for pk in deltas if pk not in existing]
+        for pk, balance in get_subcase_balances(missing).items():
+            SubCaseBalance.objects.get_or_create(
+                subcase_id=pk, defaults=dict(balance, net_amount_cny=get_net_amount(balance))
+            )
+
+
+def _subtract(deltas, balances):
+    for pk, balance in balances.items():
+        delta = deltas.setdefault(pk, _empty_balance())
+        for field, value in balance.items():
+            delta[field] -= value
+    return deltas
+
+
+def collect_contributions(sender, instance, **kwargs):
+    """
+    : pre_save/pre_delete的receiver，记录修改之前的贡献
+    """
+    label = sender._meta.label_lower
+    if kwargs.get('raw') or label not in BALANCE_SOURCE_MODELS or instance.pk is None:
+        return
+    instance._balance_contributions = get_contributions(label, [instance.pk])
+
+
+def update_contributions(sender, instance, **kwargs):
+    """
+    : post_save/post_delete的receiver，将修改前后贡献的差值更新到SubCaseBalance
+    : 删除时SET_NULL的外键已经更新，删除之后的贡献为0
+    """
+    label = sender._meta.label_lower
+    if kwargs.get('raw') or label not in BALANCE_SOURCE_MODELS:
+        return
+    deltas = get_contributions(label, [instance.pk])
+    _subtract(deltas, getattr(instance, '_balance_contributions', {}))
+    instance._balance_contributions = {}
+    apply_deltas(deltas)
+
+
+def update_bulk_disabled(sender, pks, **kwargs):
+    """
+    : utils.signals.post_bulk_disable的receiver，从SubCaseBalance中减去被禁用的对象原来的贡献
+    """
+    label = sender._meta.label_lower
+    if label not in BALANCE_SOURCE_MODELS:
+        return
+    apply_deltas(_subtract({}, get_contributions(label, pks, exclude_enabled=True)))
+
+
+def create_subcase_balance(sender, instance, created, raw=False, **kwargs):
+    """
+    : SubCase的post_save receiver，新建的分案件没有收付款，汇总均为0
+    """
+    if created and not raw:
+        apps.get_model('case', 'SubCaseBalance').objects.get_or_create(subcase_id=instance.pk)
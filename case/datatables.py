@@ -18,3 +18,5 @@ class SubCaseDataTable(ModelDataTable):
         fields = ['name', 'settled', 'closed', 'agent__name', 'case__name',
                   'category__name', 'stage__name']
         detail_url_format = '/subcase/{}'
+        # 没有搜索条件的recordsTotal使用表统计信息，超过DATATABLES_APPROXIMATE_COUNT_THRESHOLD时生效
+        approximate_count = True
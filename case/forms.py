@@ -5,6 +5,7 @@ from django.core.exceptions import ValidationError
 
 from utils.formfield.forms import ModelFormFieldSupportMixin
 from utils.formfield.fields import ModelFormField
+from utils.widgets import RemoteSelect, register_scope, set_scope
 
 from . import models
 from base import models as base_models
@@ -23,6 +24,23 @@ class ContractModelForm(forms.ModelForm):
         }
 
 
+
+def _get_trademarknations(**kwargs):
+    return base_models.TrademarkNation.enabled_objects.select_related('trademark', 'country').filter(**kwargs)
+
+
+def _get_patternnations(**kwargs):
+    return base_models.PatternNation.enabled_objects.select_related('pattern', 'country').filter(**kwargs)
+
+
+register_scope(base_models.Client, 'agent', lambda: base_models.Client.enabled_objects.filter(is_agent=1))
+# 在trademark/pattern的页面中限定为main_object相关的case
+register_scope(models.Case, params=['trademark_id', 'pattern_id'])
+# option的文字(__str__)中使用trademark/pattern以及country
+register_scope(base_models.TrademarkNation, get_queryset=_get_trademarknations, params=['trademark_id'])
+register_scope(base_models.PatternNation, get_queryset=_get_patternnations, params=['pattern_id'])
+
+
 class SubCaseModelForm(ModelFormFieldSupportMixin, forms.ModelForm):
     js_file = 'js/subcase_form.js'
     contract = ModelFormField(
@@ -38,6 +56,12 @@ class SubCaseModelForm(ModelFormFieldSupportMixin, forms.ModelForm):
         fields = ['name', 'agent', 'case',
                   'category', 'stage', 'trademarknation', 'patternnation',
                   'closed', 'desc']
+        widgets = {
+            'agent': RemoteSelect,
+            'case': RemoteSelect,
+            'trademarknation': RemoteSelect,
+            'patternnation': RemoteSelect,
+        }
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -49,11 +73,11 @@ class SubCaseModelForm(ModelFormFieldSupportMixin, forms.ModelForm):
                 self.fields['contract'].disabled = True
 
         # 设置enabled_objects, 同时限定is_agent=1
-        self.fields['agent'].queryset = base_models.Client.enabled_objects.filter(is_agent=1)
-        self.fields['case'].queryset = models.Case.enabled_objects
+        set_scope(self.fields['agent'], 'agent')
+        set_scope(self.fields['case'])
         self.fields['stage'].queryset = models.Stage.enabled_objects
-        self.fields['trademarknation'].queryset = base_models.TrademarkNation.enabled_objects
-        self.fields['patternnation'].queryset = base_models.PatternNation.enabled_objects
+        set_scope(self.fields['trademarknation'])
+        set_scope(self.fields['patternnation'])
 
         self.fields['category'].choices = models.Category.get_choices()
 
@@ -95,6 +119,10 @@ class SubCaseModelForm(ModelFormFieldSupportMixin, forms.ModelForm):
             self.instance.patternnation = None
 
 
+register_scope(base_models.Trademark)
+register_scope(base_models.Pattern)
+
+
 class CaseModelForm(forms.ModelForm):
     js_file = 'js/case_form.js'
 
@@ -102,6 +130,10 @@ class CaseModelForm(forms.ModelForm):
         model = models.Case
         fields = ['name', 'archive_no', 'closed', 'owner',
                   'category', 'stage', 'trademark', 'pattern', 'desc']
+        widgets = {
+            'trademark': RemoteSelect,
+            'pattern': RemoteSelect,
+        }
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -109,8 +141,8 @@ class CaseModelForm(forms.ModelForm):
         self.fields['owner'].queryset = base_models.Owner.enabled_objects
         # self.fields['category'].queryset = models.Category.enabled_objects
         self.fields['stage'].queryset = models.Stage.enabled_objects
-        self.fields['trademark'].queryset = base_models.Trademark.enabled_objects
-        self.fields['pattern'].queryset = base_models.Pattern.enabled_objects
+        set_scope(self.fields['trademark'])
+        set_scope(self.fields['pattern'])
 
         self.fields['category'].choices = models.Category.get_choices()
 
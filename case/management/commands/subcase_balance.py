@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from case import balance
+from case.models import SubCase, SubCaseBalance
+
+
+class Command(BaseCommand):
+    help = 'Rebuild or verify the materialized SubCaseBalance table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=['rebuild', 'verify'])
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def _iter_batches(self, batch_size):
+        pks = list(SubCase.objects.order_by('pk').values_list('pk', flat=True))
+        for i in range(0, len(pks), batch_size):
+            yield pks[i:i + batch_size]
+
+    def rebuild(self, batch_size):
+        count = 0
+        for pks in self._iter_batches(batch_size):
+            balances = balance.get_subcase_balances(pks)
+            with transaction.atomic():
+                SubCaseBalance.objects.filter(subcase_id__in=pks).delete()
+                SubCaseBalance.objects.bulk_create([
+                    SubCaseBalance(subcase_id=pk, net_amount_cny=balance.get_net_amount(b), **b)
+                    for pk, b in balances.items()
+                ])
+            count += len(pks)
+        self.stdout.write('{} subcase balances rebuilt'.format(count))
+
+    def verify(self, batch_size):
+        """
+        : 将SubCaseBalance与逐行计算的结果(SubCase原有的*_sum_cny计算方式)进行比较，
+        : 不使用rebuild所用的聚合查询，能够发现聚合查询本身的错误
+        """
+        mismatched = 0
+        for pks in self._iter_batches(batch_size):
+            stored = SubCaseBalance.objects.in_bulk(pks)
+            expected_balances = balance.get_subcase_balances_by_rows(SubCase.objects.filter(pk__in=pks))
+            for pk, expected_balance in sorted(expected_balances.items()):
+                row = stored.get(pk)
+                if row is None:
+                    mismatched += 1
+                    self.stdout.write('{}: missing'.format(pk))
+                    continue
+                for field in balance.BALANCE_FIELDS:
+                    expected = expected_balance[field]
+                    if getattr(row, field) != expected:
+                        mismatched += 1
+                        self.stdout.write('{}: {} {} != {}'.format(pk, field, getattr(row, field), expected))
+        if mismatched:
+            raise CommandError('{} mismatch(es) found'.format(mismatched))
+        self.stdout.write('SubCaseBalance is consistent')
+
+    def handle(self, *args, **options):
+        getattr(self, options['action'])(options['batch_size'])
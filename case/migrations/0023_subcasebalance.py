@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 09:32
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('case', '0022_auto_20170822_1948'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SubCaseBalance',
+            fields=[
+                ('subcase', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='balance_summary', serialize=False, to='case.SubCase', verbose_name='分案')),
+                ('receipts_sum_cny', models.DecimalField(decimal_places=6, default=0, max_digits=20, verbose_name='收款(减去手续费)')),
+                ('payment_sum_cny', models.DecimalField(decimal_places=6, default=0, max_digits=20, verbose_name='付款(包含手续费)')),
+                ('paymentlink_sum_cny', models.DecimalField(decimal_places=6, default=0, max_digits=20, verbose_name='转移付款')),
+                ('income_sum_cny', models.DecimalField(decimal_places=6, default=0, max_digits=20, verbose_name='其它收入')),
+                ('expense_sum_cny', models.DecimalField(decimal_places=6, default=0, max_digits=20, verbose_name='其它支出')),
+                ('net_amount_cny', models.DecimalField(db_index=True, decimal_places=6, default=0, max_digits=20, verbose_name='收支净额')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': '分案收支汇总',
+                'verbose_name_plural': '分案收支汇总',
+            },
+        ),
+    ]
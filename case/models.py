@@ -2,7 +2,9 @@ import os
 import itertools
 from collections import OrderedDict
 
+from django.apps import apps
 from django.db import models
+from django.db.models import Prefetch
 from django.conf import settings
 from django.urls import reverse
 from django.utils.functional import cached_property
@@ -10,6 +12,10 @@ from django.utils.functional import cached_property
 from base.models import CommonFieldMixin, DescriptionFieldMixin, FakerMixin, EnabledEntityManager
 from base.models import Client, Country, Owner
 
+from utils import caching
+
+from . import balance
+
 # Create your models here.
 
 BASE_DIR = settings.BASE_DIR
@@ -47,6 +53,25 @@ class Category(FakerMixin, CommonFieldMixin):
     def __str__(self):
         return '{}'.format(self.name)
 
+    @classmethod
+    def get_tree(cls):
+        """
+        : 使用一条查询读取分类树，按照Category的版本号缓存，Category发生save/delete时失效
+        :return: list of (id, name, [(child_id, child_name), ...])，只包含enabled的一级分类
+        """
+        def load():
+            categories = list(cls.objects.order_by('pk').values_list('id', 'name', 'parent_id', 'enabled'))
+            children = {}
+            for c_id, name, parent_id, enabled in categories:
+                if parent_id is not None:
+                    children.setdefault(parent_id, []).append((c_id, name))
+            return [
+                (c_id, name, children.get(c_id, []))
+                for c_id, name, parent_id, enabled in categories
+                if parent_id is None and enabled
+            ]
+        return caching.get_or_set('case_category_tree', [cls], load)
+
     @classmethod
     def get_choices(cls, parent=None):
         """
@@ -54,15 +79,15 @@ class Category(FakerMixin, CommonFieldMixin):
         :param parent: 用于筛选返回结果中的类别，支持list或者单个int值
         :return: 
         """
+        if parent and not isinstance(parent, (list, tuple, set)):
+            parent = [parent]
         choices = []
-        for c in cls.enabled_objects.all():
-            if c.parent is not None:
-                continue
-            if parent and (isinstance(parent, list) and c.id not in parent or c.id != parent):
+        for c_id, name, children in cls.get_tree():
+            if parent and c_id not in parent:
                 # 筛选分类
                 # 在Trademark/Pattern relatedView中会调用
                 continue
-            choices.append((c.name, [(child_c.id, child_c.name) for child_c in c.category_set.all()]))
+            choices.append((name, list(children)))
         return choices
 
 
@@ -114,6 +139,12 @@ class Case(FakerMixin, CommonFieldMixin, DescriptionFieldMixin):
     enabled_objects = EnabledEntityManager()
 
     datatables_class = 'case.datatables.CaseDataTable'
+    detail_select_related = (
+        'client',
+        'category',
+        'stage',
+        'owner',
+    )
     modelform_class = 'case.forms.CaseModelForm'
     related_entity_config = {
         'case.subcase': {
@@ -125,7 +156,6 @@ class Case(FakerMixin, CommonFieldMixin, DescriptionFieldMixin):
     faker_fields = {
         'name': 'sentence',
         'archive_no': 'isbn13',
-        'settled': 'pybool',
         'closed': 'pybool',
         'client': Client,
         'owner': Owner,
@@ -133,6 +163,7 @@ class Case(FakerMixin, CommonFieldMixin, DescriptionFieldMixin):
         'stage': Stage,
         'desc': 'paragraph'
     }
+    faker_ratio = 3
 
     class Meta:
         verbose_name = '案件'
@@ -176,13 +207,38 @@ class Case(FakerMixin, CommonFieldMixin, DescriptionFieldMixin):
 
     @cached_property
     def balance_amount_cny(self):
-        balance = sum(
-            subcase.receipts_sum_cny + subcase.income_sum_cny
-            - (subcase.payment_sum_cny + subcase.expense_sum_cny + subcase.paymentlink_sum_cny)
-            for subcase in self.subcase_set.filter(enabled=1).all()
-        )
+        # 注意只使用enabled项
+        if 'balance_subcases' in self.__dict__:
+            # show_balance页面中已经计算了各分案件的汇总，不再重复查询
+            return sum(balance.get_net_amount(subcase.balance_sums)
+                       for subcase in self.balance_subcases if subcase.enabled)
+        subcase_ids = self.subcase_set.filter(enabled=1).values_list('pk', flat=True)
+        balances = balance.get_subcase_balances(subcase_ids)
+        return sum(balance.get_net_amount(b) for b in balances.values())
 
-        return balance
+    @cached_property
+    def balance_subcases(self):
+        """
+        : show_balance页面使用的分案件列表
+        : 预先读取各分案件的收付款明细，并设置收支汇总，避免逐行查询
+        """
+        Receipts = apps.get_model('sale', 'Receipts')
+        Payment = apps.get_model('purchase', 'Payment')
+        PaymentLink = apps.get_model('purchase', 'PaymentLink')
+        Income = apps.get_model('income', 'Income')
+        Expense = apps.get_model('expense', 'Expense')
+        # 一对一以及外键关系使用select_related，每个关系只需要一次查询
+        subcases = list(self.subcase_set.prefetch_related(
+            Prefetch('receivable_set__receipts_set', queryset=Receipts.objects.select_related('transfer_charge')),
+            # linked_amount/unlinked_amount在子查询中计算，不需要读取paymentlink_set
+            Prefetch('payable_set__payment_set',
+                     queryset=Payment.objects.with_link_totals().select_related('transfer_charge')),
+            Prefetch('paymentlink_set',
+                     queryset=PaymentLink.objects.select_related('payment__payable__subcase__case')),
+            Prefetch('income_set', queryset=Income.objects.select_related('income_type')),
+            Prefetch('expense_set', queryset=Expense.objects.select_related('expense_type')),
+        ))
+        return balance.attach_balances(subcases)
 
 
 class SubCase(FakerMixin, CommonFieldMixin, DescriptionFieldMixin):
@@ -234,6 +290,17 @@ class SubCase(FakerMixin, CommonFieldMixin, DescriptionFieldMixin):
 
     modelform_class = 'case.forms.SubCaseModelForm'
     datatables_class = 'case.datatables.SubCaseDataTable'
+    detail_select_related = (
+        'case',
+        'contract',
+        'agent',
+        'category',
+        'stage',
+        'trademarknation__trademark',
+        'trademarknation__country',
+        'patternnation__pattern',
+        'patternnation__country',
+    )
     related_entity_config = {
         'sale.receivable': {
             'query_path': 'subcase',
@@ -253,6 +320,17 @@ class SubCase(FakerMixin, CommonFieldMixin, DescriptionFieldMixin):
         },
     }
 
+    faker_fields = {
+        'name': 'sentence',
+        'closed': 'pybool',
+        'agent': Client,
+        'case': Case,
+        'category': Category,
+        'stage': Stage,
+        'desc': 'paragraph'
+    }
+    faker_ratio = 6
+
     class Meta:
         verbose_name = '分案'
         verbose_name_plural = '分案'
@@ -308,43 +386,80 @@ class SubCase(FakerMixin, CommonFieldMixin, DescriptionFieldMixin):
     def receipts_iter(self):
         # 因为这个iter要多次使用
         # 所以不能设置为cached_property
-        # 注意要使用filter enabled=1
-        return itertools.chain.from_iterable(rv.receipts_set.filter(enabled=1).all() for rv in self.receivable_set.all())
-
-    @cached_property
-    def receipts_sum_cny(self):
-        # 所有关联receipts的总金额
-        # 减去transfer_charge
-        return sum(rv.amount_cny - rv.transfer_charge.amount for rv in self.receipts_iter)
+        # 注意只使用enabled项
+        # 使用all()而不是filter()，使得Case.balance_subcases中的prefetch_related能够生效
+        return itertools.chain.from_iterable(
+            (rt for rt in rv.receipts_set.all() if rt.enabled) for rv in self.receivable_set.all()
+        )
 
     @property
     def payment_iter(self):
         # 因为这个iter要多次使用
         # 所以不能设置为cached_property
-        # 注意要使用filter enabled=1
-        return itertools.chain.from_iterable(pa.payment_set.filter(enabled=1).all() for pa in self.payable_set.all())
+        # 注意只使用enabled项
+        return itertools.chain.from_iterable(
+            (pm for pm in pa.payment_set.all() if pm.enabled) for pa in self.payable_set.all()
+        )
+
+    @cached_property
+    def balance_sums(self):
+        # 收支汇总，由case.balance使用聚合查询计算
+        # Case.balance_subcases中会批量设置这个值
+        return balance.get_subcase_balances([self.pk])[self.pk]
+
+    @cached_property
+    def receipts_sum_cny(self):
+        # 所有关联receipts的总金额
+        # 减去transfer_charge
+        return self.balance_sums['receipts_sum_cny']
 
     @cached_property
     def payment_sum_cny(self):
         # 所有关联payment的总金额
         # 包含transfer_charge
-        # 注意使用的是unlinked_amount_cny，表示当前payment未被转移的金额(CNY)
-        return sum(pm.unlinked_amount_cny + pm.transfer_charge.amount for pm in self.payment_iter)
+        # 注意使用的是未被转移的金额(CNY)
+        return self.balance_sums['payment_sum_cny']
 
     @cached_property
     def paymentlink_sum_cny(self):
-        # 注意要使用filter enabled=1
-        return sum(plink.amount_cny for plink in self.paymentlink_set.filter(enabled=1).all())
+        return self.balance_sums['paymentlink_sum_cny']
 
     @cached_property
     def income_sum_cny(self):
-        # 注意要使用filter enabled=1
-        return sum(income.amount_cny for income in self.income_set.filter(enabled=1).all())
+        return self.balance_sums['income_sum_cny']
 
     @cached_property
     def expense_sum_cny(self):
-        # 注意要使用filter enabled=1
-        return sum(expense.amount_cny for expense in self.expense_set.filter(enabled=1).all())
+        return self.balance_sums['expense_sum_cny']
+
+
+class SubCaseBalance(models.Model):
+    """
+    : 分案件收支汇总(人民币)的物化表
+    : 由case.balance在相关收付款保存时增量维护，用于按利润对分案件进行排序等场景
+    : 各字段的值与SubCase中对应的*_sum_cny属性相同
+    """
+    subcase = models.OneToOneField(
+        SubCase,
+        verbose_name='分案',
+        primary_key=True,
+        related_name='balance_summary',
+        on_delete=models.CASCADE,
+    )
+    receipts_sum_cny = models.DecimalField('收款(减去手续费)', max_digits=20, decimal_places=6, default=0)
+    payment_sum_cny = models.DecimalField('付款(包含手续费)', max_digits=20, decimal_places=6, default=0)
+    paymentlink_sum_cny = models.DecimalField('转移付款', max_digits=20, decimal_places=6, default=0)
+    income_sum_cny = models.DecimalField('其它收入', max_digits=20, decimal_places=6, default=0)
+    expense_sum_cny = models.DecimalField('其它支出', max_digits=20, decimal_places=6, default=0)
+    net_amount_cny = models.DecimalField('收支净额', max_digits=20, decimal_places=6, default=0, db_index=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = '分案收支汇总'
+        verbose_name_plural = '分案收支汇总'
+
+    def __str__(self):
+        return '{}: {}'.format(self.subcase_id, self.net_amount_cny)
 
 
 class Contract(FakerMixin, CommonFieldMixin, DescriptionFieldMixin):
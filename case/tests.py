@@ -1,3 +1,206 @@
+import io
+from decimal import Decimal
+from unittest import mock
+
 from django.test import TestCase
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+
+from base.models import Currency
+from case import balance
+from case.models import Case, SubCase, SubCaseBalance, Category
+from sale.models import Receivable, Receipts
+from purchase.models import Payable, Payment, PaymentLink
+from income.models import Income
+from expense.models import Expense
+from utils.signals import post_bulk_disable
 
 # Create your tests here.
+
+
+class BalanceTestCase(TestCase):
+    def setUp(self):
+        Currency.objects.create(id='CNY', name_chs='人民币', name_en='Yuan')
+        Currency.objects.create(id='USD', name_chs='美元', name_en='Dollar')
+        self.case = Case.objects.create(name='case')
+        self.subcase = SubCase.objects.create(name='subcase 1', case=self.case)
+        self.other = SubCase.objects.create(name='subcase 2', case=self.case)
+        SubCase.objects.create(name='disabled', case=self.case, enabled=False)
+
+        rv = Receivable.objects.create(no='R1', amount=Decimal('1000'), subcase=self.subcase)
+        rt = Receipts.objects.create(amount=Decimal('100'), exchange_rate=Decimal('6.5'), currency_id='USD',
+                                     received_date='2017-08-01', receivable=rv)
+        Expense.objects.create(amount=Decimal('20'), receipts=rt)
+        Receipts.objects.create(amount=Decimal('300'), exchange_rate=Decimal('1'), currency_id='CNY',
+                                received_date='2017-08-02', receivable=rv)
+        Receipts.objects.create(amount=Decimal('999'), exchange_rate=Decimal('1'), currency_id='CNY',
+                                received_date='2017-08-02', receivable=rv, enabled=False)
+
+        pa = Payable.objects.create(no='P1', amount=Decimal('500'), subcase=self.subcase,
+                                    received_date='2017-08-01', due_date='2017-09-01')
+        pm = Payment.objects.create(amount=Decimal('50'), exchange_rate=Decimal('7'), currency_id='USD',
+                                    paid_date='2017-08-03', payable=pa)
+        Expense.objects.create(amount=Decimal('10'), payment=pm)
+        PaymentLink.objects.create(amount=Decimal('10'), payment=pm, subcase=self.other)
+        PaymentLink.objects.create(amount=Decimal('5'), payment=pm, subcase=self.other, enabled=False)
+
+        Income.objects.create(amount=Decimal('30'), exchange_rate=Decimal('2'), currency_id='USD',
+                              subcase=self.subcase)
+        Expense.objects.create(amount=Decimal('40'), currency_id='CNY', subcase=self.subcase)
+        Expense.objects.create(amount=Decimal('1'), currency_id='CNY', subcase=self.subcase, enabled=False)
+
+    def test_subcase_sums(self):
+        subcase = SubCase.objects.get(pk=self.subcase.pk)
+        self.assertEqual(subcase.receipts_sum_cny, Decimal('650') + Decimal('300') - Decimal('20'))
+        self.assertEqual(subcase.payment_sum_cny, (Decimal('50') - Decimal('10')) * Decimal('7') + Decimal('10'))
+        self.assertEqual(subcase.paymentlink_sum_cny, Decimal('0'))
+        self.assertEqual(subcase.income_sum_cny, Decimal('60'))
+        self.assertEqual(subcase.expense_sum_cny, Decimal('40'))
+
+        other = SubCase.objects.get(pk=self.other.pk)
+        self.assertEqual(other.paymentlink_sum_cny, Decimal('70'))
+
+    def test_case_balance(self):
+        case = Case.objects.get(pk=self.case.pk)
+        expected = Decimal('930') + Decimal('60') - (Decimal('290') + Decimal('40')) - Decimal('70')
+        self.assertEqual(case.balance_amount_cny, expected)
+
+    def test_row_sums_match_aggregates(self):
+        subcases = SubCase.objects.all()
+        expected = balance.get_subcase_balances_by_rows(subcases)
+        self.assertEqual(balance.get_subcase_balances([s.pk for s in subcases]), expected)
+
+    def test_incremental_update_matches_aggregates(self):
+        stored = {row.subcase_id: {f: getattr(row, f) for f in balance.BALANCE_FIELDS}
+                  for row in SubCaseBalance.objects.all()}
+        self.assertEqual(stored, balance.get_subcase_balances(SubCase.objects.values_list('pk', flat=True)))
+
+    def test_query_count_does_not_depend_on_rows(self):
+        case = Case.objects.get(pk=self.case.pk)
+        with self.assertNumQueries(2):
+            case.balance_amount_cny
+        subcases = case.balance_subcases
+        with self.assertNumQueries(0):
+            for subcase in subcases:
+                list(subcase.receipts_iter)
+                for pm in subcase.payment_iter:
+                    pm.unlinked_amount_cny
+                    pm.transfer_charge.amount
+                subcase.receipts_sum_cny
+                subcase.payment_sum_cny
+
+
+class SubCaseBalanceTestCase(TestCase):
+    def setUp(self):
+        Currency.objects.create(id='CNY', name_chs='人民币', name_en='Yuan')
+        self.subcase = SubCase.objects.create(name='subcase 1')
+        self.other = SubCase.objects.create(name='subcase 2')
+        self.receivable = Receivable.objects.create(no='R1', amount=Decimal('1000'), subcase=self.subcase)
+
+    def _stored(self, subcase):
+        return SubCaseBalance.objects.get(subcase=subcase)
+
+    def test_incremental_update(self):
+        receipts = Receipts.objects.create(amount=Decimal('100'), exchange_rate=Decimal('1'), currency_id='CNY',
+                                           received_date='2017-08-01', receivable=self.receivable)
+        self.assertEqual(self._stored(self.subcase).receipts_sum_cny, Decimal('100'))
+
+        Expense.objects.create(amount=Decimal('5'), receipts=receipts)
+        self.assertEqual(self._stored(self.subcase).receipts_sum_cny, Decimal('95'))
+
+        receipts.enabled = False
+        receipts.save()
+        self.assertEqual(self._stored(self.subcase).receipts_sum_cny, Decimal('0'))
+
+    def test_moving_row_updates_both_subcases(self):
+        income = Income.objects.create(amount=Decimal('30'), currency_id='CNY', subcase=self.subcase)
+        income.subcase = self.other
+        income.save()
+        self.assertEqual(self._stored(self.subcase).income_sum_cny, Decimal('0'))
+        self.assertEqual(self._stored(self.other).income_sum_cny, Decimal('30'))
+        self.assertEqual(self._stored(self.other).net_amount_cny, Decimal('30'))
+
+        income.delete()
+        self.assertEqual(self._stored(self.other).income_sum_cny, Decimal('0'))
+
+    def test_moving_bill_and_removing_transfer_charge(self):
+        receipts = Receipts.objects.create(amount=Decimal('100'), exchange_rate=Decimal('1'), currency_id='CNY',
+                                           received_date='2017-08-01', receivable=self.receivable)
+        charge = Expense.objects.create(amount=Decimal('5'), receipts=receipts)
+        self.receivable.subcase = self.other
+        self.receivable.save()
+        self.assertEqual(self._stored(self.subcase).receipts_sum_cny, Decimal('0'))
+        self.assertEqual(self._stored(self.other).receipts_sum_cny, Decimal('95'))
+
+        charge.delete()
+        self.assertEqual(self._stored(self.other).receipts_sum_cny, Decimal('100'))
+        Receipts.objects.filter(pk=receipts.pk).update(enabled=False)
+        post_bulk_disable.send(sender=Receipts, pks=[receipts.pk])
+        self.assertEqual(self._stored(self.other).receipts_sum_cny, Decimal('0'))
+
+    def test_single_save_query_count(self):
+        for count in (1, 10):
+            for i in range(count):
+                receipts = Receipts.objects.create(amount=Decimal('1'), exchange_rate=Decimal('1'),
+                                                   currency_id='CNY', received_date='2017-08-01',
+                                                   receivable=self.receivable)
+            receipts = Receipts.objects.get(pk=receipts.pk)
+            receipts.amount = Decimal('2')
+            # UPDATE收款，保存前后的贡献，SubCaseBalance以及unsettled_amount的UPDATE
+            with self.assertNumQueries(5):
+                receipts.save()
+        self.assertEqual(self._stored(self.subcase).receipts_sum_cny, Decimal('13'))
+
+    def test_rebuild_and_verify(self):
+        Income.objects.create(amount=Decimal('30'), currency_id='CNY', subcase=self.subcase)
+        # update()不会产生signal
+        Income.objects.update(amount=Decimal('40'))
+        with self.assertRaises(CommandError):
+            call_command('subcase_balance', 'verify', stdout=io.StringIO())
+        call_command('subcase_balance', 'rebuild', stdout=io.StringIO())
+        call_command('subcase_balance', 'verify', stdout=io.StringIO())
+        self.assertEqual(self._stored(self.subcase).income_sum_cny, Decimal('40'))
+
+    def test_verify_does_not_use_aggregates(self):
+        Income.objects.create(amount=Decimal('30'), currency_id='CNY', subcase=self.subcase)
+        get_subcase_balances = balance.get_subcase_balances
+
+        def wrong_balances(subcase_ids):
+            balances = get_subcase_balances(subcase_ids)
+            for b in balances.values():
+                b['income_sum_cny'] += 1
+            return balances
+
+        with mock.patch('case.balance.get_subcase_balances', wrong_balances):
+            call_command('subcase_balance', 'rebuild', stdout=io.StringIO())
+            with self.assertRaises(CommandError):
+                call_command('subcase_balance', 'verify', stdout=io.StringIO())
+
+
+class CategoryChoicesTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.trademark = Category.objects.create(id=1, name='商标')
+        self.pattern = Category.objects.create(id=2, name='专利')
+        Category.objects.create(id=3, name='disabled', enabled=False)
+        for parent in (self.trademark, self.pattern):
+            for i in range(2):
+                Category.objects.create(name='{}{}'.format(parent.name, i), parent=parent)
+
+    def test_single_cached_query(self):
+        with self.assertNumQueries(1):
+            choices = Category.get_choices()
+        self.assertEqual([name for name, children in choices], ['商标', '专利'])
+        self.assertEqual([name for c_id, name in choices[1][1]], ['专利0', '专利1'])
+        with self.assertNumQueries(0):
+            Category.get_choices(parent=1)
+
+    def test_parent_filter(self):
+        self.assertEqual([name for name, children in Category.get_choices(parent=2)], ['专利'])
+        self.assertEqual([name for name, children in Category.get_choices(parent=[1, 2])], ['商标', '专利'])
+
+    def test_save_invalidates(self):
+        Category.get_choices()
+        Category.objects.create(name='商标2', parent=self.trademark)
+        self.assertEqual(len(Category.get_choices(parent=1)[0][1]), 3)
@@ -8,6 +8,7 @@ case_urlpatterns = [
     url(r'^(?P<case_id>\d+)/$', views.CaseRelatedEntityView.as_view(), name='detail'),
     url(r'^create/$', views.CaseCreateView.as_view(), name='create'),
     url(r'^disable/(?P<case_id>\d+)/$', views.CaseDisableView.as_view(), name='disable'),
+    url(r'^disable/$', views.CaseDisableView.as_view(), name='bulk_disable'),
 ]
 
 subcase_urlpatterns = [
@@ -15,6 +16,7 @@ subcase_urlpatterns = [
     url(r'^(?P<subcase_id>\d+)/$', views.SubCaseRelatedEntityView.as_view(), name='detail'),
     url(r'^create/$', views.SubCaseCreateView.as_view(), name='create'),
     url(r'^disable/(?P<subcase_id>\d+)/$', views.SubCaseDisableView.as_view(), name='disable'),
+    url(r'^disable/$', views.SubCaseDisableView.as_view(), name='bulk_disable'),
 ]
 
 urlpatterns = [
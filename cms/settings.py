@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/1.11/ref/settings/
 """
 
 import os
+import sys
 from django.contrib.messages import constants as messages
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
@@ -42,22 +43,26 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     'django.contrib.staticfiles',
     'widget_tweaks',
-    'utils',
+    'utils.apps.UtilsConfig',
     'utils.formfield',
     'base',
-    'case',
-    'sale',
-    'purchase',
+    'case.apps.CaseConfig',
+    'sale.apps.SaleConfig',
+    'purchase.apps.PurchaseConfig',
     'income',
     'expense',
 ]
 
 MIDDLEWARE = [
+    # 需要放在第一位，以记录其他middleware产生的查询
+    'base.middleware.QueryInstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    # 需要request.user
+    'base.middleware.ProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'base.middleware.LoginRequiredMiddleware',
@@ -103,6 +108,37 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/1.11/topics/cache/
+# 通过环境变量CMS_CACHE_BACKEND选择: locmem(默认), file, redis
+# 多进程部署时计数等缓存需要在进程之间共享，应使用file或者redis(需要安装django-redis)
+CACHE_BACKEND = os.environ.get('CMS_CACHE_BACKEND', 'locmem')
+CACHE_LOCATION = os.environ.get('CMS_CACHE_LOCATION')
+
+if CACHE_BACKEND == 'redis':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django_redis.cache.RedisCache',
+            'LOCATION': CACHE_LOCATION or 'redis://127.0.0.1:6379/1',
+            'KEY_PREFIX': 'cms',
+        }
+    }
+elif CACHE_BACKEND == 'file':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': CACHE_LOCATION or os.path.join(BASE_DIR, '.cache'),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': CACHE_LOCATION or 'cms',
+        }
+    }
+
+
 # Password validation
 # https://docs.djangoproject.com/en/1.11/ref/settings/#auth-password-validators
 
@@ -155,3 +191,50 @@ MESSAGE_TAGS = {
     messages.ERROR: 'callout callout-danger',
     messages.SUCCESS: 'callout callout-success',
 }
+
+# DataTables server-side related settings
+# recordsTotal/recordsFiltered计数缓存时间(秒)，相关model保存时会自动失效
+DATATABLES_COUNT_CACHE_TIMEOUT = 60
+# Meta.approximate_count开启时，表统计信息估计值低于这个值则仍然使用COUNT(*)
+DATATABLES_APPROXIMATE_COUNT_THRESHOLD = 10000
+# 全局搜索pattern的最小长度，更短的pattern会被忽略(不产生查询条件)
+# 可以在ModelDataTable.Meta.search_min_length中为每个table单独设置
+DATATABLES_SEARCH_MIN_LENGTH = 1
+# 同一session中相同draw请求的缓存时间(秒)，为0时不缓存
+DATATABLES_DRAW_CACHE_TIMEOUT = 3
+# infobox以及首页汇总计数的缓存时间(秒)，相关model保存时会自动失效
+SUMMARY_COUNT_CACHE_TIMEOUT = 30
+
+# 请求的查询数量，SQL时间，重复查询以及模板渲染时间，参考base.middleware.QueryInstrumentationMiddleware
+TESTING = sys.argv[1:2] == ['test']
+# view的查询数量超出query_budget时抛出异常(开发环境以及测试中)，否则只记录warning
+QUERY_BUDGET_STRICT = DEBUG or TESTING
+
+# 请求的profile，参考base.middleware.ProfilingMiddleware
+# staff用户在url中添加这个参数时，使用cProfile记录这个请求
+PROFILE_QUERY_PARAM = '_profile'
+# 超过这个时间(ms)的请求保存采样profile，为None时不进行采样
+PROFILE_SLOW_REQUEST_THRESHOLD = float(os.environ['CMS_PROFILE_SLOW_REQUEST_MS']) \
+    if os.environ.get('CMS_PROFILE_SLOW_REQUEST_MS') else None
+# 采样间隔(秒)
+PROFILE_SAMPLE_INTERVAL = 0.005
+# 保留最近的profile数量
+PROFILE_KEEP = 200
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        # INFO: 每个请求一行json格式的统计
+        'base.middleware': {
+            'handlers': ['console'],
+            'level': os.environ.get('CMS_INSTRUMENTATION_LOG_LEVEL', 'WARNING' if TESTING else 'INFO'),
+            'propagate': False,
+        },
+    },
+}
@@ -24,4 +24,5 @@ urlpatterns = [
     url(r'', include('purchase.urls')),
     url(r'', include('income.urls')),
     url(r'', include('expense.urls')),
+    url(r'^utils/', include('utils.urls', namespace='utils')),
 ]
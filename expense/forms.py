@@ -5,6 +5,10 @@ from django import forms
 from . import models
 from base import models as base_models
 from case import models as case_models
+from utils.widgets import RemoteSelect, register_scope, set_scope
+
+
+register_scope(case_models.SubCase)
 
 
 class ExpenseModelForm(forms.ModelForm):
@@ -13,6 +17,7 @@ class ExpenseModelForm(forms.ModelForm):
         fields = ['amount', 'currency', 'exchange_rate',
                   'incurred_date', 'expense_type', 'subcase']
         widgets = {
+            'subcase': RemoteSelect,
             'incurred_date': forms.TextInput(attrs={
                 'data-provide': 'datepicker',
                 'data-date-format': 'yyyy-mm-dd',
@@ -26,7 +31,7 @@ class ExpenseModelForm(forms.ModelForm):
             # 则不显示subcase field
             del self.fields['subcase']
         else:
-            self.fields['subcase'].queryset = case_models.SubCase.enabled_objects
+            set_scope(self.fields['subcase'])
 
         self.fields['currency'].queryset = base_models.Currency.enabled_objects
         self.fields['expense_type'].queryset = models.ExpenseType.enabled_objects
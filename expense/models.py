@@ -77,6 +77,13 @@ class Expense(CommonFieldMixin, DescriptionFieldMixin):
 
     modelform_class = 'expense.forms.ExpenseModelForm'
     datatables_class = 'expense.datatables.ExpenseDataTable'
+    detail_select_related = (
+        'expense_type',
+        'currency',
+        'receipts',
+        'payment',
+        'subcase',
+    )
     related_entity_config = {}
 
     class Meta:
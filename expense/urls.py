@@ -9,6 +9,7 @@ expense_urlpatterns = [
     url(r'^(?P<expense_id>\d+)/$', views.ExpenseRelatedEntityView.as_view(), name='detail'),
     url(r'^create/$', views.ExpenseCreateView.as_view(), name='create'),
     url(r'^disable/(?P<expense_id>\d+)/$', views.ExpenseDisableView.as_view(), name='disable'),
+    url(r'^disable/$', views.ExpenseDisableView.as_view(), name='bulk_disable'),
 ]
 
 urlpatterns = [
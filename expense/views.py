@@ -1,5 +1,6 @@
 from django.views import generic
 from django.core.exceptions import ValidationError
+from django.db.models import Q
 
 from utils.views import DataTablesListView, ConfiguredModelFormMixin,\
     RelatedEntityView, DisablementView, FormMessageMixin
@@ -42,3 +43,12 @@ class ExpenseDisableView(DisablementView):
                 code='invalid'
             )
         super().validate()
+
+    def get_bulk_errors(self, queryset):
+        errors = super().get_bulk_errors(queryset)
+        for pk, payment_id, receipts_id in queryset.filter(
+            Q(payment__isnull=False) | Q(receipts__isnull=False)
+        ).values_list('pk', 'payment_id', 'receipts_id'):
+            name = '已付款项' if payment_id else '已收款项'
+            errors[pk] = '该支出款项为{0}的手续费，请从该{0}中设置，不能直接删除'.format(name)
+        return errors
@@ -5,6 +5,10 @@ from django import forms
 from . import models
 from base import models as base_models
 from case import models as case_models
+from utils.widgets import RemoteSelect, register_scope, set_scope
+
+
+register_scope(case_models.SubCase)
 
 
 class IncomeModelForm(forms.ModelForm):
@@ -13,6 +17,7 @@ class IncomeModelForm(forms.ModelForm):
         fields = ['amount', 'currency', 'exchange_rate',
                   'incurred_date', 'income_type', 'subcase']
         widgets = {
+            'subcase': RemoteSelect,
             'incurred_date': forms.TextInput(attrs={
                 'data-provide': 'datepicker',
                 'data-date-format': 'yyyy-mm-dd',
@@ -22,4 +27,4 @@ class IncomeModelForm(forms.ModelForm):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.fields['currency'].queryset = base_models.Currency.enabled_objects
-        self.fields['subcase'].queryset = case_models.SubCase.enabled_objects
+        set_scope(self.fields['subcase'])
@@ -83,6 +83,7 @@ class Income(CommonFieldMixin, DescriptionFieldMixin):
 
     modelform_class = 'income.forms.IncomeModelForm'
     datatables_class = 'income.datatables.IncomeDataTable'
+    detail_select_related = ('income_type', 'currency', 'subcase')
     related_entity_config = {}
 
     class Meta:
@@ -9,6 +9,7 @@ income_urlpatterns = [
     url(r'^(?P<income_id>\d+)/$', views.IncomeRelatedEntityView.as_view(), name='detail'),
     url(r'^create/$', views.IncomeCreateView.as_view(), name='create'),
     url(r'^disable/(?P<income_id>\d+)/$', views.IncomeDisableView.as_view(), name='disable'),
+    url(r'^disable/$', views.IncomeDisableView.as_view(), name='bulk_disable'),
 ]
 
 urlpatterns = [
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class PurchaseConfig(AppConfig):
     name = 'purchase'
+
+    def ready(self):
+        from .settlement import payable_ledger
+        payable_ledger.connect()
@@ -11,6 +11,12 @@ class PayableDataTable(ModelDataTable):
         fields = ['no', 'amount', 'unsettled_amount', 'currency__name_chs',
                   'subcase__name', 'received_date', 'due_date', ]
         detail_url_format = '/payable/{}'
+        pagination = 'keyset'
+        column_search = True
+        column_lookups = {
+            'no': 'istartswith',
+        }
+        approximate_count = True
 
 
 class PaymentDataTable(ModelDataTable):
@@ -19,6 +25,10 @@ class PaymentDataTable(ModelDataTable):
         fields = ['amount', 'currency__name_chs', 'exchange_rate',
                   'paid_date', 'payable__no']
         detail_url_format = '/payment/{}'
+        pagination = 'keyset'
+        # 金额等数字列，单个字符的搜索几乎匹配所有行
+        search_min_length = 2
+        approximate_count = True
 
 
 class PaymentLinkDataTable(ModelDataTable):
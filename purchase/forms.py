@@ -4,15 +4,20 @@ from decimal import Decimal
 
 from django import forms
 from django.core.exceptions import ValidationError
-from django.db.models import Q
+from django.db import transaction
 
 from . import models
+from .settlement import payable_ledger
 from base import models as base_models
 from case import models as case_models
 from expense import models as expense_models
 
 from utils.formfield.forms import ModelFormFieldSupportMixin
 from utils.formfield.fields import ModelFormField
+from utils.widgets import RemoteSelect, register_scope, set_scope
+
+
+register_scope(case_models.SubCase)
 
 
 class PayableModelForm(forms.ModelForm):
@@ -21,6 +26,7 @@ class PayableModelForm(forms.ModelForm):
         fields = ['no', 'amount', 'currency', 'subcase',
                   'received_date', 'due_date']
         widgets = {
+            'subcase': RemoteSelect,
             'due_date': forms.TextInput(attrs={
                 'data-provide': 'datepicker',
                 'data-date-format': 'yyyy-mm-dd',
@@ -34,7 +40,7 @@ class PayableModelForm(forms.ModelForm):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.fields['currency'].queryset = base_models.Currency.enabled_objects
-        self.fields['subcase'].queryset = case_models.SubCase.enabled_objects
+        set_scope(self.fields['subcase'])
 
 
 class TransferChargeModelForm(forms.ModelForm):
@@ -50,6 +56,9 @@ class TransferChargeModelForm(forms.ModelForm):
         fields = ['amount']
 
 
+register_scope(models.Payable)
+
+
 class PaymentModelForm(ModelFormFieldSupportMixin, forms.ModelForm):
     transfer_charge = ModelFormField(
         TransferChargeModelForm,
@@ -63,6 +72,7 @@ class PaymentModelForm(ModelFormFieldSupportMixin, forms.ModelForm):
         fields = ['amount', 'currency', 'exchange_rate',
                   'paid_date', 'payable']
         widgets = {
+            'payable': RemoteSelect,
             'paid_date': forms.TextInput(attrs={
                 'data-provide': 'datepicker',
                 'data-date-format': 'yyyy-mm-dd',
@@ -72,7 +82,7 @@ class PaymentModelForm(ModelFormFieldSupportMixin, forms.ModelForm):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.fields['currency'].queryset = base_models.Currency.enabled_objects
-        self.fields['payable'].queryset = models.Payable.enabled_objects
+        set_scope(self.fields['payable'])
 
     def clean(self):
         """
@@ -88,6 +98,17 @@ class PaymentModelForm(ModelFormFieldSupportMixin, forms.ModelForm):
         if new_amount - old_amount > limit:
             raise ValidationError('付款金额不能大于待付款金额')
 
+    @transaction.atomic
+    def save(self, commit=True):
+        """
+        : clean()中的检查没有加锁，并发录入时可能同时通过检查
+        : 这里锁定关联的Payable行，在同一个transaction中再次检查并更新unsettled_amount
+        : 超出时抛出ValidationError，由view作为form错误处理
+        """
+        if commit:
+            payable_ledger.lock_and_check(self.instance, '付款金额不能大于待付款金额')
+        return super().save(commit=commit)
+
     def before_save_related(self):
         # 在存储related formfield之前
         # 1. 将transfer_charge formfield的发生日期设置为付款日期
@@ -96,22 +117,33 @@ class PaymentModelForm(ModelFormFieldSupportMixin, forms.ModelForm):
         self['transfer_charge'].inner_form.instance.expense_type_id = 100
 
 
+
+# clean()中使用payment.unlinked_amount
+register_scope(models.Payment, get_queryset=lambda: models.Payment.enabled_objects.with_link_totals())
+# 不能将payment转移到自己所属的subcase
+register_scope(case_models.SubCase, 'exclude',
+               get_queryset=lambda **kwargs: case_models.SubCase.enabled_objects.exclude(**kwargs), params=['pk'])
+
+
 class PaymentLinkModelForm(forms.ModelForm):
     class Meta:
         model = models.PaymentLink
         fields = ['amount', 'payment', 'subcase', 'desc']
+        widgets = {
+            'payment': RemoteSelect,
+            'subcase': RemoteSelect,
+        }
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.fields['payment'].queryset = models.Payment.enabled_objects
-        self.fields['subcase'].queryset = case_models.SubCase.enabled_objects
+        set_scope(self.fields['payment'])
 
         payment = getattr(self.instance, 'payment', None)
         if payment is not None:
             # 用于在subcase queryset中去除payment关联的subcase
-            # 即不能将payment转移到自己所属的subcase
-            self.fields['subcase'].queryset = \
-                self.fields['subcase'].queryset.filter(~Q(pk=payment.payable.subcase_id))
+            set_scope(self.fields['subcase'], 'exclude', pk=payment.payable.subcase_id)
+        else:
+            set_scope(self.fields['subcase'])
 
     def clean(self):
         """
@@ -2,13 +2,16 @@ from decimal import Decimal
 from collections import OrderedDict
 
 from django.db import models
+from django.db.models import OuterRef, Subquery, Sum, F, Value, ExpressionWrapper
+from django.db.models.functions import Coalesce
 from django.urls import reverse
 from django.utils.functional import cached_property
 
-from base.models import CommonFieldMixin, DescriptionFieldMixin, EnabledEntityManager
+from base.models import CommonFieldMixin, DescriptionFieldMixin, FakerMixin, EnabledEntityManager
+from utils.ledger import TrackedFieldsMixin
 
 
-class Payable(CommonFieldMixin, DescriptionFieldMixin):
+class Payable(TrackedFieldsMixin, FakerMixin, CommonFieldMixin, DescriptionFieldMixin):
     no = models.CharField('待付款账单编号', max_length=100)
     received_date = models.DateField('账单收到日期')
     due_date = models.DateField('付款期限')
@@ -37,9 +40,12 @@ class Payable(CommonFieldMixin, DescriptionFieldMixin):
 
     objects = models.Manager()
     enabled_objects = EnabledEntityManager()
+    # unsettled_amount的维护，参考utils.ledger
+    tracked_fields = ('amount',)
 
     modelform_class = 'purchase.forms.PayableModelForm'
     datatables_class = 'purchase.datatables.PayableDataTable'
+    detail_select_related = ('subcase__case', 'currency')
     related_entity_config = {
         'purchase.payment': {
             'query_path': 'payable',
@@ -47,6 +53,16 @@ class Payable(CommonFieldMixin, DescriptionFieldMixin):
         }
     }
 
+    faker_fields = {
+        'no': 'isbn13',
+        'received_date': 'date',
+        'due_date': 'date',
+        'amount': ('pydecimal', {'left_digits': 5, 'right_digits': 2, 'positive': True}),
+        'subcase': 'case.models.SubCase',
+        'currency': 'base.models.Currency',
+    }
+    faker_ratio = 6
+
     class Meta:
         verbose_name = '待付款项'
         verbose_name_plural = '待付款项'
@@ -91,7 +107,28 @@ class Payable(CommonFieldMixin, DescriptionFieldMixin):
         return detail_info
 
 
-class Payment(CommonFieldMixin, DescriptionFieldMixin):
+class PaymentQuerySet(models.QuerySet):
+    def with_link_totals(self):
+        """
+        : 使用子查询计算每个Payment的linked_amount和unlinked_amount
+        : annotation与Payment的同名cached_property相同，
+        : 读取时直接写入实例的__dict__，不会再逐个查询paymentlink_set
+        """
+        amount_field = Payment._meta.get_field('amount')
+        links = PaymentLink.objects.filter(
+            payment=OuterRef('pk'), enabled=True
+        ).order_by().values('payment').annotate(total=Sum('amount')).values('total')
+        linked_amount = Coalesce(
+            Subquery(links, output_field=amount_field),
+            Value(Decimal('0')),
+            output_field=amount_field
+        )
+        return self.annotate(linked_amount=linked_amount).annotate(
+            unlinked_amount=ExpressionWrapper(F('amount') - F('linked_amount'), output_field=amount_field)
+        )
+
+
+class Payment(TrackedFieldsMixin, FakerMixin, CommonFieldMixin, DescriptionFieldMixin):
     amount = models.DecimalField('已付款金额', max_digits=10, decimal_places=2)
     exchange_rate = models.DecimalField('付款汇率', max_digits=8, decimal_places=4)
     paid_date = models.DateField('付款日期')
@@ -109,11 +146,14 @@ class Payment(CommonFieldMixin, DescriptionFieldMixin):
         null=True
     )
 
-    objects = models.Manager()
-    enabled_objects = EnabledEntityManager()
+    objects = PaymentQuerySet.as_manager()
+    enabled_objects = EnabledEntityManager.from_queryset(PaymentQuerySet)()
+    # unsettled_amount的维护，参考utils.ledger
+    tracked_fields = ('amount', 'enabled', 'payable_id')
 
     modelform_class = 'purchase.forms.PaymentModelForm'
     datatables_class = 'purchase.datatables.PaymentDataTable'
+    detail_select_related = ('currency', 'transfer_charge', 'payable__subcase__case')
     related_entity_config = {
         'purchase.paymentlink': {
             'query_path': 'payment',
@@ -121,6 +161,15 @@ class Payment(CommonFieldMixin, DescriptionFieldMixin):
         }
     }
 
+    faker_fields = {
+        'amount': ('pydecimal', {'left_digits': 4, 'right_digits': 2, 'positive': True}),
+        'exchange_rate': ('pydecimal', {'left_digits': 1, 'right_digits': 4, 'positive': True}),
+        'paid_date': 'date',
+        'currency': 'base.models.Currency',
+        'payable': Payable,
+    }
+    faker_ratio = 6
+
     class Meta:
         verbose_name = '已付款项'
         verbose_name_plural = '已付款项'
@@ -180,7 +229,9 @@ class Payment(CommonFieldMixin, DescriptionFieldMixin):
 
     @cached_property
     def linked_amount(self):
-        return sum(link.amount for link in self.paymentlink_set.filter(enabled=1).all())
+        # 使用with_link_totals()读取的实例已经有同名的annotation，不会执行这里
+        # 使用all()而不是filter()，使得prefetch_related能够生效
+        return sum(link.amount for link in self.paymentlink_set.all() if link.enabled)
 
     @cached_property
     def unlinked_amount(self):
@@ -212,6 +263,7 @@ class PaymentLink(CommonFieldMixin, DescriptionFieldMixin):
 
     modelform_class = 'purchase.forms.PaymentLinkModelForm'
     datatables_class = 'purchase.datatables.PaymentLinkDataTable'
+    detail_select_related = ('payment__currency', 'subcase')
     related_entity_config = {}
 
     class Meta:
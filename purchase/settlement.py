@@ -0,0 +1,6 @@
+# -*- coding: utf-8 -*-
+
+from utils.ledger import SettlementLedger
+
+# 根据Payment维护Payable.unsettled_amount
+payable_ledger = SettlementLedger('purchase.Payable', 'purchase.Payment', 'payable')
@@ -1,3 +1,225 @@
-from django.test import TestCase
+# -*- coding: utf-8 -*-
 
-# Create your tests here.
+import json
+import threading
+from decimal import Decimal
+
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase, RequestFactory, skipUnlessDBFeature
+
+from base.models import Currency
+from case.models import Case, SubCase, SubCaseBalance
+from expense.models import Expense, ExpenseType
+from .forms import PaymentModelForm
+from .models import Payable, Payment, PaymentLink
+from .settlement import payable_ledger
+from .views import PaymentRelatedEntityView, PaymentDisableView
+
+
+def create_payment(payable, amount):
+    payment = Payment(amount=Decimal(amount), exchange_rate=1, paid_date='2017-08-01', payable=payable)
+    with transaction.atomic():
+        payable_ledger.lock_and_check(payment, 'over settled')
+        payment.save()
+    return payment
+
+
+class PaymentFormSettlementTestCase(TestCase):
+    def setUp(self):
+        self.currency = Currency.objects.create(id='USD', name_chs='美元', name_en='US Dollar')
+        self.payable = Payable.objects.create(no='P1', amount=Decimal('1000'),
+                                              received_date='2017-08-01', due_date='2017-09-01')
+
+    def _form(self, amount):
+        return PaymentModelForm(data={
+            'amount': amount, 'currency': 'USD', 'exchange_rate': '1',
+            'paid_date': '2017-08-01', 'payable': self.payable.pk,
+            'payment-amount': '0',
+        })
+
+    def test_limit_checked_again_on_save(self):
+        form = self._form('800')
+        self.assertTrue(form.is_valid(), form.errors)
+        # 在form通过clean()之后，另一个用户录入了付款
+        create_payment(self.payable, '300')
+        with self.assertRaises(ValidationError):
+            form.save()
+        self.assertEqual(Payment.objects.count(), 1)
+        self.assertEqual(Payable.objects.get(pk=self.payable.pk).unsettled_amount, Decimal('700'))
+
+    def test_save_within_limit(self):
+        form = self._form('1000')
+        self.assertTrue(form.is_valid(), form.errors)
+        form.save()
+        self.assertEqual(Payable.objects.get(pk=self.payable.pk).unsettled_amount, Decimal('0'))
+
+
+class PaymentLinkTotalsTestCase(TestCase):
+    def setUp(self):
+        payable = Payable.objects.create(no='P1', amount=Decimal('1000'),
+                                         received_date='2017-08-01', due_date='2017-09-01')
+        self.payments = [create_payment(payable, '100') for i in range(3)]
+        PaymentLink.objects.create(payment=self.payments[0], amount=Decimal('30'))
+        PaymentLink.objects.create(payment=self.payments[0], amount=Decimal('20'))
+        PaymentLink.objects.create(payment=self.payments[1], amount=Decimal('40'), enabled=False)
+
+    def test_annotation_matches_property(self):
+        with self.assertNumQueries(1):
+            annotated = [(p.linked_amount, p.unlinked_amount)
+                         for p in Payment.objects.with_link_totals().order_by('pk')]
+        expected = [(p.linked_amount, p.unlinked_amount)
+                    for p in Payment.objects.order_by('pk')]
+        self.assertEqual(annotated, expected)
+        self.assertEqual(annotated[0], (Decimal('50'), Decimal('50')))
+        self.assertEqual(annotated[1], (Decimal('0'), Decimal('100')))
+
+
+class PaymentDetailInfoTestCase(TestCase):
+    def test_detail_info_in_one_query(self):
+        Currency.objects.create(id='USD', name_chs='美元', name_en='US Dollar')
+        subcase = SubCase.objects.create(name='subcase', case=Case.objects.create(name='case'))
+        payable = Payable.objects.create(no='P1', amount=Decimal('1000'), subcase=subcase,
+                                         received_date='2017-08-01', due_date='2017-09-01')
+        payment = create_payment(payable, '100')
+        payment.currency_id = 'USD'
+        payment.save()
+        Expense.objects.create(amount=Decimal('10'), payment=payment)
+        PaymentLink.objects.create(payment=payment, amount=Decimal('30'))
+
+        view = PaymentRelatedEntityView()
+        view.kwargs = {'payment_id': payment.pk}
+        view.main_entity = view.model
+        with self.assertNumQueries(1):
+            detail_info = view.get_object(view.get_main_queryset()).get_detail_info()
+        self.assertEqual(detail_info['desc']['未转移金额'], Decimal('70'))
+        self.assertIn('case', detail_info['desc']['所属案件'])
+
+
+class PaymentBulkDisableTestCase(TestCase):
+    def setUp(self):
+        self.subcase = SubCase.objects.create(name='subcase')
+        self.payable = Payable.objects.create(no='P1', amount=Decimal('1000'), subcase=self.subcase,
+                                              received_date='2017-08-01', due_date='2017-09-01')
+        self.payments = [create_payment(self.payable, amount) for amount in ('100', '200', '300')]
+        self.charge = Expense.objects.create(amount=Decimal('10'), payment=self.payments[0])
+        PaymentLink.objects.create(payment=self.payments[2], amount=Decimal('30'))
+
+    def _post(self, pks):
+        request = RequestFactory().post('/', {'pk': pks})
+        return json.loads(PaymentDisableView.as_view()(request).content.decode())
+
+    def test_bulk_disable(self):
+        result = self._post([p.pk for p in self.payments])
+        self.assertEqual(sorted(result['disabled']), [self.payments[0].pk, self.payments[1].pk])
+        self.assertEqual([e['pk'] for e in result['errors']], [self.payments[2].pk])
+        self.assertEqual(Payment.enabled_objects.count(), 1)
+        self.assertFalse(Expense.objects.get(pk=self.charge.pk).enabled)
+        # 与逐个禁用相同，更新unsettled_amount以及SubCaseBalance
+        self.assertEqual(Payable.objects.get(pk=self.payable.pk).unsettled_amount, Decimal('700'))
+        balance = SubCaseBalance.objects.get(subcase=self.subcase)
+        self.assertEqual(balance.payment_sum_cny, Decimal('270'))
+
+
+class LockAndCheckTestCase(TestCase):
+    def setUp(self):
+        self.payable = Payable.objects.create(no='P1', amount=Decimal('1000'),
+                                              received_date='2017-08-01', due_date='2017-09-01')
+        self.payment = create_payment(self.payable, '800')
+
+    def _check(self, payment):
+        payable_ledger.lock_and_check(payment, 'over settled')
+
+    def test_new_payment_over_settled(self):
+        with self.assertRaises(ValidationError) as cm:
+            self._check(Payment(amount=Decimal('201'), exchange_rate=1, payable=self.payable))
+        self.assertEqual(cm.exception.code, 'over_settled')
+        self._check(Payment(amount=Decimal('200'), exchange_rate=1, payable=self.payable))
+
+    def test_changed_payment_checks_difference(self):
+        payment = Payment.objects.get(pk=self.payment.pk)
+        payment.amount = Decimal('1000')
+        self._check(payment)
+        payment.amount = Decimal('1001')
+        with self.assertRaises(ValidationError):
+            self._check(payment)
+
+    def test_moved_payment_checks_new_payable(self):
+        other = Payable.objects.create(no='P2', amount=Decimal('500'),
+                                       received_date='2017-08-01', due_date='2017-09-01')
+        payment = Payment.objects.get(pk=self.payment.pk)
+        payment.payable = other
+        with self.assertRaises(ValidationError):
+            self._check(payment)
+
+
+@skipUnlessDBFeature('has_select_for_update')
+class ConcurrentSettlementTestCase(TransactionTestCase):
+    """
+    : 每个线程使用各自的数据库连接，通过PaymentModelForm.save()保存
+    : sqlite不支持select_for_update，只在MySQL等数据库上运行
+    """
+    def setUp(self):
+        Currency.objects.create(id='CNY', name_chs='人民币', name_en='Yuan')
+        ExpenseType.objects.create(id=100, name='汇款手续费')
+
+    def _payable(self, no, amount):
+        return Payable.objects.create(no=no, amount=Decimal(amount),
+                                      received_date='2017-08-01', due_date='2017-09-01')
+
+    def _form(self, payable, amount):
+        return PaymentModelForm(data={
+            'amount': amount, 'currency': 'CNY', 'exchange_rate': '1',
+            'paid_date': '2017-08-01', 'payable': payable.pk,
+            'payment-amount': '0',
+        })
+
+    def _save(self, form, results):
+        try:
+            form.save()
+            results.append(True)
+        except ValidationError:
+            results.append(False)
+        finally:
+            connection.close()
+
+    def test_no_over_settlement(self):
+        payable = self._payable('P1', '1000')
+        forms = [self._form(payable, '300') for i in range(8)]
+        # 所有form都在其他付款保存之前通过clean()中的检查
+        for form in forms:
+            self.assertTrue(form.is_valid(), form.errors)
+        results = []
+        barrier = threading.Barrier(len(forms))
+
+        def run(form):
+            barrier.wait()
+            self._save(form, results)
+
+        threads = [threading.Thread(target=run, args=(form,)) for form in forms]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(results.count(True), 3)
+        self.assertEqual(Payment.objects.count(), 3)
+        payable.refresh_from_db()
+        self.assertEqual(payable.unsettled_amount, Decimal('100'))
+
+    def test_different_payables_do_not_block(self):
+        locked = self._payable('P1', '1000')
+        other = self._payable('P2', '1000')
+        form = self._form(other, '100')
+        self.assertTrue(form.is_valid(), form.errors)
+        results = []
+        with transaction.atomic():
+            # 当前连接持有P1的行锁直到transaction结束
+            payable_ledger.lock_and_check(Payment(amount=Decimal('100'), payable=locked), 'over settled')
+            thread = threading.Thread(target=self._save, args=(form, results))
+            thread.start()
+            thread.join(5)
+            # P2的付款不需要等待P1的锁
+            self.assertFalse(thread.is_alive())
+        self.assertEqual(results, [True])
+        other.refresh_from_db()
+        self.assertEqual(other.unsettled_amount, Decimal('900'))
@@ -9,6 +9,7 @@ payable_urlpatterns = [
     url(r'^(?P<payable_id>\d+)/$', views.PayableRelatedEntityView.as_view(), name='detail'),
     url(r'^create/$', views.PayableCreateView.as_view(), name='create'),
     url(r'^disable/(?P<payable_id>\d+)/$', views.PayableDisableView.as_view(), name='disable'),
+    url(r'^disable/$', views.PayableDisableView.as_view(), name='bulk_disable'),
 ]
 
 payment_urlpatterns = [
@@ -16,6 +17,7 @@ payment_urlpatterns = [
     url(r'^(?P<payment_id>\d+)/$', views.PaymentRelatedEntityView.as_view(), name='detail'),
     url(r'^create/$', views.PaymentCreateView.as_view(), name='create'),
     url(r'^disable/(?P<payment_id>\d+)/$', views.PaymentDisableView.as_view(), name='disable'),
+    url(r'^disable/$', views.PaymentDisableView.as_view(), name='bulk_disable'),
 ]
 
 payment_link_urlpatterns = [
@@ -23,6 +25,7 @@ payment_link_urlpatterns = [
     url(r'^(?P<paymentlink_id>\d+)/$', views.PaymentLinkRelatedEntityView.as_view(), name='detail'),
     url(r'^create/$', views.PaymentLinkCreateView.as_view(), name='create'),
     url(r'^disable/(?P<paymentlink_id>\d+)/$', views.PaymentLinkDisableView.as_view(), name='disable'),
+    url(r'^disable/$', views.PaymentLinkDisableView.as_view(), name='bulk_disable'),
 ]
 
 urlpatterns = [
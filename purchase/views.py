@@ -1,5 +1,4 @@
 from django.views import generic
-from django.core.exceptions import ValidationError
 
 from utils.views import DataTablesListView, ConfiguredModelFormMixin,\
     RelatedEntityView, DisablementView, FormMessageMixin
@@ -27,14 +26,9 @@ class PayableCreateView(ConfiguredModelFormMixin, generic.CreateView):
 class PayableDisableView(DisablementView):
     model = models.Payable
     pk_url_kwarg = 'payable_id'
-
-    def validate(self):
-        if any(p.enabled for p in self.object.payment_set.all()):
-            raise ValidationError(
-                '不能删除该待付款项：该应付款项具有关联的已付款项',
-                code='invalid'
-            )
-        super().validate()
+    dependency_guards = (
+        ('payment_set', '不能删除该待付款项：该应付款项具有关联的已付款项'),
+    )
 
 
 class PaymentListView(DataTablesListView):
@@ -48,6 +42,10 @@ class PaymentRelatedEntityView(RelatedEntityView):
     pk_url_kwarg = 'payment_id'
     template_name = 'purchase/payment_detail.html'
 
+    def get_main_queryset(self):
+        # 详情信息中的linked_amount/unlinked_amount使用annotation
+        return super().get_main_queryset().with_link_totals()
+
     def get_form(self):
         """
         : 为了简化保证数据完整性的业务逻辑，这里要求payable不能更改
@@ -67,22 +65,11 @@ class PaymentCreateView(FormMessageMixin, ConfiguredModelFormMixin, generic.Crea
 class PaymentDisableView(DisablementView):
     model = models.Payment
     pk_url_kwarg = 'payment_id'
-
-    def disable(self):
-        # 在禁用Payment之前，需要禁用关联的Expense
-        if self.object.transfer_charge:
-            self.object.transfer_charge.enabled = False
-            self.object.transfer_charge.save()
-        super().disable()
-
-    def validate(self):
-        # 判断是否有关联的PaymentLink存在
-        if any(p.enabled for p in self.object.paymentlink_set.all()):
-            raise ValidationError(
-                '不能删除该已付款项：该已付款项具有关联的转移已付款项',
-                code='invalid'
-            )
-        super().validate()
+    dependency_guards = (
+        ('paymentlink_set', '不能删除该已付款项：该已付款项具有关联的转移已付款项'),
+    )
+    # 禁用Payment时，需要禁用作为手续费的Expense
+    cascade_disable = ('transfer_charge', )
 
 
 class PaymentLinkListView(DataTablesListView):
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class SaleConfig(AppConfig):
     name = 'sale'
+
+    def ready(self):
+        from .settlement import receivable_ledger
+        receivable_ledger.connect()
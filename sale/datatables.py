@@ -11,6 +11,12 @@ class ReceivableDataTable(ModelDataTable):
         fields = ['no', 'amount', 'unsettled_amount',
                   'currency__name_chs', 'subcase__name']
         detail_url_format = '/receivable/{}'
+        pagination = 'keyset'
+        column_search = True
+        column_lookups = {
+            'no': 'istartswith',
+        }
+        approximate_count = True
 
 
 class ReceiptsDataTable(ModelDataTable):
@@ -19,3 +25,7 @@ class ReceiptsDataTable(ModelDataTable):
         fields = ['amount', 'currency__name_chs', 'exchange_rate',
                   'received_date', 'receivable__no']
         detail_url_format = '/receipts/{}'
+        pagination = 'keyset'
+        # 金额等数字列，单个字符的搜索几乎匹配所有行
+        search_min_length = 2
+        approximate_count = True
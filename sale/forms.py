@@ -4,14 +4,20 @@ from decimal import Decimal
 
 from django.forms import ModelForm, TextInput, DecimalField
 from django.core.exceptions import ValidationError
+from django.db import transaction
 
 from . import models
+from .settlement import receivable_ledger
 from base import models as base_models
 from case import models as case_models
 from expense import models as expense_models
 
 from utils.formfield.forms import ModelFormFieldSupportMixin
 from utils.formfield.fields import ModelFormField
+from utils.widgets import RemoteSelect, register_scope, set_scope
+
+
+register_scope(case_models.SubCase)
 
 
 class ReceivableModelForm(ModelForm):
@@ -20,6 +26,7 @@ class ReceivableModelForm(ModelForm):
         fields = ['no', 'amount', 'currency', 'subcase',
                   'sent_date', 'due_date']
         widgets = {
+            'subcase': RemoteSelect,
             'due_date': TextInput(attrs={
                 'data-provide': 'datepicker',
                 'data-date-format': 'yyyy-mm-dd',
@@ -33,7 +40,7 @@ class ReceivableModelForm(ModelForm):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.fields['currency'].queryset = base_models.Currency.enabled_objects
-        self.fields['subcase'].queryset = case_models.SubCase.enabled_objects
+        set_scope(self.fields['subcase'])
 
 
 class TransferChargeModelForm(ModelForm):
@@ -49,6 +56,9 @@ class TransferChargeModelForm(ModelForm):
         fields = ['amount']
 
 
+register_scope(models.Receivable)
+
+
 class ReceiptsModelForm(ModelFormFieldSupportMixin, ModelForm):
     transfer_charge = ModelFormField(
         TransferChargeModelForm,
@@ -62,6 +72,7 @@ class ReceiptsModelForm(ModelFormFieldSupportMixin, ModelForm):
         fields = ['amount', 'currency', 'exchange_rate',
                   'received_date', 'receivable']
         widgets = {
+            'receivable': RemoteSelect,
             'received_date': TextInput(attrs={
                 'data-provide': 'datepicker',
                 'data-date-format': 'yyyy-mm-dd',
@@ -71,7 +82,7 @@ class ReceiptsModelForm(ModelFormFieldSupportMixin, ModelForm):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.fields['currency'].queryset = base_models.Currency.enabled_objects
-        self.fields['receivable'].queryset = models.Receivable.enabled_objects
+        set_scope(self.fields['receivable'])
 
     def clean(self):
         """
@@ -87,6 +98,17 @@ class ReceiptsModelForm(ModelFormFieldSupportMixin, ModelForm):
         if new_amount - old_amount > limit:
             raise ValidationError('收款金额不能大于待收款金额')
 
+    @transaction.atomic
+    def save(self, commit=True):
+        """
+        : clean()中的检查没有加锁，并发录入时可能同时通过检查
+        : 这里锁定关联的Receivable行，在同一个transaction中再次检查并更新unsettled_amount
+        : 超出时抛出ValidationError，由view作为form错误处理
+        """
+        if commit:
+            receivable_ledger.lock_and_check(self.instance, '收款金额不能大于待收款金额')
+        return super().save(commit=commit)
+
     def before_save_related(self):
         # 在存储related formfield之前
         # 1. 将transfer_charge formfield的发生日期设置为付款日期
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+TRIGGERS = [
+    'receivable_before_insert',
+    'receivable_before_update',
+    'receipts_before_insert',
+    'receipts_before_update',
+    'receipts_before_delete',
+]
+
+
+def drop_triggers(apps, schema_editor):
+    # unsettled_amount改为由utils.ledger维护，删除sql/triggers中创建的MySQL触发器
+    if schema_editor.connection.vendor != 'mysql':
+        return
+    for trigger in TRIGGERS:
+        schema_editor.execute('DROP TRIGGER IF EXISTS {}'.format(trigger))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sale', '0011_auto_20170811_0158'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_triggers, migrations.RunPython.noop),
+    ]
@@ -7,13 +7,14 @@ from django.urls import reverse
 from django.utils.functional import cached_property
 
 from base.models import CommonFieldMixin, DescriptionFieldMixin, FakerMixin, EnabledEntityManager
+from utils.ledger import TrackedFieldsMixin
 
 # Create your models here.
 
 BASE_DIR = settings.BASE_DIR
 
 
-class Receivable(CommonFieldMixin, DescriptionFieldMixin):
+class Receivable(TrackedFieldsMixin, FakerMixin, CommonFieldMixin, DescriptionFieldMixin):
     no = models.CharField('待收款账单编号', max_length=100)
     sent_date = models.DateField('账单发送日期', null=True, blank=True)
     due_date = models.DateField('待收期限', null=True, blank=True)
@@ -42,9 +43,12 @@ class Receivable(CommonFieldMixin, DescriptionFieldMixin):
 
     objects = models.Manager()
     enabled_objects = EnabledEntityManager()
+    # unsettled_amount的维护，参考utils.ledger
+    tracked_fields = ('amount',)
 
     modelform_class = 'sale.forms.ReceivableModelForm'
     datatables_class = 'sale.datatables.ReceivableDataTable'
+    detail_select_related = ('subcase__case', 'currency')
     related_entity_config = {
         'sale.receipts': {
             'query_path': 'receivable',
@@ -52,6 +56,16 @@ class Receivable(CommonFieldMixin, DescriptionFieldMixin):
         }
     }
 
+    faker_fields = {
+        'no': 'isbn13',
+        'sent_date': 'date',
+        'due_date': 'date',
+        'amount': ('pydecimal', {'left_digits': 5, 'right_digits': 2, 'positive': True}),
+        'subcase': 'case.models.SubCase',
+        'currency': 'base.models.Currency',
+    }
+    faker_ratio = 6
+
     class Meta:
         verbose_name = '待收款项'
         verbose_name_plural = '待收款项'
@@ -96,7 +110,7 @@ class Receivable(CommonFieldMixin, DescriptionFieldMixin):
         return detail_info
 
 
-class Receipts(CommonFieldMixin, DescriptionFieldMixin):
+class Receipts(TrackedFieldsMixin, FakerMixin, CommonFieldMixin, DescriptionFieldMixin):
     amount = models.DecimalField('已收款金额', max_digits=10, decimal_places=2)
     exchange_rate = models.DecimalField('收款汇率', max_digits=8, decimal_places=4)
     received_date = models.DateField('收款日期')
@@ -122,11 +136,23 @@ class Receipts(CommonFieldMixin, DescriptionFieldMixin):
 
     objects = models.Manager()
     enabled_objects = EnabledEntityManager()
+    # unsettled_amount的维护，参考utils.ledger
+    tracked_fields = ('amount', 'enabled', 'receivable_id')
 
     modelform_class = 'sale.forms.ReceiptsModelForm'
     datatables_class = 'sale.datatables.ReceiptsDataTable'
+    detail_select_related = ('currency', 'transfer_charge', 'receivable')
     related_entity_config = {}
 
+    faker_fields = {
+        'amount': ('pydecimal', {'left_digits': 4, 'right_digits': 2, 'positive': True}),
+        'exchange_rate': ('pydecimal', {'left_digits': 1, 'right_digits': 4, 'positive': True}),
+        'received_date': 'date',
+        'currency': 'base.models.Currency',
+        'receivable': Receivable,
+    }
+    faker_ratio = 6
+
     class Meta:
         verbose_name = '已收款项'
         verbose_name_plural = '已收款项'
@@ -0,0 +1,6 @@
+# -*- coding: utf-8 -*-
+
+from utils.ledger import SettlementLedger
+
+# 根据Receipts维护Receivable.unsettled_amount
+receivable_ledger = SettlementLedger('sale.Receivable', 'sale.Receipts', 'receivable')
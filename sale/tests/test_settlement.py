@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+
+from decimal import Decimal
+from io import StringIO
+
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+
+from base.models import Currency
+from sale.forms import ReceiptsModelForm
+from sale.models import Receivable, Receipts
+from sale.settlement import receivable_ledger
+
+
+class ReceivableLedgerTestCase(TestCase):
+    def setUp(self):
+        self.receivable = Receivable.objects.create(no='R1', amount=Decimal('1000'))
+
+    def _receipts(self, amount, **kwargs):
+        kwargs.setdefault('receivable', self.receivable)
+        return Receipts.objects.create(amount=Decimal(amount), exchange_rate=1,
+                                       received_date='2017-08-01', **kwargs)
+
+    def _unsettled(self, receivable=None):
+        return Receivable.objects.get(pk=(receivable or self.receivable).pk).unsettled_amount
+
+    def test_new_receivable_unsettled_amount(self):
+        receivable = Receivable.objects.create(no='R2', amount=Decimal('1000.15'))
+        self.assertEqual(self._unsettled(receivable), Decimal('1000.15'))
+
+    def test_receivable_amount_change(self):
+        self.assertEqual(self.receivable.unsettled_amount, Decimal('1000'))
+        self._receipts('300')
+        receivable = Receivable.objects.get(pk=self.receivable.pk)
+        receivable.amount = Decimal('1200')
+        receivable.save()
+        self.assertEqual(receivable.unsettled_amount, Decimal('900'))
+        self.assertEqual(self._unsettled(), Decimal('900'))
+
+    def test_receipts_insert_update_delete(self):
+        receipts = self._receipts('300')
+        self.assertEqual(self._unsettled(), Decimal('700'))
+        receipts = Receipts.objects.get(pk=receipts.pk)
+        receipts.amount = Decimal('400')
+        receipts.save()
+        self.assertEqual(self._unsettled(), Decimal('600'))
+        receipts.delete()
+        self.assertEqual(self._unsettled(), Decimal('1000'))
+
+    def test_disable_restores_amount(self):
+        receipts = self._receipts('300')
+        receipts = Receipts.objects.get(pk=receipts.pk)
+        receipts.enabled = False
+        receipts.amount = Decimal('1')
+        receipts.save()
+        self.assertEqual(Receipts.objects.get(pk=receipts.pk).amount, Decimal('300'))
+        self.assertEqual(self._unsettled(), Decimal('1000'))
+        # 已禁用的记录删除时不影响unsettled_amount
+        receipts.delete()
+        self.assertEqual(self._unsettled(), Decimal('1000'))
+
+    def test_batch_single_update(self):
+        other = Receivable.objects.create(no='R2', amount=Decimal('500'))
+        with receivable_ledger.batch():
+            for i in range(3):
+                self._receipts('100')
+                self._receipts('50', receivable=other)
+            self.assertEqual(self._unsettled(), Decimal('1000'))
+        self.assertEqual(self._unsettled(), Decimal('700'))
+        self.assertEqual(self._unsettled(other), Decimal('350'))
+
+    def test_verify_command(self):
+        self._receipts('300')
+        call_command('verify_settlement', stdout=StringIO())
+        Receivable.objects.filter(pk=self.receivable.pk).update(unsettled_amount=0)
+        with self.assertRaises(CommandError):
+            call_command('verify_settlement', stdout=StringIO())
+        call_command('verify_settlement', '--fix', stdout=StringIO())
+        self.assertEqual(self._unsettled(), Decimal('700'))
+
+
+class ReceiptsFormSettlementTestCase(TestCase):
+    def setUp(self):
+        Currency.objects.create(id='USD', name_chs='美元', name_en='US Dollar')
+        self.receivable = Receivable.objects.create(no='R1', amount=Decimal('1000'))
+
+    def _form(self, amount):
+        return ReceiptsModelForm(data={
+            'amount': amount, 'currency': 'USD', 'exchange_rate': '1',
+            'received_date': '2017-08-01', 'receivable': self.receivable.pk,
+            'receipts-amount': '0',
+        })
+
+    def test_limit_checked_again_on_save(self):
+        form = self._form('800')
+        self.assertTrue(form.is_valid(), form.errors)
+        # 在form通过clean()之后，另一个用户录入了收款
+        other = self._form('300')
+        self.assertTrue(other.is_valid(), other.errors)
+        other.save()
+        with self.assertRaises(ValidationError) as cm:
+            form.save()
+        self.assertEqual(cm.exception.code, 'over_settled')
+        self.assertEqual(Receipts.objects.count(), 1)
+        self.assertEqual(Receivable.objects.get(pk=self.receivable.pk).unsettled_amount, Decimal('700'))
+
+
+class PopulateTestCase(TestCase):
+    def _populate(self, seed):
+        Receivable.populate(count=20, seed=seed, batch_size=7)
+        Receipts.populate(count=50, seed=seed, batch_size=7)
+
+    def test_unsettled_amount_maintained(self):
+        self._populate('test')
+        self.assertEqual(Receivable.objects.count(), 20)
+        self.assertEqual(Receipts.objects.filter(receivable__isnull=False).count(), 50)
+        for pk, (balance, expected) in receivable_ledger.get_expected_balances().items():
+            self.assertEqual(balance, expected)
+        for balance in Receivable.objects.values_list('unsettled_amount', flat=True):
+            self.assertGreaterEqual(balance, 0)
+
+    def test_seed_is_reproducible(self):
+        self._populate('test')
+        first = list(Receipts.objects.order_by('pk').values_list('amount', 'receivable__no'))
+        Receipts.objects.all().delete()
+        Receivable.objects.all().delete()
+        self._populate('test')
+        second = list(Receipts.objects.order_by('pk').values_list('amount', 'receivable__no'))
+        self.assertEqual(first, second)
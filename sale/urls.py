@@ -9,6 +9,7 @@ receivable_urlpatterns = [
     url(r'^(?P<receivable_id>\d+)/$', views.ReceivableRelatedEntityView.as_view(), name='detail'),
     url(r'^create/$', views.ReceivableCreateView.as_view(), name='create'),
     url(r'^disable/(?P<receivable_id>\d+)/$', views.ReceivableDisableView.as_view(), name='disable'),
+    url(r'^disable/$', views.ReceivableDisableView.as_view(), name='bulk_disable'),
 ]
 
 receipts_urlpatterns = [
@@ -16,6 +17,7 @@ receipts_urlpatterns = [
     url(r'^(?P<receipts_id>\d+)/$', views.ReceiptsRelatedEntityView.as_view(), name='detail'),
     url(r'^create/$', views.ReceiptsCreateView.as_view(), name='create'),
     url(r'^disable/(?P<receipts_id>\d+)/$', views.ReceiptsDisableView.as_view(), name='disable'),
+    url(r'^disable/$', views.ReceiptsDisableView.as_view(), name='bulk_disable'),
 ]
 
 urlpatterns = [
@@ -1,5 +1,4 @@
 from django.views import generic
-from django.core.exceptions import ValidationError
 
 from utils.views import DataTablesListView, ConfiguredModelFormMixin,\
     RelatedEntityView, DisablementView
@@ -29,14 +28,9 @@ class ReceivableCreateView(ConfiguredModelFormMixin, generic.CreateView):
 class ReceivableDisableView(DisablementView):
     model = models.Receivable
     pk_url_kwarg = 'receivable_id'
-
-    def validate(self):
-        if any(rt.enabled for rt in self.object.receipts_set.all()):
-            raise ValidationError(
-                '不能删除该待收款项：该应收款项具有关联的已收款项',
-                code='invalid'
-            )
-        super().validate()
+    dependency_guards = (
+        ('receipts_set', '不能删除该待收款项：该应收款项具有关联的已收款项'),
+    )
 
 
 class ReceiptsListView(DataTablesListView):
@@ -69,10 +63,5 @@ class ReceiptsCreateView(ConfiguredModelFormMixin, generic.CreateView):
 class ReceiptsDisableView(DisablementView):
     model = models.Receipts
     pk_url_kwarg = 'receipts_id'
-
-    def disable(self):
-        # 在禁用Receipts之前，需要禁用关联的Expense
-        if self.object.transfer_charge:
-            self.object.transfer_charge.enabled = False
-            self.object.transfer_charge.save()
-        super().disable()
+    # 禁用Receipts时，需要禁用作为手续费的Expense
+    cascade_disable = ('transfer_charge', )
@@ -0,0 +1,23 @@
+from django.apps import AppConfig, apps
+from django.db.models.signals import post_save, post_delete, pre_delete
+from django.utils.module_loading import autodiscover_modules
+
+
+class UtilsConfig(AppConfig):
+    name = 'utils'
+
+    def ready(self):
+        from . import caching, search, registry
+        from base.models import CommonFieldMixin
+        # 所有CommonFieldMixin子类发生save/delete时更新版本号，使计数等缓存失效
+        for model in apps.get_models():
+            if issubclass(model, CommonFieldMixin):
+                caching.track(model)
+
+        # 导入所有app的datatables模块，使开启了search_index的ModelDataTable完成注册
+        autodiscover_modules('datatables')
+        # 解析所有model的datatables_class, modelform_class, related_entity_config
+        registry.autodiscover()
+        post_save.connect(search.update_search_documents, dispatch_uid='utils.search.post_save')
+        pre_delete.connect(search.collect_search_documents, dispatch_uid='utils.search.pre_delete')
+        post_delete.connect(search.delete_search_documents, dispatch_uid='utils.search.post_delete')
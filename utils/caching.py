@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+
+"""
+基于model版本号的缓存
+
+每个model在cache中有一个版本号，model发生save/delete时版本号被更新(并发送model_changed signal)，
+缓存的key中包含相关model的版本号，数据变化后旧的缓存不再被读取，由cache后端自然过期
+
+在UtilsConfig.ready()中为所有CommonFieldMixin的子类连接post_save/post_delete，
+其他model可以调用track()，使用queryset.update()等不发送signal的写入需要调用bump_version()
+"""
+
+import time
+
+from django.core.cache import cache
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import Signal
+
+# model的版本号更新之后发送，sender为model class
+model_changed = Signal(providing_args=[])
+
+
+def _version_key(model):
+    return 'model_version:{}'.format(model._meta.label_lower)
+
+
+def get_versions(models):
+    """
+    : 获取models的版本号，不存在时进行初始化
+    :param models: list of model class
+    :return: list of version
+    """
+    keys = [_version_key(m) for m in models]
+    versions = cache.get_many(keys)
+    missing = {k: int(time.time() * 1000) for k in keys if k not in versions}
+    if missing:
+        for k, v in missing.items():
+            cache.add(k, v, None)
+        versions.update(cache.get_many(list(missing)))
+    return [versions.get(k) for k in keys]
+
+
+def get_versions_key(models):
+    """
+    :return: str, 用于拼接cache key
+    """
+    return '.'.join(str(v) for v in get_versions(models))
+
+
+def bump_version(model):
+    """
+    : 更新model的版本号，使包含该model的缓存失效
+    """
+    key = _version_key(model)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # key不存在（从未使用或已被清除），使用时间戳初始化，避免与旧值重复
+        cache.set(key, int(time.time() * 1000), None)
+    model_changed.send(sender=model)
+
+
+def get_or_set(key, models, default, timeout=None):
+    """
+    : 读取依赖于models的缓存，不存在时调用default()并写入缓存
+    :param key: str, 缓存key的前缀
+    :param models: list of model class
+    :param default: callable
+    :param timeout: 缓存时间，None时使用cache后端的默认值
+    """
+    key = '{}:{}'.format(key, get_versions_key(models))
+    value = cache.get(key)
+    if value is None:
+        value = default()
+        if timeout is None:
+            cache.set(key, value)
+        else:
+            cache.set(key, value, timeout)
+    return value
+
+
+def model_saved_or_deleted(sender, **kwargs):
+    """
+    : post_save/post_delete的receiver
+    """
+    bump_version(sender)
+
+
+def track(model):
+    """
+    : 在model发生save/delete时更新版本号
+    """
+    uid = 'utils.caching:{}'.format(model._meta.label_lower)
+    post_save.connect(model_saved_or_deleted, sender=model, dispatch_uid=uid + ':post_save')
+    post_delete.connect(model_saved_or_deleted, sender=model, dispatch_uid=uid + ':post_delete')
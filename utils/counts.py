@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+
+"""
+DataTables server-side请求中recordsTotal/recordsFiltered的计数服务
+
+计数缓存的key中包含了相关model的版本号(utils.caching)，从而在数据变化后自动失效
+
+count_many()用于infobox等需要同时显示多个计数的页面，每个数据库只执行一条查询
+"""
+
+import hashlib
+from collections import OrderedDict
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet
+from django.db import connections
+
+from . import caching
+
+COUNT_CACHE_TIMEOUT = getattr(settings, 'DATATABLES_COUNT_CACHE_TIMEOUT', 60)
+# 表统计信息给出的估计值小于这个值时，直接使用COUNT(*)
+APPROXIMATE_COUNT_THRESHOLD = getattr(settings, 'DATATABLES_APPROXIMATE_COUNT_THRESHOLD', 10000)
+# infobox等页面汇总计数的缓存时间(秒)
+SUMMARY_COUNT_CACHE_TIMEOUT = getattr(settings, 'SUMMARY_COUNT_CACHE_TIMEOUT', 30)
+
+
+def _get_table_estimate(queryset):
+    """
+    : 从数据库的表统计信息中读取估计行数
+    :return: int or None, 数据库不支持时返回None
+    """
+    connection = connections[queryset.db]
+    table = queryset.model._meta.db_table
+    if connection.vendor == 'mysql':
+        sql = ('SELECT TABLE_ROWS FROM information_schema.TABLES '
+               'WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s')
+    elif connection.vendor == 'postgresql':
+        sql = 'SELECT reltuples::bigint FROM pg_class WHERE relname = %s'
+    else:
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [table])
+        row = cursor.fetchone()
+    if row is None or row[0] is None:
+        return None
+    return int(row[0])
+
+
+def count(queryset, dependent_models=None, use_cache=True, approximate=False):
+    """
+    : 获取queryset的计数
+    :param queryset: 需要计数的queryset
+    :param dependent_models: 会影响计数结果的models，queryset的filter中join的表对应的model会自动加入
+    :param use_cache: 是否使用计数缓存
+    :param approximate: 是否允许使用表统计信息的估计值，
+    :                   估计值是整个表的行数，由调用者保证queryset没有任何条件(包括enabled=True)
+    :return: int
+    """
+    # View中的queryset有可能是Manager
+    queryset = queryset.all()
+    if approximate:
+        estimate = _get_table_estimate(queryset)
+        if estimate is not None and estimate >= APPROXIMATE_COUNT_THRESHOLD:
+            return estimate
+
+    if not use_cache:
+        return queryset.count()
+
+    # queryset的SQL已经包含了enabled/disabled, related filter以及search pattern
+    sql, params = queryset.query.sql_with_params()
+    dependent_models = merge_models(dependent_models or [], get_query_models(queryset))
+    digest = hashlib.md5('{}|{!r}'.format(sql, params).encode('utf-8')).hexdigest()
+    key = 'count:{}:{}:{}'.format(
+        queryset.model._meta.label_lower,
+        caching.get_versions_key(dependent_models),
+        digest
+    )
+    result = cache.get(key)
+    if result is None:
+        result = queryset.count()
+        cache.set(key, result, COUNT_CACHE_TIMEOUT)
+    return result
+
+
+def get_query_models(queryset):
+    """
+    : queryset的SQL中用到的所有表对应的model
+    : filter中的join在filter()时加入alias_map，select_related以及排序的join在编译时才加入
+    """
+    queryset = queryset.all()
+    tables = {join.table_name for join in queryset.query.alias_map.values()}
+    models = [queryset.model]
+    models.extend(m for m in apps.get_models() if m._meta.db_table in tables and m is not queryset.model)
+    return models
+
+
+def merge_models(*model_lists):
+    """
+    : 合并多个model list，去掉重复并保持顺序
+    """
+    merged = []
+    for models in model_lists:
+        merged.extend(m for m in models if m not in merged)
+    return merged
+
+
+def count_many(querysets, use_cache=True, timeout=SUMMARY_COUNT_CACHE_TIMEOUT):
+    """
+    : 获取多个queryset的计数，每个数据库只执行一条查询:
+    :   SELECT (SELECT COUNT(*) FROM (...) count_0), (SELECT COUNT(*) FROM (...) count_1), ...
+    : 结果按照所有相关model的版本号缓存，任何一个model发生save/delete时失效
+    :param querysets: dict, name -> queryset(或Manager)
+    :param use_cache: 是否使用缓存
+    :param timeout: 缓存时间
+    :return: OrderedDict, name -> int
+    """
+    compiled = OrderedDict()
+    result = OrderedDict()
+    dependent_models = []
+    for name, queryset in querysets.items():
+        queryset = queryset.all().order_by().values('pk')
+        try:
+            sql, params = queryset.query.get_compiler(queryset.db).as_sql()
+        except EmptyResultSet:
+            # 例如pk__in=[]，不需要查询
+            result[name] = 0
+            continue
+        compiled[name] = (queryset.db, sql, params)
+        dependent_models = merge_models(dependent_models, get_query_models(queryset))
+
+    key = None
+    if use_cache and compiled:
+        digest = hashlib.md5(repr(list(compiled.items())).encode('utf-8')).hexdigest()
+        key = 'count_many:{}:{}'.format(
+            caching.get_versions_key(dependent_models),
+            digest
+        )
+        cached = cache.get(key)
+        if cached is not None:
+            result.update(cached)
+            return OrderedDict((name, result[name]) for name in querysets)
+
+    counts = {}
+    for db in {db for db, sql, params in compiled.values()}:
+        names = [name for name, (name_db, sql, params) in compiled.items() if name_db == db]
+        selects = []
+        query_params = []
+        for i, name in enumerate(names):
+            sql, params = compiled[name][1:]
+            selects.append('(SELECT COUNT(*) FROM ({}) count_{})'.format(sql, i))
+            query_params.extend(params)
+        with connections[db].cursor() as cursor:
+            cursor.execute('SELECT {}'.format(', '.join(selects)), query_params)
+            row = cursor.fetchone()
+        counts.update(zip(names, (int(c) for c in row)))
+
+    if key is not None:
+        cache.set(key, counts, timeout)
+    result.update(counts)
+    return OrderedDict((name, result[name]) for name in querysets)
@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+
+"""
+DataTablesListView以及RelatedEntityView中related entity列表的数据导出
+
+使用ModelDataTable的column title作为表头，
+数据按照(排序列, pk)进行keyset分批读取，每批是一条独立的LIMIT查询，
+MySQL(mysqlclient)的默认游标会把整个结果集读到客户端，iterator()并不能减少内存，
+分批读取使内存只与EXPORT_BATCH_SIZE相关
+"""
+
+import csv
+import tempfile
+
+from django.conf import settings
+from django.db.models import F, Q
+from django.http import StreamingHttpResponse, FileResponse
+from django.utils import timezone
+
+try:
+    import openpyxl
+except ImportError:
+    openpyxl = None
+
+XLSX_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+# 每批读取的行数
+EXPORT_BATCH_SIZE = getattr(settings, 'DATATABLES_EXPORT_BATCH_SIZE', 2000)
+# xlsx需要在临时文件中生成整个workbook之后才能发送，限制导出的行数，更多的数据使用csv导出
+EXPORT_XLSX_MAX_ROWS = getattr(settings, 'DATATABLES_EXPORT_XLSX_MAX_ROWS', 100000)
+
+
+def get_export_formats():
+    """
+    : xlsx格式需要安装openpyxl
+    :return: list of str
+    """
+    formats = ['csv']
+    if openpyxl is not None:
+        formats.append('xlsx')
+    return formats
+
+
+class _Echo:
+    """
+    : 作为csv.writer的file对象，直接返回写入的内容
+    """
+    def write(self, value):
+        return value
+
+
+def _format_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return '是' if value else '否'
+    return value
+
+
+def _get_ordering(queryset):
+    """
+    : queryset的排序，最后加上pk使顺序唯一
+    :return: list of (field name, 是否降序)
+    """
+    query = queryset.query
+    ordering = query.order_by or (query.get_meta().ordering if query.default_ordering else [])
+    result = []
+    for name in ordering:
+        if not isinstance(name, str) or name == '?':
+            raise ValueError('Unsupported ordering for export: {!r}'.format(name))
+        descending = name.startswith('-')
+        name = name.lstrip('-')
+        if name == queryset.model._meta.pk.name:
+            name = 'pk'
+        result.append((name, descending))
+        if name == 'pk':
+            # pk之后的排序没有作用
+            break
+    if not result or result[-1][0] != 'pk':
+        result.append(('pk', False))
+    return result
+
+
+def _get_order_expression(model, name, descending):
+    """
+    : 可以为NULL的列，NULL视为最大值(升序时在最后，降序时在最前)，与_get_seek_q()一致
+    """
+    # utils.utils导入了这个模块
+    from .utils import _is_nullable_path
+    if not _is_nullable_path(model, name):
+        return '-' + name if descending else name
+    if descending:
+        return F(name).desc(nulls_first=True)
+    return F(name).asc(nulls_last=True)
+
+
+def _get_seek_q(ordering, values):
+    """
+    : 排在values这一行之后的行:
+    :   (a > va) OR (a = va AND b > vb) OR ... OR (a = va AND ... AND pk > vpk)
+    : NULL视为最大值
+    :param ordering: _get_ordering()的结果
+    :param values: 上一批最后一行中排序列的值
+    :return: Q object
+    """
+    seek = None
+    equal = Q()
+    for (name, descending), value in zip(ordering, values):
+        if value is None:
+            after = Q(**{name + '__isnull': False}) if descending else None
+            same = Q(**{name + '__isnull': True})
+        else:
+            after = Q(**{name + ('__lt' if descending else '__gt'): value})
+            if not descending:
+                after |= Q(**{name + '__isnull': True})
+            same = Q(**{name: value})
+        if after is not None:
+            seek = equal & after if seek is None else seek | (equal & after)
+        equal &= same
+    return seek
+
+
+def iter_rows(datatable, queryset, batch_size=None):
+    """
+    : 按照datatable的columns生成数据行
+    : 按照queryset的排序(加上pk)进行keyset分批读取，排序列有索引时每一批的开销相同，
+    : 没有索引的排序列每一批都需要排序
+    :return: generator of list
+    """
+    batch_size = batch_size or EXPORT_BATCH_SIZE
+    fields = list(datatable.columns)
+    ordering = _get_ordering(queryset)
+    order_names = [name for name, descending in ordering]
+    names = fields + [name for name in order_names if name not in fields]
+    positions = [names.index(name) for name in order_names]
+    queryset = queryset.order_by(*[
+        _get_order_expression(queryset.model, name, descending) for name, descending in ordering
+    ]).values_list(*names)
+
+    batch = queryset
+    while True:
+        rows = list(batch[:batch_size])
+        for row in rows:
+            yield [_format_value(v) for v in row[:len(fields)]]
+        if len(rows) < batch_size:
+            return
+        batch = queryset.filter(_get_seek_q(ordering, [rows[-1][i] for i in positions]))
+
+
+def _get_filename(datatable, export_format):
+    return '{}-{}.{}'.format(
+        datatable.table_id.split('-', 1)[-1],
+        timezone.localtime(timezone.now()).strftime('%Y%m%d%H%M%S'),
+        export_format
+    )
+
+
+def export_csv(datatable, queryset):
+    writer = csv.writer(_Echo())
+
+    def _stream():
+        # UTF-8 BOM, 使Excel能够正确识别中文
+        yield '\ufeff'
+        yield writer.writerow(datatable.get_titles())
+        for row in iter_rows(datatable, queryset):
+            yield writer.writerow(row)
+
+    response = StreamingHttpResponse(_stream(), content_type='text/csv; charset=utf-8')
+    response['Content-Disposition'] = 'attachment; filename="{}"'.format(_get_filename(datatable, 'csv'))
+    return response
+
+
+def export_xlsx(datatable, queryset):
+    """
+    : 与csv不同，xlsx不能边读取边发送，需要先在临时文件中生成整个workbook，
+    : 最多导出EXPORT_XLSX_MAX_ROWS行，超出时在最后一行说明
+    """
+    # write_only模式下，openpyxl将已经写入的行保存在临时文件中
+    workbook = openpyxl.Workbook(write_only=True)
+    worksheet = workbook.create_sheet()
+    worksheet.append([str(title) for title in datatable.get_titles()])
+    for i, row in enumerate(iter_rows(datatable, queryset)):
+        if i >= EXPORT_XLSX_MAX_ROWS:
+            worksheet.append(['仅导出了前{}行，请使用csv导出全部数据'.format(EXPORT_XLSX_MAX_ROWS)])
+            break
+        worksheet.append(row)
+    output = tempfile.TemporaryFile()
+    workbook.save(output)
+    output.seek(0)
+
+    response = FileResponse(output, content_type=XLSX_CONTENT_TYPE)
+    response['Content-Disposition'] = 'attachment; filename="{}"'.format(_get_filename(datatable, 'xlsx'))
+    return response
+
+
+def export_response(datatable, queryset, export_format):
+    """
+    :param datatable: ModelDataTable class
+    :param queryset: 已经完成filter以及order_by的queryset
+    :param export_format: 'csv'或'xlsx'
+    :return: HttpResponse
+    """
+    if export_format == 'xlsx':
+        return export_xlsx(datatable, queryset)
+    return export_csv(datatable, queryset)
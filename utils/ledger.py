@@ -0,0 +1,302 @@
+# -*- coding: utf-8 -*-
+
+"""
+待收/待付账单unsettled_amount的维护
+
+取代原来只能在MySQL中使用的触发器(sql/triggers)，
+在应用层根据收/付款记录的变化量，使用F()表达式原子地更新账单的unsettled_amount:
+
+    unsettled_amount = amount - sum(enabled收/付款的amount)
+
+批量写入收/付款记录时，可以使用SettlementLedger.batch()合并对账单的更新，
+使用bulk_create()时需要调用SettlementLedger.prepare_bulk_create()
+"""
+
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from decimal import Decimal
+
+from django.apps import apps
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import F, Sum, Case, When, Value, DecimalField
+from django.db.models.functions import Coalesce
+from django.db.models.signals import pre_save, post_save, post_delete
+
+from . import caching, signals
+
+# 已注册的SettlementLedger
+_ledgers = []
+
+
+class TrackedFieldsMixin:
+    """
+    : 记录model实例从数据库读取(或者最近一次保存)时tracked_fields的值
+    : 用于在保存时计算变化量
+    """
+    tracked_fields = ()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.reset_tracked_values()
+        return instance
+
+    def reset_tracked_values(self):
+        deferred = self.get_deferred_fields()
+        self._tracked_values = {
+            name: getattr(self, name) for name in self.tracked_fields if name not in deferred
+        }
+
+    def get_tracked_value(self, name, default=None):
+        """
+        :return: 数据库中的值，新建的实例返回default
+        """
+        return getattr(self, '_tracked_values', {}).get(name, default)
+
+
+class SettlementLedger:
+    """
+    : 一个账单model(parent)与其收/付款model(child)之间的unsettled_amount维护
+    : parent和child需要继承TrackedFieldsMixin，并在tracked_fields中包含amount等字段
+    """
+    def __init__(self, parent_model, child_model, parent_field,
+                 amount_field='amount', balance_field='unsettled_amount'):
+        """
+        :param parent_model: str, 'app_label.ModelName'形式，例如'purchase.Payable'
+        :param child_model: str, 例如'purchase.Payment'
+        :param parent_field: str, child中指向parent的ForeignKey名
+        """
+        self.parent_model_label = parent_model
+        self.child_model_label = child_model
+        self.parent_field = parent_field
+        self.parent_attname = parent_field + '_id'
+        self.amount_field = amount_field
+        self.balance_field = balance_field
+        self._local = threading.local()
+
+    @property
+    def parent_model(self):
+        return apps.get_model(self.parent_model_label)
+
+    @property
+    def child_model(self):
+        return apps.get_model(self.child_model_label)
+
+    def connect(self):
+        """
+        : 在AppConfig.ready()中调用
+        """
+        uid = 'ledger:{}:{}'.format(self.parent_model_label, self.child_model_label)
+        pre_save.connect(self.parent_pre_save, sender=self.parent_model, dispatch_uid=uid + ':parent_pre_save')
+        post_save.connect(self.parent_post_save, sender=self.parent_model, dispatch_uid=uid + ':parent_post_save')
+        pre_save.connect(self.child_pre_save, sender=self.child_model, dispatch_uid=uid + ':child_pre_save')
+        post_save.connect(self.child_post_save, sender=self.child_model, dispatch_uid=uid + ':child_post_save')
+        post_delete.connect(self.child_post_delete, sender=self.child_model, dispatch_uid=uid + ':child_post_delete')
+        signals.post_bulk_disable.connect(
+            self.child_post_bulk_disable, sender=self.child_model, dispatch_uid=uid + ':child_post_bulk_disable'
+        )
+        if self not in _ledgers:
+            _ledgers.append(self)
+
+    # parent(账单)
+
+    def parent_pre_save(self, sender, instance, raw=False, **kwargs):
+        if raw:
+            return
+        amount = getattr(instance, self.amount_field)
+        if instance._state.adding:
+            # 新建账单时unsettled_amount等于amount
+            setattr(instance, self.balance_field, amount)
+            return
+        delta = amount - instance.get_tracked_value(self.amount_field, amount)
+        if delta:
+            # 根据amount的变化量修改unsettled_amount，
+            # 使用F()表达式，避免覆盖内存中过期的unsettled_amount
+            setattr(instance, self.balance_field, F(self.balance_field) + delta)
+            instance._ledger_refresh = True
+
+    def parent_post_save(self, sender, instance, raw=False, **kwargs):
+        if getattr(instance, '_ledger_refresh', False):
+            instance.refresh_from_db(fields=[self.balance_field])
+            instance._ledger_refresh = False
+        instance.reset_tracked_values()
+
+    # child(收/付款)
+
+    def _get_settled(self, parent_id, amount, enabled):
+        """
+        : child对parent已结算金额的贡献
+        """
+        if not enabled or parent_id is None or not amount:
+            return {}
+        return {parent_id: amount}
+
+    def _get_original_settled(self, instance):
+        return self._get_settled(
+            instance.get_tracked_value(self.parent_attname),
+            instance.get_tracked_value(self.amount_field),
+            instance.get_tracked_value('enabled', False),
+        )
+
+    def child_pre_save(self, sender, instance, raw=False, **kwargs):
+        if raw or instance._state.adding:
+            return
+        if instance.get_tracked_value('enabled') and not instance.enabled:
+            # 与原来的触发器相同：禁用时保持amount不变
+            setattr(instance, self.amount_field, instance.get_tracked_value(self.amount_field))
+
+    def child_post_save(self, sender, instance, created, raw=False, **kwargs):
+        if raw:
+            return
+        deltas = defaultdict(Decimal)
+        if not created:
+            for parent_id, amount in self._get_original_settled(instance).items():
+                deltas[parent_id] -= amount
+        settled = self._get_settled(
+            getattr(instance, self.parent_attname), getattr(instance, self.amount_field), instance.enabled
+        )
+        for parent_id, amount in settled.items():
+            deltas[parent_id] += amount
+        self.record(deltas)
+        instance.reset_tracked_values()
+
+    def child_post_delete(self, sender, instance, **kwargs):
+        deltas = {parent_id: -amount for parent_id, amount in self._get_original_settled(instance).items()}
+        self.record(deltas)
+
+    def child_post_bulk_disable(self, sender, pks, **kwargs):
+        """
+        : 与child_post_save相同，禁用时amount不变，从parent的已结算金额中减去
+        """
+        rows = sender._default_manager.filter(pk__in=pks).exclude(
+            **{self.parent_attname: None}
+        ).order_by().values_list(self.parent_attname).annotate(total=Sum(self.amount_field))
+        self.record({parent_id: -total for parent_id, total in rows})
+
+    def lock_and_check(self, instance, message):
+        """
+        : 锁定instance关联的parent行(select_for_update)，检查保存instance后unsettled_amount不小于0
+        : 需要在保存instance的transaction中调用，
+        : 锁在transaction结束前一直保持，从而检查与child_post_save中的更新之间不会有其他修改
+        : 只锁定一个parent行，不同账单的收/付款之间不会相互阻塞
+        :param instance: 将要保存的child实例
+        :param message: 超出unsettled_amount时ValidationError的信息
+        :raise ValidationError
+        """
+        parent_id = getattr(instance, self.parent_attname)
+        if parent_id is None:
+            return
+        delta = self._get_settled(parent_id, getattr(instance, self.amount_field), instance.enabled).get(parent_id, 0)
+        if not instance._state.adding:
+            delta -= self._get_original_settled(instance).get(parent_id, 0)
+        if delta <= 0:
+            return
+        balance = self.parent_model._default_manager.select_for_update().filter(
+            pk=parent_id
+        ).values_list(self.balance_field, flat=True).first()
+        if balance is None or delta > balance:
+            raise ValidationError(message, code='over_settled')
+
+    def prepare_bulk_create(self, model, objs):
+        """
+        : bulk_create()不发送pre_save/post_save，在bulk_create之前调用，完成相同的维护
+        : parent: unsettled_amount设置为amount
+        : child: 将objs对parent已结算金额的贡献记录到parent的unsettled_amount
+        : 需要与bulk_create在同一个transaction中调用
+        :param model: objs的model class
+        :param objs: 将要写入的model实例
+        """
+        if model is self.parent_model:
+            for obj in objs:
+                setattr(obj, self.balance_field, getattr(obj, self.amount_field))
+        elif model is self.child_model:
+            deltas = defaultdict(Decimal)
+            for obj in objs:
+                settled = self._get_settled(
+                    getattr(obj, self.parent_attname), getattr(obj, self.amount_field), obj.enabled
+                )
+                for parent_id, amount in settled.items():
+                    deltas[parent_id] += amount
+            self.record(deltas)
+
+    # 更新
+
+    def record(self, deltas):
+        """
+        :param deltas: dict, parent pk -> 已结算金额的变化量
+        """
+        pending = getattr(self._local, 'pending', None)
+        if pending is None:
+            self.apply_deltas(deltas)
+            return
+        for parent_id, delta in deltas.items():
+            pending[parent_id] += delta
+
+    def apply_deltas(self, deltas):
+        """
+        : 使用一条UPDATE语句更新所有parent的unsettled_amount
+        """
+        deltas = {parent_id: delta for parent_id, delta in deltas.items() if delta}
+        if not deltas:
+            return
+        if len(deltas) == 1:
+            (parent_id, delta), = deltas.items()
+            expression = Value(delta)
+        else:
+            expression = Case(
+                *[When(pk=parent_id, then=Value(delta)) for parent_id, delta in deltas.items()],
+                output_field=DecimalField()
+            )
+        self.parent_model._default_manager.filter(pk__in=list(deltas)).update(
+            **{self.balance_field: F(self.balance_field) - expression}
+        )
+        # update()不发送post_save，需要手动使相关缓存失效
+        caching.bump_version(self.parent_model)
+
+    @contextmanager
+    def batch(self):
+        """
+        : 在with block中写入的收/付款记录，对账单的更新在block结束时合并为一条UPDATE语句
+        : 所有的写入在同一个transaction中
+        """
+        if getattr(self._local, 'pending', None) is not None:
+            # 嵌套的batch()合并到最外层
+            yield
+            return
+        self._local.pending = defaultdict(Decimal)
+        try:
+            with transaction.atomic():
+                yield
+                deltas, self._local.pending = self._local.pending, None
+                self.apply_deltas(deltas)
+        finally:
+            self._local.pending = None
+
+    # 检查
+
+    def get_expected_balances(self, queryset=None):
+        """
+        : 根据收/付款记录重新计算unsettled_amount
+        :return: dict, parent pk -> (当前值, 正确值)
+        """
+        if queryset is None:
+            queryset = self.parent_model._default_manager.all()
+        child_query = '{}__'.format(self.child_model._meta.model_name)
+        settled = Coalesce(
+            Sum(Case(
+                When(**{child_query + 'enabled': True, 'then': F(child_query + self.amount_field)}),
+                default=Value(Decimal('0')),
+                output_field=DecimalField()
+            )),
+            Value(Decimal('0'))
+        )
+        rows = queryset.order_by().annotate(settled_sum=settled).values_list(
+            'pk', self.balance_field, self.amount_field, 'settled_sum'
+        )
+        return {pk: (balance, amount - settled) for pk, balance, amount, settled in rows}
+
+
+def get_ledgers():
+    return list(_ledgers)
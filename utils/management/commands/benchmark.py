@@ -0,0 +1,344 @@
+# -*- coding: utf-8 -*-
+
+import datetime
+import json
+import logging
+import re
+import statistics
+import sys
+import time
+from collections import namedtuple
+from urllib.parse import urlencode
+
+import django
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import BaseCommand, call_command
+from django.core.management.base import CommandError
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import get_resolver, reverse
+from django.views.generic.edit import CreateView
+
+from base.views import IndexView
+from utils import registry
+from utils.views import DataTablesListView, RelatedEntityView
+
+# setup: 测量之前依次GET的(url, ajax)，用于设置session中的related entity以及keyset cursor
+Endpoint = namedtuple('Endpoint', ['name', 'method', 'path', 'params', 'ajax', 'setup'])
+
+DRAW_LENGTH = 10
+# 不计入查询数量
+SAVEPOINT_SQL = ('SAVEPOINT', 'RELEASE SAVEPOINT', 'ROLLBACK TO SAVEPOINT')
+
+
+# QueryInstrumentationMiddleware的Server-Timing中的查询数量(db)以及query_budget(budget)
+_SERVER_TIMING_QUERIES_RE = re.compile(r'(db|budget);(?:dur=[\d.]+;)?desc="(\d+) queries"')
+
+
+def iter_views(resolver=None, namespace=''):
+    """
+    : 遍历url配置中的class-based view
+    :return: iterator of (url name, view class)，url name包含namespace
+    """
+    if resolver is None:
+        resolver = get_resolver()
+    for pattern in resolver.url_patterns:
+        if hasattr(pattern, 'url_patterns'):
+            ns = namespace
+            if pattern.namespace:
+                ns = '{}{}:'.format(namespace, pattern.namespace)
+            yield from iter_views(pattern, ns)
+            continue
+        view_class = getattr(pattern.callback, 'view_class', None)
+        if view_class is not None and pattern.name:
+            yield namespace + pattern.name, view_class
+
+
+def _get_first_object(model):
+    manager = getattr(model, 'enabled_objects', model._default_manager)
+    return manager.order_by('pk').first()
+
+
+def _get_draw_params(start=0, search='', order_column=0, order_dir='asc'):
+    return {
+        'draw': '1', 'start': str(start), 'length': str(DRAW_LENGTH),
+        'search[value]': search, 'search[regex]': 'false',
+        'order[0][column]': str(order_column), 'order[0][dir]': order_dir,
+    }
+
+
+def _get_form_data(view_class, obj):
+    """
+    : 根据已有对象的值构造create页面POST的数据
+    """
+    view = view_class()
+    form = view.get_form_class()(instance=obj)
+    data = {}
+    for bound_field in form:
+        value = bound_field.value()
+        if value is None or value == []:
+            continue
+        data[bound_field.html_name] = value
+    return data
+
+
+def _get_budget_usage(response):
+    """
+    :return: tuple, (middleware记录的查询数量, query_budget)，没有设置budget时为None
+    """
+    values = {name: int(count) for name, count in
+              _SERVER_TIMING_QUERIES_RE.findall(response.get('Server-Timing', ''))}
+    return values.get('db'), values.get('budget')
+
+
+def _summarize(values):
+    return {
+        'min': round(min(values), 2),
+        'median': round(statistics.median(values), 2),
+        'max': round(max(values), 2),
+    }
+
+
+class Command(BaseCommand):
+    help = 'Time and count queries of list, detail, ajax and create endpoints, output JSON results'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=5,
+                            help='number of warm runs for each endpoint')
+        parser.add_argument('--only', action='append', default=[],
+                            help='only benchmark endpoints whose name starts with the value, e.g. case:')
+        parser.add_argument('--output', help='write JSON results to the file, default stdout')
+        parser.add_argument('--compare', help='JSON results of a previous run')
+        parser.add_argument('--threshold', type=float, default=1.2,
+                            help='median time ratio to the compared run regarded as regression')
+        parser.add_argument('--username', help='run as the user, default a temporary superuser')
+        parser.add_argument('--populate', type=int, metavar='COUNT',
+                            help='run initdb --count COUNT before benchmarking')
+        parser.add_argument('--seed', default='benchmark', help='seed of initdb --populate')
+
+    # endpoints
+
+    def get_list_endpoints(self, name, view_class):
+        path = reverse(name)
+        columns = list(view_class.dt_config.columns)
+        sort_column = min(1, len(columns) - 1)
+        # 与列表页面默认的查询范围(不显示disabled项)相同
+        view = view_class()
+        view.config_dt_queryset({})
+        queryset = view.queryset if view.queryset is not None else view_class.model._default_manager
+        deep = max((queryset.count() - 1) // DRAW_LENGTH * DRAW_LENGTH, 0)
+        obj = _get_first_object(view_class.model)
+        term = str(obj)[:3] if obj is not None else 'a'
+        dt_config = view_class.dt_config
+        if dt_config.pagination == 'keyset' and not dt_config.query_plan.column_list[0].nullable:
+            # 先在同一个session中请求前一页，最后一页使用前一页保存的keyset cursor
+            previous = '{}?{}'.format(path, urlencode(_get_draw_params(start=max(deep - DRAW_LENGTH, 0))))
+            deep_endpoint = Endpoint(name + ' draw deep', 'GET', path, _get_draw_params(start=deep), True,
+                                     ((previous, True),) if deep else ())
+        else:
+            # 直接跳到最后一页，使用OFFSET
+            deep_endpoint = Endpoint(name + ' draw deep offset', 'GET', path, _get_draw_params(start=deep), True, ())
+        return [
+            Endpoint(name, 'GET', path, {}, False, ()),
+            Endpoint(name + ' draw first', 'GET', path, _get_draw_params(), True, ()),
+            deep_endpoint,
+            Endpoint(name + ' draw searched', 'GET', path, _get_draw_params(search=term), True, ()),
+            Endpoint(name + ' draw sorted', 'GET', path,
+                     _get_draw_params(order_column=sort_column, order_dir='desc'), True, ()),
+        ]
+
+    def get_detail_endpoints(self, name, view_class):
+        obj = _get_first_object(view_class.model)
+        if obj is None:
+            return []
+        path = reverse(name, kwargs={view_class.pk_url_kwarg: obj.pk})
+        clear = (path + '?clear', False)
+        endpoints = [Endpoint(name, 'GET', path, {}, False, (clear,))]
+        for action in view_class.main_entity_extra_action:
+            endpoints.append(Endpoint('{} {}'.format(name, action), 'GET', path, {}, False,
+                                      (clear, ('{}?action={}'.format(path, action), False))))
+        # 每个related entity的第一页数据
+        for label in registry.get_related_entity_config(view_class.model) or {}:
+            endpoints.append(Endpoint('{} {} draw'.format(name, label), 'GET', path,
+                                      _get_draw_params(), True,
+                                      (clear, ('{}?current={}'.format(path, label), False))))
+        return endpoints
+
+    def get_create_endpoints(self, name, view_class):
+        path = reverse(name)
+        endpoints = [Endpoint(name, 'GET', path, {}, False, ())]
+        obj = _get_first_object(view_class.model)
+        if obj is not None:
+            endpoints.append(Endpoint(name + ' post', 'POST', path,
+                                      _get_form_data(view_class, obj), False, ()))
+        return endpoints
+
+    def get_endpoints(self, only):
+        endpoints = []
+        for name, view_class in iter_views():
+            if only and not any(name.startswith(prefix) for prefix in only):
+                continue
+            if issubclass(view_class, DataTablesListView):
+                endpoints.extend(self.get_list_endpoints(name, view_class))
+            elif issubclass(view_class, RelatedEntityView):
+                endpoints.extend(self.get_detail_endpoints(name, view_class))
+            elif issubclass(view_class, CreateView):
+                endpoints.extend(self.get_create_endpoints(name, view_class))
+            elif issubclass(view_class, IndexView):
+                endpoints.append(Endpoint(name, 'GET', reverse(name), {}, False, ()))
+        return endpoints
+
+    # 测量
+
+    def request(self, client, endpoint):
+        ajax_extra = {'HTTP_X_REQUESTED_WITH': 'XMLHttpRequest'}
+        for url, ajax in endpoint.setup:
+            client.get(url, **(ajax_extra if ajax else {}))
+        extra = ajax_extra if endpoint.ajax else {}
+        method = client.post if endpoint.method == 'POST' else client.get
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            # 每个请求在savepoint中执行，view中的异常不会影响之后的请求
+            # POST写入的数据回滚，每次测量写入的数据相同
+            with transaction.atomic():
+                response = method(endpoint.path, endpoint.params, **extra)
+                if endpoint.method == 'POST':
+                    transaction.set_rollback(True)
+            elapsed = (time.perf_counter() - started) * 1000
+        count = sum(1 for q in queries if not q['sql'].startswith(SAVEPOINT_SQL))
+        return response, count, elapsed
+
+    def measure(self, client, endpoint, repeat):
+        """
+        : 清空缓存后的第一次请求为cold，之后repeat次为warm(例如datatables draw的缓存命中)
+        """
+        cache.clear()
+        response, cold_queries, cold_ms = self.request(client, endpoint)
+        usages = [_get_budget_usage(response)]
+        timings = []
+        warm_queries = []
+        for _ in range(repeat):
+            response, count, elapsed = self.request(client, endpoint)
+            timings.append(elapsed)
+            warm_queries.append(count)
+            usages.append(_get_budget_usage(response))
+        # 与QUERY_BUDGET_STRICT相同，cold以及warm中任何一次超出query_budget都视为超出
+        budget = usages[-1][1]
+        result = {
+            'name': endpoint.name,
+            'method': endpoint.method,
+            'path': endpoint.path,
+            'ajax': endpoint.ajax,
+            'status': response.status_code,
+            'cold': {'queries': cold_queries, 'ms': round(cold_ms, 2)},
+            'queries': max(warm_queries) if warm_queries else cold_queries,
+            'ms': _summarize(timings or [cold_ms]),
+            'budget': budget,
+            'over_budget': any(b is not None and q is not None and q > b for q, b in usages),
+        }
+        if 'Server-Timing' in response:
+            result['server_timing'] = response['Server-Timing']
+        return result
+
+    def get_user(self, username):
+        user_model = get_user_model()
+        if username:
+            try:
+                return user_model._default_manager.get_by_natural_key(username)
+            except user_model.DoesNotExist:
+                raise CommandError('user {} not found'.format(username))
+        # 在回滚的transaction中创建，不会保留
+        return user_model._default_manager.create_superuser('benchmark', 'benchmark@localhost', None)
+
+    def run(self, options):
+        endpoints = self.get_endpoints(options['only'])
+        results = []
+        with transaction.atomic():
+            client = Client()
+            client.force_login(self.get_user(options['username']))
+            for endpoint in endpoints:
+                try:
+                    result = self.measure(client, endpoint, options['repeat'])
+                except Exception as e:
+                    # 记录出错的endpoint，继续测量其他endpoint
+                    result = {'name': endpoint.name, 'method': endpoint.method, 'path': endpoint.path,
+                              'error': '{}: {}'.format(type(e).__name__, e)}
+                    self.stderr.write('{name}: {error}'.format(**result))
+                else:
+                    message = '{name}: {queries} queries, {ms[median]}ms'.format(**result)
+                    if result['over_budget']:
+                        message += ', exceeding query_budget {}'.format(result['budget'])
+                    self.stderr.write(message)
+                results.append(result)
+            transaction.set_rollback(True)
+        return results
+
+    def get_meta(self, options):
+        return {
+            'created': datetime.datetime.now().isoformat(),
+            'django': django.get_version(),
+            'python': sys.version.split()[0],
+            'vendor': connection.vendor,
+            'repeat': options['repeat'],
+            'rows': {m._meta.label_lower: m._default_manager.count() for m in apps.get_models()},
+        }
+
+    def compare(self, results, path, threshold):
+        """
+        : 与之前的结果比较，查询数量增加或者median时间超过threshold倍时视为regression
+        : 超出view的query_budget时，无论之前的结果如何都视为regression
+        :return: list of str
+        """
+        with open(path) as f:
+            baseline = {r['name']: r for r in json.load(f)['results']}
+        regressions = []
+        for result in results:
+            previous = baseline.get(result['name'])
+            if 'error' in result:
+                regressions.append('{}: {}'.format(result['name'], result['error']))
+                continue
+            if result['over_budget']:
+                regressions.append('{}: queries exceed query_budget {}'.format(result['name'], result['budget']))
+            if previous is None or 'error' in previous:
+                continue
+            if result['queries'] > previous['queries']:
+                regressions.append('{}: queries {} -> {}'.format(
+                    result['name'], previous['queries'], result['queries']))
+            if result['ms']['median'] > previous['ms']['median'] * threshold:
+                regressions.append('{}: median {}ms -> {}ms'.format(
+                    result['name'], previous['ms']['median'], result['ms']['median']))
+        return regressions
+
+    def handle(self, *args, **options):
+        if options['populate']:
+            call_command('initdb', count=options['populate'], seed=options['seed'], stdout=self.stderr)
+
+        # 测试client使用testserver作为host
+        # 不抛出QueryBudgetExceeded，继续测量其他endpoint，超出预算的endpoint在结果中记录为over_budget
+        # 每个请求的instrumentation日志由结果代替，只保留warning
+        logger = logging.getLogger('base.middleware')
+        level = logger.level
+        logger.setLevel(max(level, logging.WARNING))
+        try:
+            with override_settings(ALLOWED_HOSTS=settings.ALLOWED_HOSTS + ['testserver'],
+                                   QUERY_BUDGET_STRICT=False):
+                meta = self.get_meta(options)
+                results = self.run(options)
+        finally:
+            logger.setLevel(level)
+
+        output = json.dumps({'meta': meta, 'results': results}, indent=2, ensure_ascii=False)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output)
+        else:
+            self.stdout.write(output)
+
+        if options['compare']:
+            regressions = self.compare(results, options['compare'], options['threshold'])
+            if regressions:
+                raise CommandError('{} regression(s):\n{}'.format(len(regressions), '\n'.join(regressions)))
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+
+from django.core.management.base import BaseCommand
+from django.db import connections, router
+
+from utils.utils import ModelDataTable
+
+
+def _get_datatable_classes(cls=ModelDataTable):
+    for sub_cls in cls.__subclasses__():
+        yield sub_cls
+        yield from _get_datatable_classes(sub_cls)
+
+
+def _get_indexed_columns(connection, table_name):
+    """
+    : 获取表上所有索引的第一列
+    :return: set of column name
+    """
+    with connection.cursor() as cursor:
+        constraints = connection.introspection.get_constraints(cursor, table_name)
+    return {c['columns'][0] for c in constraints.values()
+            if c['columns'] and (c['index'] or c['unique'] or c['primary_key'])}
+
+
+class Command(BaseCommand):
+    help = 'Report missing indexes for order/filter columns of ModelDataTables'
+
+    def handle(self, *args, **options):
+        indexed_columns = {}
+        missing = 0
+        datatables = sorted(_get_datatable_classes(), key=lambda c: (c.__module__, c.__name__))
+        for datatable in datatables:
+            plan = datatable.query_plan
+            model = plan.model
+            connection = connections[router.db_for_read(model)]
+            table_name = model._meta.db_table
+            if table_name not in indexed_columns:
+                indexed_columns[table_name] = _get_indexed_columns(connection, table_name)
+            for field, reasons in plan.expected_indexes:
+                if field.column in indexed_columns[table_name]:
+                    continue
+                missing += 1
+                self.stdout.write('{}.{}: {}.{} ({})'.format(
+                    datatable.__module__, datatable.__name__,
+                    table_name, field.column, ', '.join(reasons)
+                ))
+        if missing:
+            self.stdout.write('{} missing index(es) found'.format(missing))
+        else:
+            self.stdout.write('No missing indexes found')
@@ -1,9 +1,15 @@
 # -*- coding: utf-8 -*-
 
 import logging
-from django.core.management import BaseCommand
+import multiprocessing
+import time
+
+from django.core.management import BaseCommand, call_command
 from django.core.management.base import CommandError
 from django.apps import apps
+from django.db import connection, connections
+
+from utils import caching, search
 
 
 def _get_dependent_models(model):
@@ -11,58 +17,170 @@ def _get_dependent_models(model):
             if f.related_model != model and (f.one_to_one or f.many_to_one) and f.concrete]
 
 
-def _populate_model(model):
-    try:
-        model.populate()
-    except AttributeError:
-        logging.warning('model {} does not support populate()'
-                        .format(model._meta.verbose_name))
+def _get_populate_kwargs(model, options, ratios):
+    """
+    : 生成数量为--count乘以model的faker_ratio(或者--ratio指定的比例)
+    """
+    ratio = ratios.get(model._meta.label_lower, model.faker_ratio)
+    return {
+        'count': max(int(options['count'] * ratio), 1),
+        'locale': options['locale'],
+        'seed': options['seed'],
+        'batch_size': options['batch_size'],
+    }
+
+
+def _populate_model(task):
+    """
+    : 在worker进程中执行，参数和返回值需要可以pickle
+    :param task: (model label, populate()的参数)
+    :return: (label, 写入的数量, 用时)
+    """
+    label, kwargs = task
+    started = time.time()
+    count = apps.get_model(label).populate(**kwargs)
+    return label, count, time.time() - started
+
 
+def _parse_ratios(values):
+    """
+    :param values: list of 'app_label.ModelName=ratio'
+    :return: dict, model label_lower -> float
+    """
+    ratios = {}
+    for value in values:
+        label, sep, ratio = value.partition('=')
+        try:
+            model = apps.get_model(label)
+            ratios[model._meta.label_lower] = float(ratio)
+        except (LookupError, ValueError):
+            raise CommandError('invalid ratio {}, expected app_label.ModelName=ratio'.format(value))
+    return ratios
 
-def _check_all_dependent_model_initialized(dependencies, initialized):
-    for d in dependencies:
-        if d not in initialized:
-            return False
-    return True
+
+def sort_models(dependencies):
+    """
+    : 拓扑排序，同一层的model之间没有依赖关系
+    :param dependencies: dict, model -> 依赖的model，不在dependencies中的model视为已经初始化
+    :return: list of list, 按照初始化顺序分层
+    :raise CommandError: 存在循环依赖
+    """
+    remaining = {m: set(d for d in deps if d in dependencies and d != m) for m, deps in dependencies.items()}
+    dependents = {m: [] for m in remaining}
+    for m, deps in remaining.items():
+        for d in deps:
+            dependents[d].append(m)
+
+    levels = []
+    ready = [m for m, deps in remaining.items() if not deps]
+    while ready:
+        levels.append(ready)
+        next_ready = []
+        for m in ready:
+            del remaining[m]
+            for dependent in dependents[m]:
+                deps = remaining[dependent]
+                deps.discard(m)
+                if not deps:
+                    next_ready.append(dependent)
+        ready = next_ready
+    if remaining:
+        raise CommandError('circular dependency, cannot order models: {}'.format(
+            ', '.join(sorted(str(m) for m in remaining))
+        ))
+    return levels
 
 
 class Command(BaseCommand):
+    help = 'Populate models with data files or faker, in dependency order'
+
     def add_arguments(self, parser):
         parser.add_argument('app_label', action='store', nargs='?')
         parser.add_argument('model_name', action='store', nargs='?')
+        parser.add_argument('--count', type=int, default=100,
+                            help='number of rows for models with faker_ratio 1')
+        parser.add_argument('--ratio', action='append', default=[],
+                            help='app_label.ModelName=ratio, override faker_ratio of the model')
+        parser.add_argument('--seed', help='seed for reproducible datasets')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--locale', default='en_US')
+        parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count(),
+                            help='number of processes populating models of the same level, '
+                                 'sqlite always uses 1')
 
-    def handle(self, *args, **options):
-        all_models = apps.get_models()
-
+    def get_target_models(self, options):
         if options['app_label'] is None:
-            target_models = all_models
-            initialized = []
+            return apps.get_models()
+        try:
+            target_app = apps.get_app_config(options['app_label'])
+        except LookupError:
+            raise CommandError('app {} not found'.format(options['app_label']))
+        if options['model_name'] is None:
+            return target_app.get_models()
+        try:
+            return [target_app.get_model(options['model_name']), ]
+        except LookupError:
+            raise CommandError('model {} not found'.format(options['model_name']))
+
+    def populate_level(self, level, options, ratios, workers):
+        """
+        : 初始化一层model，workers大于1时使用多个进程
+        :return: list of populated model
+        """
+        tasks = []
+        for model in level:
+            if not hasattr(model, 'populate'):
+                logging.warning('model {} does not support populate()'
+                                .format(model._meta.verbose_name))
+                continue
+            tasks.append((model._meta.label, _get_populate_kwargs(model, options, ratios)))
+
+        if workers > 1 and len(tasks) > 1:
+            # fork之前关闭数据库连接，每个worker使用自己的连接
+            connections.close_all()
+            with multiprocessing.Pool(min(workers, len(tasks))) as pool:
+                results = list(self._report(pool.imap_unordered(_populate_model, tasks)))
         else:
-            try:
-                target_app = apps.get_app_config(options['app_label'])
-            except LookupError as e:
-                raise CommandError('app {} not found'.format(options['app_label']))
-            if options['model_name'] is None:
-                target_models = target_app.get_models()
-            else:
-                try:
-                    target_models = [target_app.get_model(options['model_name']), ]
-                except LookupError:
-                    raise CommandError('model {} not found'.format(options['model_name']))
-            # 需要将iterator转为list
-            # 因为not in操作有可能提前将iterator耗尽
-            target_models = list(target_models)
-            initialized = [m for m in all_models if m not in target_models]
-        init_target = [[m, False, _get_dependent_models(m)] for m in target_models]
-
-        init_target_len = len(init_target)
-        count = 0
-        while init_target_len > count:
-            for m in init_target:
-                if m[1]:
-                    continue
-                if _check_all_dependent_model_initialized(m[2], initialized):
-                    initialized.append(m[0])
-                    _populate_model(m[0])
-                    m[1] = True
-                    count += 1
+            results = list(self._report(map(_populate_model, tasks)))
+
+        populated = []
+        for label, count, elapsed in results:
+            if count:
+                model = apps.get_model(label)
+                # worker进程中的缓存(例如locmem)与当前进程不同
+                caching.bump_version(model)
+                populated.append(model)
+        return populated
+
+    def _report(self, results):
+        for label, count, elapsed in results:
+            self.stdout.write('  {}: {} rows in {:.2f}s'.format(label, count or 0, elapsed))
+            yield label, count, elapsed
+
+    def handle(self, *args, **options):
+        ratios = _parse_ratios(options['ratio'])
+        # 需要将iterator转为list
+        target_models = list(self.get_target_models(options))
+        levels = sort_models({m: _get_dependent_models(m) for m in target_models})
+
+        workers = options['workers']
+        if connection.vendor == 'sqlite':
+            # sqlite不支持并发写入
+            workers = 1
+
+        started = time.time()
+        populated = []
+        for i, level in enumerate(levels, 1):
+            self.stdout.write('level {}/{}: {} model(s)'.format(i, len(levels), len(level)))
+            populated.extend(self.populate_level(level, options, ratios, workers))
+
+        # populate()使用bulk_create，不会触发SubCaseBalance和SearchDocument的更新
+        if apps.is_installed('case'):
+            from case import balance
+            labels = set(balance.BALANCE_SOURCE_MODELS) | {'case.subcase'}
+            if any(m._meta.label_lower in labels for m in populated):
+                call_command('subcase_balance', 'rebuild', stdout=self.stdout)
+        indexed = [m._meta.label for m in populated if m in search.get_registered_models()]
+        if indexed:
+            call_command('rebuild_search_index', *indexed, stdout=self.stdout)
+        self.stdout.write('{} model(s) populated in {:.2f}s'.format(len(populated), time.time() - started))
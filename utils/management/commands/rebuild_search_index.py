@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+
+from django.core.management.base import BaseCommand, CommandError
+from django.apps import apps
+
+from utils import search
+
+
+class Command(BaseCommand):
+    help = 'Rebuild search documents of ModelDataTables with Meta.search_index enabled'
+
+    def add_arguments(self, parser):
+        parser.add_argument('models', nargs='*', help='app_label.ModelName, default to all registered models')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        registered = search.get_registered_models()
+        if options['models']:
+            models = []
+            for label in options['models']:
+                try:
+                    model = apps.get_model(label)
+                except (LookupError, ValueError):
+                    raise CommandError('Model not found: {}'.format(label))
+                if model not in registered:
+                    raise CommandError('Search index is not enabled for {}'.format(label))
+                models.append(model)
+        else:
+            models = registered
+
+        for model in models:
+            count = search.reindex(model, batch_size=options['batch_size'])
+            self.stdout.write('{}: {} documents'.format(model._meta.label, count))
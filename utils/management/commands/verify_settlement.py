@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+
+from django.core.management.base import BaseCommand, CommandError
+
+from utils import ledger
+
+
+class Command(BaseCommand):
+    help = 'Verify unsettled_amount of receivables/payables against their enabled receipts/payments'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true', help='Update incorrect unsettled_amount')
+
+    def handle(self, *args, **options):
+        mismatched = 0
+        for settlement_ledger in ledger.get_ledgers():
+            model = settlement_ledger.parent_model
+            balances = settlement_ledger.get_expected_balances()
+            for pk, (balance, expected) in sorted(balances.items()):
+                if balance == expected:
+                    continue
+                mismatched += 1
+                self.stdout.write('{} {}: unsettled_amount {}, expected {}'.format(
+                    model._meta.label, pk, balance, expected
+                ))
+                if options['fix']:
+                    model._default_manager.filter(pk=pk).update(
+                        **{settlement_ledger.balance_field: expected}
+                    )
+            self.stdout.write('{}: {} checked'.format(model._meta.label, len(balances)))
+
+        if mismatched and not options['fix']:
+            raise CommandError('{} unsettled_amount mismatched'.format(mismatched))
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 10:00
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('utils', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RequestProfile',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(auto_now_add=True, verbose_name='时间')),
+                ('method', models.CharField(max_length=10, verbose_name='method')),
+                ('path', models.CharField(max_length=2000, verbose_name='url')),
+                ('view', models.CharField(blank=True, max_length=200, verbose_name='view')),
+                ('status_code', models.PositiveSmallIntegerField(verbose_name='status')),
+                ('duration', models.FloatField(verbose_name='用时(ms)')),
+                ('query_count', models.PositiveIntegerField(verbose_name='查询数量')),
+                ('queries', models.TextField()),
+                ('trigger', models.CharField(choices=[('flag', 'staff请求'), ('slow', '慢请求')], max_length=10)),
+                ('profile_format', models.CharField(choices=[('pstats', 'pstats'), ('collapsed', 'collapsed stacks')], max_length=10)),
+                ('profile', models.BinaryField()),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-pk'],
+            },
+        ),
+    ]
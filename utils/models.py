@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+
+from django.conf import settings
+from django.db import models
+from django.contrib.contenttypes.models import ContentType
+
+from . import profiling, search
+
+
+class SearchDocumentQuerySet(models.QuerySet):
+    def search(self, pattern):
+        """
+        : 在document中查找pattern
+        : MySQL中使用FULLTEXT(ngram)索引，pattern长度小于ngram_token_size时退回LIKE
+        : 其他数据库使用LIKE，只扫描一个column，不需要join
+        :param pattern: str, 已经经过DataTablesSearchPlanner.normalize()处理
+        :return: queryset
+        """
+        pattern = search.normalize_text(pattern)
+        if self.db_vendor() == 'mysql' and len(pattern) >= search.NGRAM_TOKEN_SIZE:
+            # 使用短语查询，并过滤掉FULLTEXT可能产生的false positive
+            phrase = '"{}"'.format(pattern.replace('"', ' '))
+            return self.extra(
+                where=['MATCH (document) AGAINST (%s IN BOOLEAN MODE)'],
+                params=[phrase]
+            ).filter(document__contains=pattern)
+        return self.filter(document__contains=pattern)
+
+    def db_vendor(self):
+        from django.db import connections
+        return connections[self.db].vendor
+
+
+class SearchDocument(models.Model):
+    """
+    : ModelDataTable全局搜索使用的反规范化搜索文档
+    : 每个开启了Meta.search_index的model实例对应一条记录，
+    : document中保存了所有searchable columns的值(包括跨表的columns)
+    """
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
+    object_id = models.PositiveIntegerField()
+    document = models.TextField()
+
+    objects = SearchDocumentQuerySet.as_manager()
+
+    class Meta:
+        unique_together = ('content_type', 'object_id')
+
+
+class RequestProfileQuerySet(models.QuerySet):
+    def prune(self, keep):
+        """
+        : 只保留最近的keep条记录
+        """
+        boundary = self.order_by('-pk').values_list('pk', flat=True)[keep:keep + 1]
+        if boundary:
+            return self.filter(pk__lte=boundary[0]).delete()[0]
+        return 0
+
+
+class RequestProfile(models.Model):
+    """
+    : base.middleware.ProfilingMiddleware记录的请求profile
+    : profile为utils.profiling中profiler的输出，格式由profile_format指定
+    : queries为请求中执行的查询，json格式
+    """
+    TRIGGER_CHOICES = (
+        ('flag', 'staff请求'),
+        ('slow', '慢请求'),
+    )
+    FORMAT_CHOICES = (
+        (profiling.FORMAT_PSTATS, 'pstats'),
+        (profiling.FORMAT_COLLAPSED, 'collapsed stacks'),
+    )
+
+    created = models.DateTimeField('时间', auto_now_add=True)
+    method = models.CharField('method', max_length=10)
+    path = models.CharField('url', max_length=2000)
+    view = models.CharField('view', max_length=200, blank=True)
+    status_code = models.PositiveSmallIntegerField('status')
+    duration = models.FloatField('用时(ms)')
+    query_count = models.PositiveIntegerField('查询数量')
+    queries = models.TextField()
+    trigger = models.CharField(max_length=10, choices=TRIGGER_CHOICES)
+    profile_format = models.CharField(max_length=10, choices=FORMAT_CHOICES)
+    profile = models.BinaryField()
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.SET_NULL)
+
+    objects = RequestProfileQuerySet.as_manager()
+
+    class Meta:
+        ordering = ['-pk']
+
+    def get_filename(self):
+        extension = 'prof' if self.profile_format == profiling.FORMAT_PSTATS else 'txt'
+        return 'profile-{}.{}'.format(self.pk, extension)
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+
+"""
+请求profile，由base.middleware.ProfilingMiddleware使用
+
+    CallProfiler: cProfile，记录所有函数调用，开销较大，只用于staff显式请求的profile
+    SamplingProfiler: 后台线程定时采样请求线程的调用栈，开销小，可以对所有请求开启，
+                      只保存超过时间阈值的请求
+"""
+
+import cProfile
+import marshal
+import sys
+import threading
+from collections import Counter
+
+FORMAT_PSTATS = 'pstats'
+FORMAT_COLLAPSED = 'collapsed'
+
+
+class CallProfiler:
+    """
+    : 结果为pstats格式(marshal)，可以使用pstats.Stats, snakeviz等工具读取
+    """
+    format = FORMAT_PSTATS
+
+    def __init__(self):
+        self._profile = cProfile.Profile()
+
+    def start(self):
+        self._profile.enable()
+
+    def stop(self):
+        self._profile.disable()
+
+    def dumps(self):
+        self._profile.create_stats()
+        return marshal.dumps(self._profile.stats)
+
+
+class SamplingProfiler:
+    """
+    : 结果为collapsed stack格式，每行为'调用栈(以;分隔) 采样次数'，
+    : 可以使用flamegraph.pl, speedscope等工具生成火焰图
+    : 需要在被采样的线程中调用start()
+    """
+    format = FORMAT_COLLAPSED
+
+    def __init__(self, interval=0.005):
+        """
+        :param interval: 采样间隔(秒)
+        """
+        self.interval = interval
+        self.samples = Counter()
+        self._thread_id = None
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread_id = threading.get_ident()
+        self._thread = threading.Thread(target=self._run, name='profiling-sampler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self._thread_id)
+            if frame is not None:
+                self.samples[self._get_stack(frame)] += 1
+
+    @staticmethod
+    def _get_stack(frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append('{} ({}:{})'.format(code.co_name, code.co_filename, code.co_firstlineno))
+            frame = frame.f_back
+        return ';'.join(reversed(stack))
+
+    def dumps(self):
+        lines = ['{} {}'.format(stack, count) for stack, count in self.samples.most_common()]
+        return '\n'.join(lines).encode('utf-8')
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+
+"""
+model相关配置(datatables_class, modelform_class, related_entity_config, detail_select_related)的注册表
+
+在UtilsConfig.ready()中对所有model的配置进行解析和检查，
+配置错误在启动时即抛出ImproperlyConfigured，
+请求处理过程中(包括每一次ajax draw请求)只需要进行dict查找
+"""
+
+from django.apps import apps
+from django.core.exceptions import ImproperlyConfigured, FieldDoesNotExist
+from django.forms.models import ModelFormMetaclass
+from django.utils.module_loading import import_string
+
+# model -> ModelDataTable class
+_datatables_classes = {}
+# model -> ModelForm class, 没有配置时为None
+_modelform_classes = {}
+# model -> related_entity_config dict, 没有配置时为None
+_related_entity_configs = {}
+# model -> detail_select_related tuple
+_detail_select_related = {}
+
+
+def _model_label(model):
+    return '{}:{}'.format(model._meta.app_label, model._meta.verbose_name)
+
+
+def _resolve_datatables_class(model):
+    from .utils import ModelDataTable
+
+    datatables_class = getattr(model, 'datatables_class', None)
+    if datatables_class is None:
+        return None
+    if isinstance(datatables_class, str):
+        try:
+            datatables_class = import_string(datatables_class)
+        except ImportError:
+            raise ImproperlyConfigured('Error in datatables configured in {}'.format(_model_label(model)))
+    if not isinstance(datatables_class, type) or not issubclass(datatables_class, ModelDataTable):
+        raise ImproperlyConfigured('Improperly configured datatables_class attr in {}'.format(_model_label(model)))
+    return datatables_class
+
+
+def _resolve_modelform_class(model):
+    modelform_class = getattr(model, 'modelform_class', None)
+    if modelform_class is None:
+        return None
+    if isinstance(modelform_class, str):
+        try:
+            modelform_class = import_string(modelform_class)
+        except ImportError:
+            raise ImproperlyConfigured('Error in modelform_class configured in {}'.format(_model_label(model)))
+    if not isinstance(modelform_class, ModelFormMetaclass):
+        raise ImproperlyConfigured('Improperly configured modelform_class attr in {}'.format(_model_label(model)))
+    return modelform_class
+
+
+def _resolve_related_entity_config(model):
+    try:
+        related_entity_config = model.get_related_entity_config()
+    except AttributeError:
+        return None
+    if related_entity_config is None:
+        return None
+    if not isinstance(related_entity_config, dict):
+        raise ImproperlyConfigured('Related entity config for {} must be a dict'.format(_model_label(model)))
+    for related_name, related_config in related_entity_config.items():
+        try:
+            apps.get_model(related_name)
+        except (LookupError, ValueError):
+            raise ImproperlyConfigured('Related entity {} configured in {} not found'
+                                       .format(related_name, _model_label(model)))
+        if not isinstance(related_config.get('query_path'), str):
+            raise ImproperlyConfigured('query_path for {} in {} must be a str'
+                                       .format(related_name, _model_label(model)))
+    return related_entity_config
+
+
+def _resolve_detail_select_related(model):
+    """
+    : detail_select_related中的每一个路径都必须由ForeignKey/OneToOneField组成，
+    : 使得可以在select_related()中使用
+    """
+    paths = getattr(model, 'detail_select_related', ())
+    if isinstance(paths, str):
+        raise ImproperlyConfigured('detail_select_related for {} must be a list or tuple'.format(_model_label(model)))
+    for path in paths:
+        opts = model._meta
+        for name in path.split('__'):
+            try:
+                field = opts.get_field(name)
+            except FieldDoesNotExist:
+                field = None
+            if field is None or not (field.many_to_one or field.one_to_one):
+                raise ImproperlyConfigured('Invalid detail_select_related path {} in {}'
+                                           .format(path, _model_label(model)))
+            opts = field.related_model._meta
+    return tuple(paths)
+
+
+def register(model):
+    """
+    : 解析并检查model的配置
+    """
+    _datatables_classes[model] = _resolve_datatables_class(model)
+    _modelform_classes[model] = _resolve_modelform_class(model)
+    _related_entity_configs[model] = _resolve_related_entity_config(model)
+    _detail_select_related[model] = _resolve_detail_select_related(model)
+
+
+def autodiscover():
+    """
+    : 在UtilsConfig.ready()中调用，注册所有model
+    """
+    for model in apps.get_models():
+        register(model)
+
+
+def _get(registry, model):
+    try:
+        return registry[model]
+    except KeyError:
+        # 没有在启动时注册的model(例如测试中动态定义的model)
+        register(model)
+        return registry[model]
+
+
+def get_datatables_class(model):
+    """
+    :return: ModelDataTable class
+    """
+    datatables_class = _get(_datatables_classes, model)
+    if datatables_class is None:
+        raise ImproperlyConfigured('No datatables class configured in {}'.format(_model_label(model)))
+    return datatables_class
+
+
+def get_modelform_class(model):
+    """
+    :return: ModelForm class, 没有配置时返回None
+    """
+    return _get(_modelform_classes, model)
+
+
+def get_related_entity_config(model):
+    """
+    :return: dict, 没有配置时返回None
+    """
+    return _get(_related_entity_configs, model)
+
+
+def get_detail_select_related(model):
+    """
+    :return: tuple, 详情页面需要select_related的关联路径
+    """
+    return _get(_detail_select_related, model)
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+
+"""
+ModelDataTable全局搜索使用的搜索索引
+
+Meta.search_index = True的ModelDataTable会在这里注册，
+model实例(以及columns路径上的related model实例)保存时，更新对应的SearchDocument，
+DataTablesMixin在处理全局搜索时，只查询SearchDocument.document一列，
+而不是对每一个column(包括join的column)进行LIKE
+
+只有MySQL使用FULLTEXT(ngram)索引，
+其他数据库(以及短于NGRAM_TOKEN_SIZE的pattern)仍然是对document的LIKE '%pattern%'，需要扫描整个表，
+只是避免了join和多列的OR条件
+SearchDocument.object_id为整数，只支持整数主键的model
+"""
+
+from django.conf import settings
+from django.db.models import Q
+
+# 与MySQL的ngram_token_size保持一致
+NGRAM_TOKEN_SIZE = getattr(settings, 'SEARCH_INDEX_NGRAM_TOKEN_SIZE', 2)
+# 各column的值之间的分隔符，保证pattern不会跨column匹配
+DOCUMENT_SEPARATOR = '\n'
+
+# SearchDocument.object_id(PositiveIntegerField)可以保存的主键类型
+INTEGER_PK_TYPES = ('AutoField', 'IntegerField', 'PositiveIntegerField',
+                    'SmallIntegerField', 'PositiveSmallIntegerField')
+
+# model -> ModelDataTable
+_registry = {}
+# related model -> [(indexed model, lookup)]
+_related_lookups = {}
+
+
+def normalize_text(value):
+    return str(value).lower()
+
+
+def _get_relation_prefixes(model, field_name):
+    """
+    : 获取field_name路径上的related model，以及从model到related model的lookup
+    : 例如TrademarkNation的'trademark__client__name'
+    : 返回[(Trademark, 'trademark'), (Client, 'trademark__client')]
+    """
+    prefixes = []
+    parts = field_name.split('__')[:-1]
+    for i in range(len(parts)):
+        field = model._meta.get_field(parts[i])
+        if field.related_model is None:
+            break
+        prefixes.append((field.related_model, '__'.join(parts[:i + 1])))
+        model = field.related_model
+    return prefixes
+
+
+def register(model, datatable):
+    """
+    : 由ModelDataTableMetaClass调用，注册开启了search_index的ModelDataTable
+    :param model: ModelDataTable的Meta.model
+    :param datatable: ModelDataTable class
+    """
+    if model._meta.pk.get_internal_type() not in INTEGER_PK_TYPES:
+        from django.core.exceptions import ImproperlyConfigured
+        raise ImproperlyConfigured('Search index requires an integer primary key, {}.{} is {}'.format(
+            model._meta.label, model._meta.pk.name, model._meta.pk.get_internal_type()
+        ))
+    registered = _registry.get(model)
+    if registered is not None and registered.__qualname__ != datatable.__qualname__:
+        from django.core.exceptions import ImproperlyConfigured
+        raise ImproperlyConfigured('Search index of {} has already been registered by {}'.format(
+            model._meta.label, registered.__qualname__
+        ))
+    _registry[model] = datatable
+    for column in get_search_columns(datatable):
+        for related_model, lookup in _get_relation_prefixes(model, column):
+            lookups = _related_lookups.setdefault(related_model, [])
+            if (model, lookup) not in lookups:
+                lookups.append((model, lookup))
+
+
+def get_registered_models():
+    return list(_registry)
+
+
+def get_search_columns(datatable):
+    return [name for name, column in datatable.columns.items() if column.searchable]
+
+
+def build_document(values):
+    return DOCUMENT_SEPARATOR.join(normalize_text(v) for v in values if v is not None and v != '')
+
+
+def reindex(model, queryset=None, batch_size=1000):
+    """
+    : 重新生成model的SearchDocument
+    :param model: 已注册的model
+    :param queryset: 需要更新的model实例，为None时更新全部
+    :param batch_size: 每次读取/写入的数量
+    :return: int, 更新的document数量
+    """
+    from django.contrib.contenttypes.models import ContentType
+    from .models import SearchDocument
+
+    datatable = _registry[model]
+    columns = get_search_columns(datatable)
+    content_type = ContentType.objects.get_for_model(model)
+    if queryset is None:
+        queryset = model._default_manager.all()
+
+    count = 0
+    pks = list(queryset.order_by('pk').values_list('pk', flat=True))
+    for i in range(0, len(pks), batch_size):
+        batch_pks = pks[i:i + batch_size]
+        rows = model._default_manager.filter(pk__in=batch_pks).values_list('pk', *columns)
+        documents = {}
+        for row in rows:
+            # 跨多值关系的column会产生多行，合并到同一个document中
+            documents.setdefault(row[0], []).extend(row[1:])
+        SearchDocument.objects.filter(content_type=content_type, object_id__in=batch_pks).delete()
+        SearchDocument.objects.bulk_create([
+            SearchDocument(content_type=content_type, object_id=pk, document=build_document(values))
+            for pk, values in documents.items()
+        ])
+        count += len(documents)
+    return count
+
+
+def filter_queryset(queryset, pattern):
+    """
+    : 使用SearchDocument对queryset进行全局搜索
+    :return: queryset
+    """
+    from django.contrib.contenttypes.models import ContentType
+    from .models import SearchDocument
+
+    content_type = ContentType.objects.get_for_model(queryset.model)
+    object_ids = SearchDocument.objects.filter(content_type=content_type).search(pattern).values('object_id')
+    return queryset.filter(pk__in=object_ids)
+
+
+def update_search_documents(sender, instance, **kwargs):
+    """
+    : post_save的receiver
+    """
+    if kwargs.get('raw'):
+        return
+    if sender in _registry:
+        reindex(sender, sender._default_manager.filter(pk=instance.pk))
+    for model, lookup in _related_lookups.get(sender, []):
+        reindex(model, model._default_manager.filter(Q(**{lookup: instance.pk})))
+
+
+def collect_search_documents(sender, instance, **kwargs):
+    """
+    : pre_delete的receiver
+    : related model被删除时，SET_NULL的外键通过UPDATE语句修改，不会产生post_save，
+    : 这里记录受影响的model实例，在post_delete中重新生成document
+    """
+    affected = []
+    for model, lookup in _related_lookups.get(sender, []):
+        pks = list(model._default_manager.filter(Q(**{lookup: instance.pk})).values_list('pk', flat=True))
+        if pks:
+            affected.append((model, pks))
+    instance._search_index_affected = affected
+
+
+def delete_search_documents(sender, instance, **kwargs):
+    """
+    : post_delete的receiver
+    """
+    if sender in _registry:
+        from django.contrib.contenttypes.models import ContentType
+        from .models import SearchDocument
+        SearchDocument.objects.filter(
+            content_type=ContentType.objects.get_for_model(sender),
+            object_id=instance.pk
+        ).delete()
+    for model, pks in getattr(instance, '_search_index_affected', []):
+        reindex(model, model._default_manager.filter(pk__in=pks))
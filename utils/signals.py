@@ -0,0 +1,7 @@
+# -*- coding: utf-8 -*-
+
+from django.dispatch import Signal
+
+# queryset.update(enabled=False)之后发送，sender为model class，pks为被禁用的pk
+# update()不发送post_save，需要根据enabled维护数据的receiver(例如utils.ledger)连接这个signal
+post_bulk_disable = Signal(providing_args=['pks'])
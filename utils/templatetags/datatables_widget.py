@@ -11,12 +11,14 @@ register = Library()
 @register.inclusion_tag('dt_templates/dt_tabel.html')
 def render_table(dt_config, class_=None):
     titles = dt_config.get_titles()
-    return {'dt_config': dt_config, 'titles': titles, 'class': class_}
+    return {'dt_config': dt_config, 'titles': titles, 'class': class_,
+            'columns': dt_config.columns.values()}
 
 
-@register.inclusion_tag('dt_templates/dt_jsscript.html')
-def render_js_script(dt_config):
-    return {'dt_config': dt_config}
+@register.inclusion_tag('dt_templates/dt_jsscript.html', takes_context=True)
+def render_js_script(context, dt_config):
+    # bulk_disable_url由DataTablesListView加入context，存在时显示批量删除按钮
+    return {'dt_config': dt_config, 'bulk_disable_url': context.get('bulk_disable_url')}
 
 
 @register.filter(name='json')
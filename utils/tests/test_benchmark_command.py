@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+
+import io
+import json
+import os
+import tempfile
+from unittest import mock
+
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase
+from django.test.client import Client as TestClient
+from django.test.utils import CaptureQueriesContext
+from django.core.management import call_command
+from django.core.management.base import CommandError
+
+from base.models import Client, Country, Currency
+from base.views import ClientListView
+from sale.models import Receipts
+from sale.views import ReceiptsListView
+from utils.management.commands.benchmark import Command
+
+
+class BenchmarkCommandTestCase(TestCase):
+    def setUp(self):
+        country = Country.objects.create(id='CN', name_en_short='China', calling_code='86', iso_code='CN')
+        currency = Currency.objects.create(id='CNY', name_chs='人民币', name_en='Yuan')
+        for i in range(3):
+            Client.objects.create(name='client {}'.format(i), country=country, currency=currency)
+        fd, self.output = tempfile.mkstemp(suffix='.json')
+        os.close(fd)
+        self.addCleanup(os.remove, self.output)
+
+    def _benchmark(self, *args):
+        call_command('benchmark', '--repeat', '1', '--only', 'client:', '--only', 'index',
+                     '--output', self.output, *args, stderr=io.StringIO())
+        with open(self.output) as f:
+            return json.load(f)
+
+    def test_endpoints_measured(self):
+        results = {r['name']: r for r in self._benchmark()['results']}
+        for name in ['index', 'client:list draw first', 'client:list draw deep offset',
+                     'client:list draw searched', 'client:list draw sorted',
+                     'client:detail', 'client:create', 'client:create post']:
+            self.assertIn(name, results)
+            self.assertNotIn('error', results[name])
+        self.assertEqual(results['client:create post']['status'], 302)
+        self.assertGreater(results['client:list draw first']['cold']['queries'], 0)
+        self.assertEqual(results['client:list']['budget'], ClientListView.query_budget)
+        self.assertFalse(any(r['over_budget'] for r in results.values()))
+        # create post写入的数据被回滚
+        self.assertEqual(Client.objects.count(), 3)
+
+    def test_compare_reports_regression(self):
+        baseline = self._benchmark()
+        for result in baseline['results']:
+            result['queries'] = 0
+        with tempfile.NamedTemporaryFile('w', suffix='.json') as f:
+            json.dump(baseline, f)
+            f.flush()
+            with self.assertRaises(CommandError):
+                self._benchmark('--compare', f.name)
+
+    def test_over_budget_reported(self):
+        baseline = self._benchmark()
+        with tempfile.NamedTemporaryFile('w', suffix='.json') as f:
+            json.dump(baseline, f)
+            f.flush()
+            with mock.patch.object(ClientListView, 'query_budget', 1):
+                with self.assertRaisesRegex(CommandError, 'client:list: queries exceed query_budget 1'):
+                    self._benchmark('--compare', f.name)
+        with open(self.output) as f:
+            results = {r['name']: r for r in json.load(f)['results']}
+        self.assertTrue(results['client:list']['over_budget'])
+        self.assertFalse(results['client:detail']['over_budget'])
+
+    def test_deep_page_uses_keyset_cursor(self):
+        for i in range(35):
+            Receipts.objects.create(amount=Decimal(i + 1), exchange_rate=1, received_date='2017-08-01',
+                                    enabled=i < 25)
+        endpoints = {e.name: e for e in Command().get_list_endpoints('receipts:list', ReceiptsListView)}
+        # 只计算enabled的25行，最后一页从20开始，之前先在同一个session中请求10开始的一页
+        endpoint = endpoints['receipts:list draw deep']
+        self.assertEqual(endpoint.params['start'], '20')
+        self.assertEqual(len(endpoint.setup), 1)
+        self.assertIn('start=10', endpoint.setup[0][0])
+
+        client = TestClient(HTTP_HOST='localhost')
+        client.force_login(User.objects.create_superuser('test_user', 'test_user@test.com', 'testpassword'))
+        with CaptureQueriesContext(connection) as queries:
+            response = Command().request(client, endpoint)[0]
+        self.assertEqual(len(json.loads(response.content.decode())['data']), 5)
+        # 最后一次查询数据的SQL使用cursor，不使用OFFSET
+        fetch = [q['sql'] for q in queries if 'FROM "sale_receipts"' in q['sql'] and 'LIMIT' in q['sql']]
+        self.assertNotIn('OFFSET', fetch[-1])
+        self.assertIn('OFFSET', fetch[0])
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+
+from django.test import TestCase
+from django.core.cache import cache
+
+from utils import caching
+from base.models import Client, Country
+
+
+class ModelVersionTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_save_and_delete_bump_version(self):
+        version = caching.get_versions([Client])[0]
+        client = Client.objects.create(name='client')
+        self.assertNotEqual(caching.get_versions([Client])[0], version)
+        version = caching.get_versions([Client])[0]
+        client.delete()
+        self.assertNotEqual(caching.get_versions([Client])[0], version)
+
+    def test_model_changed_signal(self):
+        senders = []
+
+        def receiver(sender, **kwargs):
+            senders.append(sender)
+
+        caching.model_changed.connect(receiver)
+        try:
+            Country.objects.create(id='CN', name_en_short='China', calling_code='86', iso_code='CN')
+        finally:
+            caching.model_changed.disconnect(receiver)
+        self.assertEqual(senders, [Country])
+
+    def test_get_or_set(self):
+        calls = []
+
+        def compute():
+            calls.append(1)
+            return Client.objects.count()
+
+        self.assertEqual(caching.get_or_set('client_count', [Client], compute), 0)
+        self.assertEqual(caching.get_or_set('client_count', [Client], compute), 0)
+        self.assertEqual(len(calls), 1)
+        Client.objects.create(name='client')
+        self.assertEqual(caching.get_or_set('client_count', [Client], compute), 1)
+        self.assertEqual(len(calls), 2)
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+
+import json
+from unittest import mock
+
+from django.test import TestCase, RequestFactory
+from django.core.cache import cache
+from django.contrib.sessions.middleware import SessionMiddleware
+
+from utils import counts
+from utils.utils import ModelDataTable
+from utils.views import DataTablesListView
+from base.models import Client, Country, Trademark
+from base.datatables import ClientDataTable
+
+
+class ApproximateClientDataTable(ModelDataTable):
+    class Meta:
+        model = Client
+        fields = ['name']
+        approximate_count = True
+
+
+class ApproximateClientListView(DataTablesListView):
+    dt_config = ApproximateClientDataTable
+    model = Client
+
+
+class CountCacheTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.country = Country.objects.create(id='CN', name_en_short='China', calling_code='86', iso_code='CN')
+        for i in range(3):
+            Client.objects.create(name='client {}'.format(i), country=self.country)
+
+    def _count(self, queryset):
+        return counts.count(queryset, dependent_models=ClientDataTable.dependent_models)
+
+    def test_dependent_models_follow_column_paths(self):
+        self.assertEqual(ClientDataTable.dependent_models, [Client, Country])
+
+    def test_count_is_cached(self):
+        self.assertEqual(self._count(Client.enabled_objects), 3)
+        with self.assertNumQueries(0):
+            self.assertEqual(self._count(Client.enabled_objects), 3)
+
+    def test_search_pattern_is_part_of_key(self):
+        self.assertEqual(self._count(Client.enabled_objects), 3)
+        self.assertEqual(self._count(Client.enabled_objects.filter(name__icontains='1')), 1)
+
+    def test_disable_invalidates_count(self):
+        self.assertEqual(self._count(Client.enabled_objects), 3)
+        client = Client.objects.first()
+        client.enabled = False
+        client.save()
+        self.assertEqual(self._count(Client.enabled_objects), 2)
+        self.assertEqual(self._count(Client.objects), 3)
+
+    def test_approximate_count_falls_back_to_exact(self):
+        # sqlite等不提供表统计信息的数据库，使用COUNT(*)
+        self.assertEqual(counts.count(Client.objects, use_cache=False, approximate=True), 3)
+
+    def test_filter_joins_are_dependent(self):
+        # related entity的filter(例如trademark__client)中join的表也会使缓存失效
+        Trademark.objects.create(name='trademark', client=Client.objects.first())
+        queryset = Trademark.objects.filter(client__name='client 0')
+        self.assertEqual(counts.count(queryset, dependent_models=[Trademark]), 1)
+        Client.objects.filter(name='client 0').update(name='renamed')
+        # update()不发送post_save，手动修改版本号
+        from utils import caching
+        caching.bump_version(Client)
+        self.assertEqual(counts.count(queryset, dependent_models=[Trademark]), 0)
+
+
+class ApproximateCountViewTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        for i in range(3):
+            Client.objects.create(name='client {}'.format(i))
+        Client.objects.create(name='disabled', enabled=False)
+
+    def _draw(self, pattern='', show_disabled='0'):
+        req = RequestFactory().get('/', {
+            'draw': '1', 'start': '0', 'length': '10',
+            'search[value]': pattern, 'search[regex]': 'false',
+            'order[0][column]': '0', 'order[0][dir]': 'asc',
+            'show_disabled': show_disabled,
+        }, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        SessionMiddleware().process_request(req)
+        return json.loads(ApproximateClientListView.as_view()(req).content.decode())
+
+    @mock.patch('utils.counts._get_table_estimate', return_value=50000)
+    def test_estimate_used_without_conditions(self, estimate):
+        result = self._draw(show_disabled='1')
+        self.assertEqual(result['recordsTotal'], 50000)
+        self.assertEqual(result['recordsFiltered'], 50000)
+        # 搜索结果仍然使用COUNT(*)
+        result = self._draw('client 1', show_disabled='1')
+        self.assertEqual(result['recordsTotal'], 50000)
+        self.assertEqual(result['recordsFiltered'], 1)
+        self.assertEqual(estimate.call_count, 2)
+
+    @mock.patch('utils.counts._get_table_estimate', return_value=50000)
+    def test_estimate_not_used_with_enabled_filter(self, estimate):
+        # 表统计信息中包含disabled的行
+        result = self._draw()
+        self.assertEqual(result['recordsTotal'], 3)
+        self.assertEqual(result['recordsFiltered'], 3)
+        result = self._draw('client 1')
+        self.assertEqual(result['recordsTotal'], 3)
+        self.assertEqual(result['recordsFiltered'], 1)
+        self.assertFalse(estimate.called)
+
+    def test_related_filter_is_not_unfiltered(self):
+        view = ApproximateClientListView()
+        view.model = Client
+        self.assertTrue(view.is_unfiltered_queryset(Client.objects.all()))
+        self.assertFalse(view.is_unfiltered_queryset(Client.enabled_objects.all()))
+        self.assertFalse(view.is_unfiltered_queryset(Client.objects.filter(country__id='CN')))
+
+
+class CountManyTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.country = Country.objects.create(id='CN', name_en_short='China', calling_code='86', iso_code='CN')
+        for i in range(3):
+            Client.objects.create(name='client {}'.format(i), country=self.country if i else None)
+
+    def _querysets(self):
+        return {
+            'clients': Client.enabled_objects,
+            'in_country': Client.enabled_objects.filter(country__name_en_short='China'),
+            'countries': Country.objects.all(),
+            'none': Client.objects.filter(pk__in=[]),
+        }
+
+    def test_single_query(self):
+        with self.assertNumQueries(1):
+            result = counts.count_many(self._querysets(), use_cache=False)
+        self.assertEqual(result, {'clients': 3, 'in_country': 2, 'countries': 1, 'none': 0})
+
+    def test_cached_until_related_model_saved(self):
+        counts.count_many(self._querysets())
+        with self.assertNumQueries(0):
+            counts.count_many(self._querysets())
+        # 被join的Country发生变化时同样失效
+        self.country.name_en_short = 'PRC'
+        self.country.save()
+        self.assertEqual(counts.count_many(self._querysets())['in_country'], 0)
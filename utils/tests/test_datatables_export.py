@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+
+import csv
+import io
+import unittest
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.contrib.sessions.middleware import SessionMiddleware
+from django.test import TestCase, RequestFactory, override_settings
+from django.urls import reverse
+
+from utils import export
+from utils.views import DataTablesListView
+from base.models import Client
+from base.datatables import ClientDataTable
+
+
+class ClientListView(DataTablesListView):
+    dt_config = ClientDataTable
+    model = Client
+
+
+class ExportTestCase(TestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+        for name in ('beta', 'alpha', 'gamma'):
+            Client.objects.create(name=name, is_agent=name == 'alpha')
+        Client.objects.create(name='disabled', enabled=False)
+
+    def _export(self, export_format='csv', **params):
+        query = {'export': export_format, 'order[0][column]': '0', 'order[0][dir]': 'asc'}
+        query.update(params)
+        req = self.factory.get('/', query)
+        SessionMiddleware().process_request(req)
+        return ClientListView.as_view()(req)
+
+    def _read_csv(self, response):
+        content = b''.join(response.streaming_content).decode('utf-8')
+        return list(csv.reader(io.StringIO(content.lstrip('\ufeff'))))
+
+    def test_csv_uses_titles_and_order(self):
+        response = self._export()
+        self.assertIn('attachment', response['Content-Disposition'])
+        rows = self._read_csv(response)
+        self.assertEqual(rows[0], ClientDataTable.get_titles())
+        self.assertEqual([row[0] for row in rows[1:]], ['alpha', 'beta', 'gamma'])
+        self.assertEqual(rows[1][1], '是')
+
+    def test_csv_applies_search_and_show_disabled(self):
+        rows = self._read_csv(self._export(**{'search[value]': 'a', 'search[regex]': 'false',
+                                              'show_disabled': '1'}))
+        self.assertEqual([row[0] for row in rows[1:]], ['alpha', 'beta', 'disabled', 'gamma'])
+
+    def test_unsupported_format(self):
+        self.assertEqual(self._export('pdf').status_code, 400)
+
+    def test_batches_match_single_query(self):
+        # email可以为NULL，NULL与重复值都需要在分批之间保持顺序
+        for i, email in enumerate([None, 'a@test.com', None, 'a@test.com', 'b@test.com']):
+            Client.objects.create(name='client {}'.format(i), email=email)
+        for ordering in (['name'], ['-email'], ['email'], ['email', '-name'], []):
+            queryset = Client.objects.order_by(*ordering)
+            expected = list(export.iter_rows(ClientDataTable, queryset, batch_size=100))
+            with self.assertNumQueries(5):
+                rows = list(export.iter_rows(ClientDataTable, queryset, batch_size=2))
+            self.assertEqual(rows, expected, ordering)
+            self.assertEqual(len(rows), 9)
+
+    @unittest.skipUnless(export.openpyxl, 'openpyxl is not installed')
+    @override_settings(QUERY_BUDGET_STRICT=True)
+    def test_xlsx_export_not_limited_by_query_budget(self):
+        for i in range(10):
+            Client.objects.create(name='client {}'.format(i))
+        self.client.force_login(User.objects.create_superuser('test_user', 'test_user@test.com', 'testpassword'))
+        params = {'export': 'xlsx', 'order[0][column]': '0', 'order[0][dir]': 'asc'}
+        # 13行分为7批读取，超过ClientListView的query_budget
+        with mock.patch.object(export, 'EXPORT_BATCH_SIZE', 2):
+            response = self.client.get(reverse('client:list'), params, HTTP_HOST='localhost')
+        self.assertEqual(response.status_code, 200)
+        workbook = export.openpyxl.load_workbook(io.BytesIO(b''.join(response.streaming_content)))
+        self.assertEqual(workbook.active.max_row, 14)
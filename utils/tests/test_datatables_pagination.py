@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+
+import json
+
+from django.test import TestCase, RequestFactory
+from django.contrib.sessions.middleware import SessionMiddleware
+
+from utils.utils import ModelDataTable
+from utils.views import DataTablesListView
+from base.models import Client, Trademark, TrademarkNation
+from base.datatables import TrademarkNationDataTable
+
+
+class KeysetClientDataTable(ModelDataTable):
+    class Meta:
+        model = Client
+        fields = ['name', 'email']
+        pagination = 'keyset'
+
+
+class KeysetClientListView(DataTablesListView):
+    dt_config = KeysetClientDataTable
+    model = Client
+
+
+class KeysetPaginationTestCase(TestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.session_middleware = SessionMiddleware()
+        # 名称重复，用于验证pk作为第二排序条件
+        for i in range(25):
+            Client.objects.create(name='client {:02d}'.format(i // 2), email=None)
+
+    def _draw(self, start, session=None, order_column=0, order_dir='asc'):
+        req = self.factory.get('/', {
+            'draw': '1', 'start': str(start), 'length': '10',
+            'search[value]': '', 'search[regex]': 'false',
+            'order[0][column]': str(order_column), 'order[0][dir]': order_dir,
+        }, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.session_middleware.process_request(req)
+        if session is not None:
+            req.session = session
+        res = KeysetClientListView.as_view()(req)
+        return json.loads(res.content.decode()), req.session
+
+    def test_nullable_column_is_not_keyset(self):
+        view = KeysetClientListView()
+        view.request = self.factory.get('/')
+        self.session_middleware.process_request(view.request)
+        self.assertTrue(view.is_keyset_pagination(KeysetClientDataTable.columns['name']))
+        self.assertFalse(view.is_keyset_pagination(KeysetClientDataTable.columns['email']))
+
+    def test_sequential_pages_match_offset_pages(self):
+        expected = list(Client.enabled_objects.order_by('name', 'pk').values_list('pk', flat=True))
+        session = None
+        pks = []
+        for start in (0, 10, 20):
+            result, session = self._draw(start, session)
+            self.assertEqual(result['recordsTotal'], 25)
+            self.assertEqual(result['recordsFiltered'], 25)
+            pks.extend(row['pk'] for row in result['data'])
+        self.assertEqual(pks, expected)
+        cursors = session['dt_keyset_{}'.format(KeysetClientDataTable.table_id)]['cursors']
+        self.assertIn('10', cursors)
+        self.assertIn('20', cursors)
+
+    def test_descending_pages(self):
+        expected = list(Client.enabled_objects.order_by('-name', '-pk').values_list('pk', flat=True))
+        result, session = self._draw(0, order_dir='desc')
+        result2, session = self._draw(10, session, order_dir='desc')
+        pks = [row['pk'] for row in result['data'] + result2['data']]
+        self.assertEqual(pks, expected[:20])
+
+
+class QueryPlanTestCase(TestCase):
+    def setUp(self):
+        client = Client.objects.create(name='client')
+        trademark = Trademark.objects.create(name='trademark', client=client)
+        for i in range(5):
+            TrademarkNation.objects.create(app_no='{:02d}'.format(i), trademark=trademark if i % 2 else None)
+
+    def test_joins_precomputed(self):
+        plan = TrademarkNationDataTable.query_plan
+        self.assertEqual(plan.joins, {'trademark', 'trademark__client', 'country'})
+        self.assertEqual(plan.get_joins(['-app_no']), set())
+        self.assertEqual(plan.get_joins(['trademark__client__name']), {'trademark', 'trademark__client'})
+
+    def test_late_row_lookup_keeps_order(self):
+        plan = TrademarkNationDataTable.query_plan
+        queryset = TrademarkNation.objects.order_by('-app_no')[1:4]
+        expected = list(queryset.values(*plan.fields))
+        with self.assertNumQueries(2):
+            self.assertEqual(plan.fetch(queryset), expected)
+        # 排序列需要全部的join时，不需要再次查询
+        queryset = TrademarkNation.objects.order_by('trademark__client__name', 'country__name_chs', 'pk')
+        with self.assertNumQueries(1):
+            plan.fetch(queryset)
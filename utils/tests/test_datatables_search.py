@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+
+import json
+
+from django.test import TestCase, RequestFactory
+from django.core.cache import cache
+from django.contrib.sessions.middleware import SessionMiddleware
+
+from utils.utils import DataTablesSearchPlanner, DataTablesColumn, ModelDataTable
+from utils.views import DataTablesListView
+from utils import search
+from utils.models import SearchDocument
+from base.models import Client, Country, Trademark, TrademarkNation
+from base.datatables import ClientDataTable
+
+
+class UnsearchableEmailDataTable(ModelDataTable):
+    email = DataTablesColumn(searchable=False)
+
+    class Meta:
+        model = Client
+        fields = ['name', 'email']
+
+
+class ClientListView(DataTablesListView):
+    dt_config = ClientDataTable
+    model = Client
+
+
+class SearchPlannerTestCase(TestCase):
+    def test_empty_pattern_produces_no_condition(self):
+        planner = DataTablesSearchPlanner(ClientDataTable.columns.values())
+        self.assertIsNone(planner.get_q_object('', False))
+        self.assertIsNone(planner.get_q_object('   ', False))
+        self.assertIsNone(planner.get_q_object(None, False))
+
+    def test_short_pattern_rejected(self):
+        planner = DataTablesSearchPlanner(ClientDataTable.columns.values(), min_length=3)
+        self.assertIsNone(planner.get_q_object('ab', False))
+        self.assertIsNotNone(planner.get_q_object('abc', False))
+
+    def test_only_searchable_columns_used(self):
+        planner = DataTablesSearchPlanner(UnsearchableEmailDataTable.columns.values())
+        q = planner.get_q_object('abc', False)
+        lookups = [child[0] for child in q.children]
+        self.assertIn('name__icontains', lookups)
+        self.assertNotIn('email__icontains', lookups)
+
+
+class DrawCacheTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.factory = RequestFactory()
+        for i in range(3):
+            Client.objects.create(name='client {}'.format(i))
+        self.session = None
+
+    def _draw(self, draw, pattern=''):
+        req = self.factory.get('/', {
+            'draw': str(draw), 'start': '0', 'length': '10', '_': str(draw),
+            'search[value]': pattern, 'search[regex]': 'false',
+            'order[0][column]': '0', 'order[0][dir]': 'asc',
+        }, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        SessionMiddleware().process_request(req)
+        if self.session is None:
+            req.session.save()
+            self.session = req.session
+        req.session = self.session
+        return json.loads(ClientListView.as_view()(req).content.decode())
+
+    def test_repeated_draw_served_from_cache(self):
+        first = self._draw(1, 'client')
+        with self.assertNumQueries(0):
+            second = self._draw(2, 'client')
+        self.assertEqual(second['draw'], 2)
+        self.assertEqual(first['data'], second['data'])
+
+    def test_save_invalidates_cached_draw(self):
+        self._draw(1)
+        Client.objects.create(name='client new')
+        result = self._draw(2)
+        self.assertEqual(result['recordsTotal'], 4)
+
+
+class SearchIndexTestCase(TestCase):
+    def setUp(self):
+        self.client_obj = Client.objects.create(name='Acme Corporation')
+        self.trademark = Trademark.objects.create(name='ROADRUNNER', client=self.client_obj)
+        self.country = Country.objects.create(id='CN', name_en_short='China', name_chs='中国',
+                                              calling_code='86', iso_code='CN')
+        self.nation = TrademarkNation.objects.create(trademark=self.trademark, country=self.country,
+                                                     app_no='20170001')
+        TrademarkNation.objects.create(app_no='20170002')
+
+    def _search(self, pattern):
+        queryset = search.filter_queryset(TrademarkNation.objects.all(), pattern)
+        return list(queryset.values_list('pk', flat=True))
+
+    def test_document_created_on_save(self):
+        self.assertEqual(self._search('20170001'), [self.nation.pk])
+        self.assertEqual(self._search('acme'), [self.nation.pk])
+        self.assertEqual(self._search('中国'), [self.nation.pk])
+
+    def test_related_save_updates_document(self):
+        self.client_obj.name = 'Wile E. Coyote'
+        self.client_obj.save()
+        self.assertEqual(self._search('acme'), [])
+        self.assertEqual(self._search('coyote'), [self.nation.pk])
+
+    def test_related_delete_updates_document(self):
+        self.country.delete()
+        self.assertEqual(self._search('中国'), [])
+
+    def test_pattern_does_not_span_columns(self):
+        # app_no和client name不应该被连接成一个字符串进行匹配
+        self.assertEqual(self._search('0001 acme'), [])
+
+    def test_integer_pk_required(self):
+        from django.core.exceptions import ImproperlyConfigured
+        with self.assertRaises(ImproperlyConfigured):
+            class CountryDataTable(ModelDataTable):
+                class Meta:
+                    model = Country
+                    fields = ['name_chs']
+                    search_index = True
+
+    def test_rebuild(self):
+        SearchDocument.objects.all().delete()
+        self.assertEqual(search.reindex(TrademarkNation), 2)
+        self.assertEqual(self._search('roadrunner'), [self.nation.pk])
+
+
+class ColumnSearchTestCase(TestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+        Client.objects.create(name='b', is_agent=True)
+        Client.objects.create(name='a', is_agent=False)
+        Client.objects.create(name='a', is_agent=True)
+        for i, app_date in enumerate(['2017-01-15', '2017-03-01', '2017-06-30']):
+            TrademarkNation.objects.create(app_no='CN{}'.format(i), app_date=app_date)
+
+    def _q(self, datatable, name, value):
+        return datatable.columns[name].get_column_filter_q_object(value)
+
+    def test_boolean_column_exact(self):
+        q = self._q(ClientDataTable, 'is_agent', 'true')
+        self.assertEqual(Client.objects.filter(q).count(), 2)
+        self.assertIsNone(self._q(ClientDataTable, 'is_agent', 'maybe'))
+
+    def test_date_column_range(self):
+        from base.datatables import TrademarkNationDataTable
+        q = self._q(TrademarkNationDataTable, 'app_date', '2017-02-01~2017-06-30')
+        self.assertEqual(TrademarkNation.objects.filter(q).count(), 2)
+        q = self._q(TrademarkNationDataTable, 'app_date', '~2017-02-01')
+        self.assertEqual(TrademarkNation.objects.filter(q).count(), 1)
+        self.assertIsNone(self._q(TrademarkNationDataTable, 'app_date', 'not a date~'))
+
+    def test_column_lookup_prefix(self):
+        from base.datatables import TrademarkNationDataTable
+        q = self._q(TrademarkNationDataTable, 'app_no', 'cn1')
+        self.assertEqual(list(q.children), [('app_no__istartswith', 'cn1')])
+
+    def test_multi_column_order_and_column_filter(self):
+        req = self.factory.get('/', {
+            'draw': '1', 'start': '0', 'length': '10',
+            'search[value]': '', 'search[regex]': 'false',
+            'columns[1][search][value]': 'true',
+            'order[0][column]': '0', 'order[0][dir]': 'asc',
+            'order[1][column]': '1', 'order[1][dir]': 'desc',
+        }, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        SessionMiddleware().process_request(req)
+        result = json.loads(ClientListView.as_view()(req).content.decode())
+        self.assertEqual(result['recordsTotal'], 3)
+        self.assertEqual(result['recordsFiltered'], 2)
+        self.assertEqual([row['name'] for row in result['data']], ['a', 'b'])
+
+        view = ClientListView()
+        orders = view.get_dt_orders(req.GET)
+        self.assertEqual([(c.name, d) for c, d in orders], [('name', ''), ('is_agent', '-')])
@@ -1,6 +1,6 @@
 # -*- coding: utf-8 -*-
 
-from django.test import TestCase, TransactionTestCase
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
 from django.core.management import call_command
 from django.core.management.base import CommandError
 from django.db import transaction
@@ -89,3 +89,25 @@ class InitdbCommandTestCase(TransactionTestCase):
         self.assertNotEqual(Case.objects.count(), 0)
         self.assertEqual(Client.objects.count(), 0)
         self.assertEqual(Contract.objects.count(), 0)
+
+
+class SortModelsTestCase(SimpleTestCase):
+    def test_levels(self):
+        from utils.management.commands.initdb import sort_models
+        levels = sort_models({
+            'receipts': ['receivable', 'currency'],
+            'receivable': ['subcase', 'currency'],
+            'subcase': ['case'],
+            'case': ['client', 'stage'],
+            'client': ['currency', 'country'],
+            'stage': [],
+            'currency': [],
+        })
+        self.assertEqual([sorted(level) for level in levels], [
+            ['currency', 'stage'], ['client'], ['case'], ['subcase'], ['receivable'], ['receipts'],
+        ])
+
+    def test_circular_dependency(self):
+        from utils.management.commands.initdb import sort_models
+        with self.assertRaisesRegexp(CommandError, 'circular dependency, cannot order models: a, b, d$'):
+            sort_models({'a': ['b'], 'b': ['a'], 'c': [], 'd': ['a']})
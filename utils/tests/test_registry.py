@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+
+from django.test import SimpleTestCase
+from django.core.exceptions import ImproperlyConfigured
+
+from utils import registry
+from base.models import Client, TrademarkNation
+from base.datatables import ClientDataTable
+from base.forms import ClientModelForm
+
+
+class FakeModel:
+    _meta = Client._meta
+    datatables_class = 'base.datatables.NotExistDataTable'
+
+
+class RegistryTestCase(SimpleTestCase):
+    def test_resolved_at_startup(self):
+        self.assertIn(Client, registry._datatables_classes)
+        self.assertIs(registry.get_datatables_class(Client), ClientDataTable)
+        self.assertIs(registry.get_modelform_class(Client), ClientModelForm)
+        self.assertIn('base.trademark', registry.get_related_entity_config(Client))
+
+    def test_misconfiguration_raises(self):
+        with self.assertRaises(ImproperlyConfigured):
+            registry.register(FakeModel)
+        FakeModel.datatables_class = 'base.models.Client'
+        with self.assertRaises(ImproperlyConfigured):
+            registry.register(FakeModel)
+
+    def test_detail_select_related(self):
+        self.assertEqual(registry.get_detail_select_related(TrademarkNation), ('trademark__client', 'country'))
+
+        class ReverseRelationModel:
+            _meta = Client._meta
+            detail_select_related = ('trademark_set',)
+
+        with self.assertRaises(ImproperlyConfigured):
+            registry.register(ReverseRelationModel)
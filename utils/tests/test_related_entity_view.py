@@ -1,6 +1,12 @@
 # -*- coding: utf-8 -*-
 
+from decimal import Decimal
+
 from django.test import TestCase, RequestFactory
+from django.test.utils import override_settings
+from django.urls import reverse
+from utils import registry
+from utils.management.commands.benchmark import iter_views
 from utils.views import RelatedEntityView
 from base.models import Client
 
@@ -23,3 +29,100 @@ class RelatedEntityViewTestCase(TestCase):
         res = ClientRelatedEntityView.as_view()(req, pk=self.client.pk)
         print(res)
         self.assertTrue(res.has_header('set-cookie'))
+
+
+class RelatedEntityQueryBudgetTestCase(TestCase):
+    """
+    : 在QUERY_BUDGET_STRICT下渲染每个RelatedEntityView的详情页面，
+    : 包括main_entity_extra_action(例如show_balance)以及每个related entity的页面和第一页数据，
+    : 查询数量超出view的query_budget时QueryInstrumentationMiddleware抛出QueryBudgetExceeded
+    : 每个对象都有多个关联对象，逐行查询的页面会超出预算
+    """
+    ROWS = 3
+
+    def setUp(self):
+        from base.models import (Continent, Country, Currency, Trademark, TrademarkNation,
+                                 NiceClassification, TrademarkNationNice, Pattern, PatternNation)
+        from case.models import Case, SubCase, Category, Stage
+        from base.models import Owner
+        from sale.models import Receivable, Receipts
+        from purchase.models import Payable, Payment, PaymentLink
+        from income.models import Income, IncomeType
+        from expense.models import Expense, ExpenseType
+
+        continent = Continent.objects.create(id='AS', name_chs='亚洲', name_en='Asia')
+        country = Country.objects.create(id='CN', name_chs='中国', name_en_short='China', calling_code='86',
+                                         iso_code='CHN', continent=continent)
+        Currency.objects.create(id='CNY', name_chs='人民币', name_en='Yuan')
+        usd = Currency.objects.create(id='USD', name_chs='美元', name_en='Dollar')
+        category = Category.objects.create(name='商标')
+        stage = Stage.objects.create(name='申请')
+        owner = Owner.objects.create(name='部门')
+        nice_class = NiceClassification.objects.create(name='1')
+        income_type = IncomeType.objects.create(name='收入')
+        expense_type = ExpenseType.objects.create(name='支出')
+
+        client = Client.objects.create(name='client', is_agent=True, currency=usd, country=country)
+        for i in range(self.ROWS):
+            trademark = Trademark.objects.create(name='trademark {}'.format(i), client=client)
+            trademarknation = TrademarkNation.objects.create(trademark=trademark, country=country)
+            TrademarkNationNice.objects.create(goods='goods', trademarknation=trademarknation, nice_class=nice_class)
+            pattern = Pattern.objects.create(name='pattern {}'.format(i), client=client)
+            patternnation = PatternNation.objects.create(pattern=pattern, country=country)
+            case = Case.objects.create(name='case {}'.format(i), client=client, owner=owner, category=category,
+                                       stage=stage, trademark=trademark, pattern=pattern)
+            for j in range(self.ROWS):
+                subcase = SubCase.objects.create(
+                    name='subcase {}'.format(j), case=case, agent=client, category=category, stage=stage,
+                    trademarknation=trademarknation, patternnation=patternnation,
+                )
+                receivable = Receivable.objects.create(no='R{}{}'.format(i, j), amount=Decimal('1000'),
+                                                       subcase=subcase, currency=usd)
+                payable = Payable.objects.create(no='P{}{}'.format(i, j), amount=Decimal('1000'), subcase=subcase,
+                                                 currency=usd, received_date='2017-08-01', due_date='2017-09-01')
+                for k in range(self.ROWS):
+                    receipts = Receipts.objects.create(amount=Decimal('10'), exchange_rate=Decimal('6.5'),
+                                                       currency=usd, received_date='2017-08-01',
+                                                       receivable=receivable)
+                    Expense.objects.create(amount=Decimal('1'), receipts=receipts, expense_type=expense_type)
+                    payment = Payment.objects.create(amount=Decimal('10'), exchange_rate=Decimal('6.5'),
+                                                     currency=usd, paid_date='2017-08-01', payable=payable)
+                    Expense.objects.create(amount=Decimal('1'), payment=payment, expense_type=expense_type)
+                    PaymentLink.objects.create(amount=Decimal('1'), payment=payment, subcase=subcase)
+                    Income.objects.create(amount=Decimal('10'), currency=usd, subcase=subcase,
+                                          income_type=income_type)
+                    Expense.objects.create(amount=Decimal('10'), currency=usd, subcase=subcase,
+                                           expense_type=expense_type)
+
+        from django.contrib.auth.models import User
+        self.client.force_login(User.objects.create_superuser('test_user', 'test_user@test.com', 'testpassword'))
+
+    def _get(self, path, **extra):
+        return self.client.get(path, HTTP_HOST='localhost', **extra)
+
+    def _get_draw(self, path):
+        params = {'draw': '1', 'start': '0', 'length': '10', 'search[value]': '', 'search[regex]': 'false',
+                  'order[0][column]': '0', 'order[0][dir]': 'asc'}
+        return self.client.get(path, params, HTTP_HOST='localhost', HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+
+    @override_settings(QUERY_BUDGET_STRICT=True)
+    def test_detail_pages_within_budget(self):
+        checked = 0
+        for name, view_class in iter_views():
+            if not issubclass(view_class, RelatedEntityView):
+                continue
+            obj = view_class.model._default_manager.order_by('pk').first()
+            self.assertIsNotNone(obj, name)
+            path = reverse(name, kwargs={view_class.pk_url_kwarg: obj.pk})
+            with self.subTest(view=name):
+                self._get(path + '?clear')
+                self.assertEqual(self._get(path).status_code, 200)
+                for action in view_class.main_entity_extra_action:
+                    self._get('{}?action={}'.format(path, action))
+                    self.assertEqual(self._get(path).status_code, 200)
+                for label in registry.get_related_entity_config(view_class.model) or {}:
+                    self._get('{}?current={}'.format(path, label))
+                    self.assertEqual(self._get(path).status_code, 200)
+                    self.assertEqual(self._get_draw(path).status_code, 200)
+            checked += 1
+        self.assertEqual(checked, 15)
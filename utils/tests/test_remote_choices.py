@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+
+import json
+import re
+
+from django.core import signing
+from django.core.cache import cache
+from django.http import Http404
+from django.test import TestCase, RequestFactory
+
+from utils import widgets
+from utils.views import RemoteChoicesView
+from base.models import Client, Trademark
+from base.forms import TrademarkModelForm
+# 声明Client的agent范围
+from case import forms as case_forms  # noqa
+
+
+class RemoteSelectTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.factory = RequestFactory()
+        self.agents = [Client.objects.create(name='agent {:02d}'.format(i), is_agent=True) for i in range(25)]
+        Client.objects.create(name='agent client', is_agent=False)
+        self.trademark = Trademark.objects.create(name='trademark', client=self.agents[3])
+
+    def _render(self):
+        form = TrademarkModelForm(instance=self.trademark)
+        # 与SubCaseModelForm的agent字段范围相同
+        widgets.set_scope(form.fields['client'], 'agent')
+        return str(form['client'])
+
+    def _token(self, html):
+        return re.search(r'data-remote-url="/utils/remote-choices/([^/]+)/"', html).group(1)
+
+    def _get(self, html, **params):
+        return self._get_token(self._token(html), **params)
+
+    def _get_token(self, token, **params):
+        res = RemoteChoicesView.as_view()(self.factory.get('/', params), token=token)
+        return json.loads(res.content.decode())
+
+    def test_only_selected_option_rendered(self):
+        html = self._render()
+        self.assertEqual(len(re.findall(r'<option', html)), 2)
+        self.assertIn('selected>agent 03</option>', html)
+
+    def test_paged_search_respects_queryset(self):
+        html = self._render()
+        result = self._get(html, term='agent')
+        self.assertEqual(len(result['results']), 20)
+        self.assertTrue(result['pagination']['more'])
+        result = self._get(html, term='agent', page=2)
+        self.assertEqual(len(result['results']), 5)
+        self.assertFalse(result['pagination']['more'])
+        self.assertNotIn('agent client', [r['text'] for r in result['results']])
+        result = self._get(html, term='agent 1')
+        self.assertEqual(len(result['results']), 10)
+
+    def test_default_scope(self):
+        form = TrademarkModelForm(instance=self.trademark)
+        result = self._get(str(form['client']), term='agent client')
+        self.assertEqual([r['text'] for r in result['results']], ['agent client'])
+
+
+    def test_token_does_not_depend_on_cache(self):
+        html = self._render()
+        # 例如由另一个进程处理搜索请求
+        cache.clear()
+        result = self._get(html, term='agent client')
+        self.assertEqual(result['results'], [])
+        self.assertEqual(len(self._get(html, term='agent 0')['results']), 10)
+
+    def test_tampered_token(self):
+        token = self._token(self._render())
+        with self.assertRaises(Http404):
+            RemoteChoicesView.as_view()(self.factory.get('/'), token=token + 'a')
+
+    def test_forged_token_limited_to_registered_scopes(self):
+        # SECRET_KEY泄露时可以伪造签名，但是只能使用已声明的范围和参数
+        token = widgets.get_token('base.Client', 'agent', {})
+        self.assertEqual(len(self._get_token(token, term='agent')['results']), 20)
+        for label, name, params in [('base.Client', 'unknown', {}),
+                                    ('auth.User', 'enabled', {}),
+                                    ('base.Client', 'agent', {'is_agent': 0}),
+                                    ('case.Case', 'enabled', {'trademark_id': [1]})]:
+            with self.subTest(label=label, name=name, params=params):
+                with self.assertRaises(Http404):
+                    self._get_token(widgets.get_token(label, name, params))
+        with self.assertRaises(Http404):
+            self._get_token(signing.dumps(['base.Client'], salt=widgets._TOKEN_SALT))
@@ -0,0 +1,11 @@
+# -*- coding: utf-8 -*-
+
+from django.conf.urls import url
+
+from . import views
+
+urlpatterns = [
+    url(r'^remote-choices/(?P<token>[-\w.:]+)/$', views.RemoteChoicesView.as_view(), name='remote_choices'),
+    url(r'^profiles/$', views.RequestProfileListView.as_view(), name='profile_list'),
+    url(r'^profiles/(?P<pk>\d+)/download/$', views.RequestProfileDownloadView.as_view(), name='profile_download'),
+]
@@ -1,10 +1,15 @@
 # -*- coding: utf-8 -*-
 
 from collections import OrderedDict
-from django.core.exceptions import ImproperlyConfigured, FieldDoesNotExist
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured, FieldDoesNotExist, ValidationError
 from django.db.models.base import ModelBase
 from django.db.models.fields import Field
-from django.db.models import Q
+from django.db.models import (Q, BooleanField, CharField, NullBooleanField, DateField, DateTimeField,
+                              IntegerField, DecimalField, FloatField)
+from django.utils.dateparse import parse_date
+
+from . import export
 
 
 def _get_field(model, field_name):
@@ -24,7 +29,58 @@ def _get_field(model, field_name):
         return field
 
 
+def _is_nullable_path(model, field_name):
+    """
+    : 判断field_name指向的值是否可能为NULL
+    : 对于跨表的field_name，路径上任何一个可以为NULL的外键都会导致结果可能为NULL
+    :param model: model class
+    :param field_name: str, 可以包含'__'
+    :return: boolean
+    """
+    if field_name == 'pk':
+        return False
+    related_model_name, _, related_field_name = field_name.partition('__')
+    try:
+        field = model._meta.get_field(related_model_name)
+    except FieldDoesNotExist:
+        return True
+    if field.null:
+        return True
+    if related_field_name:
+        if field.related_model is None:
+            return True
+        return _is_nullable_path(field.related_model, related_field_name)
+    return False
+
+
+def _get_path_models(model, field_name):
+    """
+    : 获取field_name路径上经过的所有model（包括model本身）
+    :return: list of model class
+    """
+    models = [model]
+    related_model_name, _, related_field_name = field_name.partition('__')
+    if not related_field_name:
+        return models
+    try:
+        related_model = model._meta.get_field(related_model_name).related_model
+    except FieldDoesNotExist:
+        return models
+    if related_model is None:
+        return models
+    return models + _get_path_models(related_model, related_field_name)
+
+
 class DataTablesColumn:
+    # 该列的值是否可能为NULL，在ModelDataTableMetaClass中根据field路径设置
+    # keyset分页要求排序列不能为NULL
+    nullable = True
+    # 针对该列搜索(columns[i][search][value])时使用的lookup，为None时根据field类型决定
+    # 通过Meta.column_lookups设置
+    lookup = None
+    # 范围搜索时，起始值与结束值之间的分隔符
+    range_separator = '~'
+
     def __init__(self, title=None, searchable=True, orderable=True, width=None, field=None):
         self.title = title
         self.searchable = searchable
@@ -78,12 +134,238 @@ class DataTablesColumn:
         lookup_str = self.name + lookup_str
         return Q(**{lookup_str: pattern})
 
+    @property
+    def column_searchable(self):
+        """
+        : 是否可以针对该列进行搜索
+        : ForeignKey等relationship列虽然不能参与全局搜索，但可以按pk进行exact搜索
+        """
+        if not self._bound:
+            return False
+        return self.searchable or self._field.is_relation
+
+    @property
+    def column_search_placeholder(self):
+        """
+        : 列搜索输入框的提示文字
+        """
+        if self.lookup is None and isinstance(self._field, (DateField, IntegerField, DecimalField, FloatField)):
+            return '起始{}结束'.format(self.range_separator)
+        return ''
+
+    def _to_python(self, field, value):
+        """
+        : 将请求中的字符串转换为field对应的python值
+        :return: 转换后的值，转换失败时返回None
+        """
+        try:
+            if isinstance(field, DateTimeField):
+                # DateTimeField按日期进行搜索
+                return parse_date(value)
+            if isinstance(field, (BooleanField, NullBooleanField)):
+                # DataTables前端通常传入'true'/'false'
+                return {'true': True, '1': True, 'false': False, '0': False}.get(value.lower())
+            return field.to_python(value)
+        except (ValidationError, ValueError):
+            return None
+
+    def get_column_filter_q_object(self, value):
+        """
+        : 产生针对该列进行搜索的Q对象，根据field类型选择lookup
+        : ForeignKey, BooleanField, 定义了choices的field: exact
+        : DateField, DateTimeField, 数值类型: 范围，格式为'起始~结束'，任一端可以省略
+        : 其他: icontains，可以通过Meta.column_lookups指定，例如编号类的列使用istartswith
+        :param value: 请求中的columns[i][search][value]
+        :return: django.db.models.Q对象，value为空或者无效时返回None
+        """
+        if value is None or not self.column_searchable:
+            return None
+        value = value.strip()
+        if not value:
+            return None
+
+        if self.lookup is not None:
+            return Q(**{'{}__{}'.format(self.name, self.lookup): value})
+
+        field = self._field
+        if field.is_relation:
+            value = self._to_python(field.target_field, value)
+            if value is None:
+                return None
+            return Q(**{self.name: value})
+
+        if isinstance(field, (BooleanField, NullBooleanField)) or field.choices:
+            value = self._to_python(field, value)
+            if value is None:
+                return None
+            return Q(**{self.name: value})
+
+        if isinstance(field, (DateField, IntegerField, DecimalField, FloatField)):
+            name = self.name
+            if isinstance(field, DateTimeField):
+                name = name + '__date'
+            if self.range_separator not in value:
+                value = self._to_python(field, value)
+                if value is None:
+                    return None
+                return Q(**{name: value})
+            start, end = [v.strip() for v in value.split(self.range_separator, 1)]
+            q = Q()
+            for bound, lookup in ((start, 'gte'), (end, 'lte')):
+                if not bound:
+                    continue
+                bound = self._to_python(field, bound)
+                if bound is None:
+                    return None
+                q &= Q(**{'{}__{}'.format(name, lookup): bound})
+            return q if q.children else None
+
+        return Q(**{self.name + '__icontains': value})
+
     @classmethod
     def get_instance_from_field(cls, field):
         dt_column = cls(field=field)
         return dt_column
 
 
+class DataTablesSearchPlanner:
+    """
+    : 根据DataTables请求中的全局search参数生成filter用的Q对象
+    : 空的pattern，以及长度小于min_length的pattern不会产生任何查询条件，
+    : 避免对每一列产生LIKE '%%'
+    """
+    def __init__(self, columns, min_length=1):
+        self.all_columns = list(columns)
+        self.columns = [c for c in self.all_columns if c.searchable]
+        self.min_length = min_length
+
+    def normalize(self, pattern):
+        """
+        :param pattern: 请求中的search[value]
+        :return: str or None, None表示不需要进行搜索
+        """
+        if pattern is None:
+            return None
+        pattern = pattern.strip()
+        if not pattern or len(pattern) < self.min_length:
+            return None
+        return pattern
+
+    def get_q_object(self, pattern, is_regex=False):
+        """
+        :return: django.db.models.Q对象，不需要进行搜索时返回None
+        """
+        pattern = self.normalize(pattern)
+        if pattern is None or not self.columns:
+            return None
+        q_objects = [c.get_filter_q_object(pattern, is_regex) for c in self.columns]
+        q = q_objects[0]
+        for q_object in q_objects[1:]:
+            q |= q_object
+        return q
+
+    def get_column_q_object(self, values):
+        """
+        : 根据请求中的columns[i][search][value]生成Q对象，各列之间为AND关系
+        :param values: dict, column index -> search value
+        :return: django.db.models.Q对象，没有任何有效的列搜索时返回None
+        """
+        q = Q()
+        for index, value in values.items():
+            if not 0 <= index < len(self.all_columns):
+                continue
+            q_object = self.all_columns[index].get_column_filter_q_object(value)
+            if q_object is not None:
+                q &= q_object
+        return q if q.children else None
+
+
+def _get_join_paths(field_name):
+    """
+    : 获取field_name所需要的join，例如'trademark__client__name'需要'trademark'和'trademark__client'
+    :return: list of str
+    """
+    parts = field_name.split('__')[:-1]
+    return ['__'.join(parts[:i + 1]) for i in range(len(parts))]
+
+
+class DataTablesQueryPlan:
+    """
+    : 在ModelDataTableMetaClass中为每个ModelDataTable预先生成的查询计划
+    : 包含了values()使用的columns，每一列需要的join，以及排序/搜索所期望的索引
+    : 获取一页数据时，如果排序和filter所需要的join少于显示所需要的join，
+    : 先只使用必要的join得到当前页的pk，再用pk获取完整的数据(late row lookup)，
+    : 避免对所有符合条件的行进行join之后再排序/分页
+    """
+    def __init__(self, model, columns, pk_name):
+        self.model = model
+        self.pk_name = pk_name
+        # DataTables请求中使用index指定column
+        self.column_list = list(columns.values())
+        self.fields = [name for name in columns] + [pk_name]
+        self.column_joins = {name: frozenset(_get_join_paths(name)) for name in columns}
+        self.joins = frozenset().union(*self.column_joins.values())
+        self.expected_indexes = self._get_expected_indexes(columns)
+
+    def _get_expected_indexes(self, columns):
+        """
+        : 排序列，以及使用exact/范围/前缀搜索的列，需要在model的表上有索引
+        : 跨表的列即使有索引，也很难在join之后被用于排序，这里只考虑model本身的列
+        :return: list of (field, reason)
+        """
+        indexes = []
+        for name, column in columns.items():
+            if '__' in name or not column._bound:
+                continue
+            field = column._field
+            if field.primary_key or field.is_relation:
+                # 主键以及外键已经有索引
+                continue
+            if isinstance(field, (BooleanField, NullBooleanField)):
+                # 区分度太低，索引没有意义
+                continue
+            reasons = []
+            if column.orderable:
+                reasons.append('order')
+            if column.column_searchable:
+                lookup = column.lookup
+                if lookup is None and isinstance(field, CharField) and not field.choices:
+                    lookup = 'icontains'
+                if lookup not in ('icontains', 'contains', 'iregex', 'regex'):
+                    reasons.append('filter')
+            if reasons:
+                indexes.append((field, reasons))
+        return indexes
+
+    def get_joins(self, column_names):
+        """
+        :param column_names: 排序/filter所使用的列
+        :return: frozenset, 所需要的join
+        """
+        joins = set()
+        for name in column_names:
+            name = name.lstrip('-')
+            joins.update(self.column_joins.get(name, _get_join_paths(name)))
+        return frozenset(joins)
+
+    def fetch(self, queryset, filter_columns=()):
+        """
+        : 获取已经排序/分页的queryset的数据
+        :param queryset: 已经完成filter, order_by以及slice的queryset
+        :param filter_columns: filter所使用的列
+        :return: list of dict
+        """
+        used_columns = list(filter_columns) + [name for name in queryset.query.order_by if isinstance(name, str)]
+        if self.joins <= self.get_joins(used_columns):
+            return list(queryset.values(*self.fields))
+        pks = list(queryset.values_list('pk', flat=True))
+        if not pks:
+            return []
+        rows = self.model._default_manager.filter(pk__in=pks).values(*self.fields)
+        rows = {row[self.pk_name]: row for row in rows}
+        return [rows[pk] for pk in pks if pk in rows]
+
+
 class ModelDataTableMetaClass(type):
     def __new__(mcls, name, bases, attrs):
         if not bases:
@@ -102,15 +384,16 @@ class ModelDataTableMetaClass(type):
         # 处理声明式定义的columns
         d = dict(attrs)
         declared_columns = []
-        for name, value in attrs.items():
+        for column_name, value in attrs.items():
             if isinstance(value, DataTablesColumn):
-                field = _get_field(model, name)
+                field = _get_field(model, column_name)
                 if field is None:
                     continue
-                value.name = name
+                value.name = column_name
                 value.field = field
-                declared_columns.append((name, value))
-                d.pop(name)
+                value.nullable = _is_nullable_path(model, column_name)
+                declared_columns.append((column_name, value))
+                d.pop(column_name)
         d['_declared_columns'] = OrderedDict(declared_columns)
 
         # 处理从Meta class属性中读取fields-columns的信息
@@ -124,6 +407,7 @@ class ModelDataTableMetaClass(type):
                 continue
             dt_column = DataTablesColumn.get_instance_from_field(field)
             dt_column.name = field_name
+            dt_column.nullable = _is_nullable_path(model, field_name)
             if titles.get(field_name):
                 dt_column.title = titles.get(field_name)
             meta_defined_columns.append((field_name, dt_column))
@@ -133,16 +417,16 @@ class ModelDataTableMetaClass(type):
         column_order = getattr(meta, 'column_order', None)
         if column_order is None:
             columns = OrderedDict(declared_columns)
-            for name, column in d['_meta_defined_columns'].items():
-                if name not in columns:
-                    columns[name] = column
+            for column_name, column in d['_meta_defined_columns'].items():
+                if column_name not in columns:
+                    columns[column_name] = column
         else:
             columns = OrderedDict()
-            for name in column_order:
-                if name in d['_declared_columns']:
-                    columns[name] = d['_declared_columns'][name]
-                elif name in d['_meta_defined_columns']:
-                    columns[name] = d['_meta_defined_columns'][name]
+            for column_name in column_order:
+                if column_name in d['_declared_columns']:
+                    columns[column_name] = d['_declared_columns'][column_name]
+                elif column_name in d['_meta_defined_columns']:
+                    columns[column_name] = d['_meta_defined_columns'][column_name]
         d['columns'] = columns
 
         # 处理js配置属性，dt_开头的类属性
@@ -181,11 +465,58 @@ class ModelDataTableMetaClass(type):
 
         # 处理Meta.width
         width = getattr(meta, 'width', {})
-        for name, w in width.items():
-            if name in d['columns']:
-                d['columns'][name].width = w
+        for column_name, w in width.items():
+            if column_name in d['columns']:
+                d['columns'][column_name].width = w
+
+        # 处理Meta.column_lookups，指定针对列搜索时使用的lookup
+        column_lookups = getattr(meta, 'column_lookups', {})
+        for column_name, lookup in column_lookups.items():
+            if column_name in d['columns']:
+                d['columns'][column_name].lookup = lookup
+
+        # 处理Meta.column_search，为True时在table footer中显示针对每一列的搜索框
+        d['column_search'] = getattr(meta, 'column_search', False)
+
+        # 处理Meta.pagination
+        # 'offset': 使用LIMIT/OFFSET分页
+        # 'keyset': 从上一页最后一行的(order column, pk)开始seek，深度翻页的开销与第一页相同
+        pagination = getattr(meta, 'pagination', 'offset')
+        if pagination not in ('offset', 'keyset'):
+            raise ImproperlyConfigured("Meta.pagination should be 'offset' or 'keyset'")
+        d['pagination'] = pagination
 
-        return super().__new__(mcls, name, bases, d)
+        # 处理计数相关配置
+        # cache_counts: 缓存recordsTotal/recordsFiltered，在相关model保存时失效
+        # approximate_count: 没有任何filter(包括show_disabled=0时的enabled=True)时，使用数据库的表统计信息代替COUNT(*)
+        d['cache_counts'] = getattr(meta, 'cache_counts', True)
+        d['approximate_count'] = getattr(meta, 'approximate_count', False)
+
+        # 处理Meta.search_min_length，为None时使用settings.DATATABLES_SEARCH_MIN_LENGTH
+        d['search_min_length'] = getattr(meta, 'search_min_length', None)
+        # columns所涉及的所有model，其中任何一个发生变化都可能影响计数结果
+        dependent_models = [model]
+        for column_name in columns:
+            for m in _get_path_models(model, column_name):
+                if m not in dependent_models:
+                    dependent_models.append(m)
+        d['dependent_models'] = dependent_models
+
+        # 处理Meta.search_index
+        # 为True时，全局搜索使用utils.search维护的SearchDocument，而不是对每一列进行LIKE
+        # 只有MySQL使用FULLTEXT索引，其他数据库仍然是对SearchDocument.document的全表LIKE
+        # model需要使用整数主键
+        d['search_index'] = getattr(meta, 'search_index', False)
+
+        # 生成查询计划
+        pk_name = d['pk_column'].name if 'pk_column' in d else 'pk'
+        d['query_plan'] = DataTablesQueryPlan(model, columns, pk_name)
+
+        cls = super().__new__(mcls, name, bases, d)
+        if cls.search_index:
+            from . import search
+            search.register(model, cls)
+        return cls
 
     @classmethod
     def __prepare__(mcls, name, bases):
@@ -221,10 +552,18 @@ class ModelDataTable(metaclass=ModelDataTableMetaClass):
         : 指定json数据中包含的fields，用于对请求的处理函数中
         :return: list，json数据中应该包含的fields
         """
-        query_fields = [c.name for c in cls.columns.values()]
-        # 加入pk_column对应的名字
-        query_fields.append(cls.pk_column.name)
-        return query_fields
+        # query_plan.fields中已经包含了pk_column对应的名字
+        return list(cls.query_plan.fields)
+
+    @classmethod
+    def get_search_planner(cls):
+        """
+        : 生成用于处理全局搜索的DataTablesSearchPlanner
+        """
+        min_length = cls.search_min_length
+        if min_length is None:
+            min_length = getattr(settings, 'DATATABLES_SEARCH_MIN_LENGTH', 1)
+        return DataTablesSearchPlanner(cls.columns.values(), min_length=min_length)
 
     @classmethod
     def get_titles(cls):
@@ -259,6 +598,8 @@ class ModelDataTable(metaclass=ModelDataTableMetaClass):
         else:
             buttons = list()
         buttons.extend(cls._default_buttons)
+        # 导出按钮，xlsx需要安装openpyxl
+        buttons.extend('cms_export_{}'.format(f) for f in export.get_export_formats())
         if not buttons:
             # 在dt_buttons以及_default_buttons都为空的情况下，
             # 删除buttons config项
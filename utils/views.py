@@ -1,20 +1,38 @@
-from functools import reduce
+import hashlib
 from collections import OrderedDict
 from django.views import generic
-from django.http import JsonResponse, HttpResponseRedirect
-from django.core.exceptions import ImproperlyConfigured, ValidationError
+from django.http import JsonResponse, HttpResponse, HttpResponseRedirect, HttpResponseBadRequest, Http404
+from django.core.exceptions import ImproperlyConfigured, ValidationError, EmptyResultSet
 from django.apps import apps
-from django.utils.module_loading import import_string
-from django.db.models import Q
-from django.forms.models import ModelFormMetaclass
+from django.db import transaction
+from django.db.models import Q, Exists, OuterRef
 from django.forms.utils import ErrorList
 from django.contrib import messages
+from django.contrib.auth.mixins import UserPassesTestMixin
+from django.utils.http import urlencode
+from django.urls import reverse, NoReverseMatch
+from django.conf import settings
+from django.core.cache import cache
 
 from utils.utils import ModelDataTable
+from utils.models import RequestProfile
+from utils import counts, search, registry, export, caching, widgets, signals
+from base.middleware import set_query_budget
 
 from cms import site_config
 
 
+def _get_where_sql(queryset):
+    """
+    : queryset的WHERE部分(包括join)，用于比较两个queryset的条件是否相同
+    """
+    queryset = queryset.all().order_by().values('pk')
+    try:
+        return queryset.query.sql_with_params()
+    except EmptyResultSet:
+        return None
+
+
 class JsonContextMixin:
     def get_json_context_data(self, **kwargs):
         """
@@ -47,6 +65,10 @@ class DataTablesMixin(JsonResponseMixin, JsonContextMixin):
     dt_column_fields = None
     dt_table_id = None
     enabled_objects_manager = 'enabled_objects'
+    # keyset分页时，每个table在session中最多保存的cursor数量
+    keyset_cursor_limit = 20
+    # 相同draw请求的缓存时间(秒)，为0时不缓存
+    draw_cache_timeout = getattr(settings, 'DATATABLES_DRAW_CACHE_TIMEOUT', 3)
 
     def get_dt_data_src(self):
         return self.dt_data_src
@@ -92,19 +114,7 @@ class DataTablesMixin(JsonResponseMixin, JsonContextMixin):
         """
         json_context = {}
 
-        # 用于控制是否返回disabled项
-        # 要求model中定义了enabled_objects Manager
-        # 因为初始请求的query args中不存在show_disabled参数
-        # 为了保证默认不显示disabled的项目，这里要将get的默认值设为'0'
-        show_disabled = http_queryset.get('show_disabled', '0')
-        if show_disabled == '0':
-            # 如果没有找到，则self.queryset为None
-            # 这样在下面的执行中会默认使用_default_manager
-            # 所以可以 避免 没有enabled/disabled区分的情况下结果不正确
-            self.queryset = getattr(self.model, self.enabled_objects_manager, None)
-        elif show_disabled == '1':
-            self.queryset = self.model._default_manager
-
+        self.config_dt_queryset(http_queryset)
         dt_column_fields = self.get_dt_query_fields()
         queryset = self.get_queryset()
         if self.is_server_side():
@@ -113,42 +123,274 @@ class DataTablesMixin(JsonResponseMixin, JsonContextMixin):
 
             try:
                 draw = int(http_queryset.get('draw'))
-            except ValueError:
+            except (TypeError, ValueError):
                 json_context.update(error='Invalid request arguments')
                 return super().get_json_context_data(**json_context)
             else:
                 json_context.update(draw=draw)
-            records_total = queryset.count()
+
+            # 同一session中相同的请求(例如连续输入时重复发出的draw)直接返回缓存的结果
+            # related entity的filter(例如subcase__case)中join的表同样影响结果
+            dependent_models = counts.merge_models(self.dt_config.dependent_models,
+                                                   counts.get_query_models(queryset))
+            draw_cache_key = self.get_draw_cache_key(http_queryset, dependent_models)
+            if draw_cache_key is not None:
+                cached_context = cache.get(draw_cache_key)
+                if cached_context is not None:
+                    cached_context.update(draw=draw)
+                    return super().get_json_context_data(**cached_context)
+            records_total = self.get_dt_count(
+                queryset, dependent_models,
+                approximate=self.dt_config.approximate_count and self.is_unfiltered_queryset(queryset)
+            )
             json_context.update(recordsTotal=records_total)
 
             # 处理filter
-            # 只实现了对全局的搜索
-            # 没有实现对指定列的搜索
-            pattern = http_queryset.get('search[value]')
-            is_regex = http_queryset.get('search[regex]') == 'true'
-            queryset = queryset.filter(
-                reduce(
-                    lambda x, y: x | y,
-                    [c.get_filter_q_object(pattern, is_regex) for c in self.dt_config.columns.values()]
-                )
-            )
-            records_filtered = queryset.count()
+            # 有搜索条件时recordsFiltered使用COUNT(*)，只有没有任何条件时才与估计的recordsTotal相同
+            queryset, filter_columns, filtered = self.filter_dt_queryset(queryset, http_queryset)
+            records_filtered = self.get_dt_count(queryset, dependent_models) if filtered else records_total
             json_context.update(recordsFiltered=records_filtered)
 
-            # 处理order
-            order_dir = '' if http_queryset['order[0][dir]'] == 'asc' else '-'
-            order_column = list(self.dt_config.columns.values())[int(http_queryset['order[0][column]'])].name
-            queryset = queryset.order_by(order_dir + order_column)
+            # 处理order，支持多列排序(order[0], order[1], ...)
+            orders = self.get_dt_orders(http_queryset)
 
             # 处理分页
             page_start = int(http_queryset['start'])
             page_length = int(http_queryset['length'])
-            queryset = queryset[page_start:page_start + page_length]
 
-        json_context[self.dt_data_src] = list(queryset.values(*dt_column_fields))
+            # keyset分页只支持单列排序
+            if len(orders) == 1 and self.is_keyset_pagination(orders[0][0]):
+                order_column, order_dir = orders[0]
+                data = self.get_keyset_page(
+                    queryset, http_queryset, filter_columns,
+                    order_column, order_dir, page_start, page_length
+                )
+            else:
+                queryset = queryset.order_by(*[order_dir + column.name for column, order_dir in orders])
+                queryset = queryset[page_start:page_start + page_length]
+                data = self.dt_config.query_plan.fetch(queryset, filter_columns)
+        else:
+            draw_cache_key = None
+            data = list(queryset.values(*dt_column_fields))
+
+        json_context[self.dt_data_src] = data
+        if draw_cache_key is not None:
+            cache.set(draw_cache_key, json_context, self.draw_cache_timeout)
 
         return super().get_json_context_data(**json_context)
 
+    def config_dt_queryset(self, http_queryset):
+        """
+        : 根据请求中的show_disabled参数设置self.queryset
+        """
+        # 用于控制是否返回disabled项
+        # 要求model中定义了enabled_objects Manager
+        # 因为初始请求的query args中不存在show_disabled参数
+        # 为了保证默认不显示disabled的项目，这里要将get的默认值设为'0'
+        show_disabled = http_queryset.get('show_disabled', '0')
+        if show_disabled == '0':
+            # 如果没有找到，则self.queryset为None
+            # 这样在下面的执行中会默认使用_default_manager
+            # 所以可以 避免 没有enabled/disabled区分的情况下结果不正确
+            self.queryset = getattr(self.model, self.enabled_objects_manager, None)
+        elif show_disabled == '1':
+            self.queryset = self.model._default_manager
+
+    def filter_dt_queryset(self, queryset, http_queryset):
+        """
+        : 处理请求中的全局搜索以及针对列的搜索
+        : 全局搜索(search[value])与针对列的搜索(columns[i][search][value])之间为AND关系
+        : 空的pattern或者过短的pattern不会产生查询条件
+        :return: tuple, (queryset, filter所使用的列, 是否产生了查询条件)
+        """
+        pattern = http_queryset.get('search[value]')
+        is_regex = http_queryset.get('search[regex]') == 'true'
+        planner = self.dt_config.get_search_planner()
+        pattern = planner.normalize(pattern)
+        column_search_values = self.get_dt_column_search_values(http_queryset)
+        column_q = planner.get_column_q_object(column_search_values)
+        # filter所使用的列，用于决定获取数据时需要的join
+        filter_columns = [self.dt_config.query_plan.column_list[i].name for i in column_search_values]
+        if pattern is None and column_q is None:
+            return queryset, filter_columns, False
+
+        if column_q is not None:
+            queryset = queryset.filter(column_q)
+        if pattern is not None:
+            if self.dt_config.search_index and not is_regex:
+                # 开启了search index时，只查询SearchDocument
+                queryset = search.filter_queryset(queryset, pattern)
+            else:
+                queryset = queryset.filter(planner.get_q_object(pattern, is_regex))
+                filter_columns.extend(c.name for c in planner.columns)
+        return queryset, filter_columns, True
+
+    def render_to_export_response(self, http_queryset):
+        """
+        : 按照当前的show_disabled, 搜索以及排序条件导出全部数据(不分页)
+        : 请求中的export参数指定导出格式: csv或xlsx
+        :return: StreamingHttpResponse或FileResponse
+        """
+        export_format = http_queryset.get('export')
+        if export_format not in export.get_export_formats():
+            return HttpResponseBadRequest('Unsupported export format: {}'.format(export_format))
+
+        self.config_dt_queryset(http_queryset)
+        queryset = self.filter_dt_queryset(self.get_queryset(), http_queryset)[0]
+        orders = self.get_dt_orders(http_queryset)
+        queryset = queryset.order_by(*[order_dir + column.name for column, order_dir in orders])
+        # 导出时每EXPORT_BATCH_SIZE行执行一次查询，查询数量随导出的行数增加，不适用页面的query_budget
+        set_query_budget(self.request, None)
+        return export.export_response(self.dt_config, queryset, export_format)
+
+    def get_dt_column_search_values(self, http_queryset):
+        """
+        : 读取请求中针对列的搜索值
+        :return: dict, column index -> columns[i][search][value]
+        """
+        values = {}
+        for index in range(len(self.dt_config.columns)):
+            value = http_queryset.get('columns[{}][search][value]'.format(index))
+            if value:
+                values[index] = value
+        return values
+
+    def get_dt_orders(self, http_queryset):
+        """
+        : 读取请求中的order[i][column], order[i][dir]
+        : 忽略无效的以及不能排序的列
+        :return: list of (DataTablesColumn, order_dir), order_dir为''或'-'
+        """
+        columns = self.dt_config.query_plan.column_list
+        orders = []
+        used = set()
+        i = 0
+        while 'order[{}][column]'.format(i) in http_queryset:
+            try:
+                column = columns[int(http_queryset['order[{}][column]'.format(i)])]
+            except (ValueError, IndexError):
+                column = None
+            order_dir = '-' if http_queryset.get('order[{}][dir]'.format(i)) == 'desc' else ''
+            if column is not None and column.orderable and column.name not in used:
+                used.add(column.name)
+                orders.append((column, order_dir))
+            i += 1
+        return orders
+
+    def get_draw_cache_key(self, http_queryset, dependent_models=None):
+        """
+        : 生成用于合并重复draw请求的cache key
+        : key中包含session, 请求参数(除draw及jQuery的'_'参数外)，以及相关model的版本号，
+        : 数据发生变化之后缓存会自动失效
+        :param dependent_models: 相关model，默认为dt_config.dependent_models
+        :return: str, 不能缓存时返回None
+        """
+        if not self.draw_cache_timeout:
+            return None
+        session = getattr(self.request, 'session', None)
+        if session is None or session.session_key is None:
+            return None
+        items = sorted((k, v) for k, v in http_queryset.items() if k not in ('draw', '_'))
+        # 同一path下(RelatedEntityView)可能对应不同的related entity，所以需要加入table_id
+        raw_key = '{}|{}|{}|{}|{}'.format(
+            session.session_key,
+            self.request.path_info,
+            self.get_dt_table_name(),
+            urlencode(items),
+            caching.get_versions_key(dependent_models or self.dt_config.dependent_models)
+        )
+        return 'dt_draw:{}'.format(hashlib.md5(raw_key.encode('utf-8')).hexdigest())
+
+    def get_dt_count(self, queryset, dependent_models=None, approximate=False):
+        """
+        : 获取recordsTotal/recordsFiltered
+        : 根据ModelDataTable.Meta中的cache_counts/approximate_count配置使用计数缓存或表统计信息
+        :param approximate: 是否使用表统计信息，只用于没有related entity, 搜索等条件的queryset
+        :return: int
+        """
+        return counts.count(
+            queryset,
+            dependent_models=dependent_models or self.dt_config.dependent_models,
+            use_cache=self.dt_config.cache_counts,
+            approximate=approximate
+        )
+
+    def is_unfiltered_queryset(self, queryset):
+        """
+        : queryset是否没有任何条件，即与表统计信息的范围相同
+        : enabled_objects的enabled=True(show_disabled=0)，RelatedEntityView中related entity的条件等都会返回False
+        """
+        return _get_where_sql(queryset) == _get_where_sql(self.model._default_manager)
+
+    def is_keyset_pagination(self, order_column):
+        """
+        : 判断当前请求是否可以使用keyset分页
+        : 需要在ModelDataTable.Meta中设置pagination = 'keyset'，
+        : 并且排序列的值不能为NULL（NULL的排序位置与数据库相关，无法作为seek条件）
+        :param order_column: DataTablesColumn
+        :return: boolean
+        """
+        if getattr(self.dt_config, 'pagination', 'offset') != 'keyset':
+            return False
+        if getattr(self.request, 'session', None) is None:
+            return False
+        return not order_column.nullable
+
+    def get_keyset_cursor_key(self, http_queryset):
+        """
+        : 生成用于标识keyset cursor的签名
+        : 除分页参数外的请求参数(filter, order, show_disabled)，以及当前path(related entity)都会影响结果集
+        :return: str
+        """
+        ignored = ('draw', 'start', 'length', '_')
+        items = sorted((k, v) for k, v in http_queryset.items() if k not in ignored)
+        return '{}?{}'.format(self.request.path_info, urlencode(items))
+
+    def get_keyset_page(self, queryset, http_queryset, filter_columns,
+                        order_column, order_dir, page_start, page_length):
+        """
+        : 使用keyset(seek)方式获取一页数据
+        : 已经返回过的每一页的最后一行(order column, pk)会被保存在session中，
+        : 当请求的page_start正好是某一页的结尾时，使用WHERE条件seek到该位置，
+        : 否则(例如直接跳页)回退到OFFSET
+        :return: list, 当前页数据
+        """
+        pk_name = self.dt_config.pk_column.name
+        order_name = order_column.name
+        queryset = queryset.order_by(order_dir + order_name, order_dir + pk_name)
+
+        session_key = 'dt_keyset_{}'.format(self.get_dt_table_name())
+        cursor_key = self.get_keyset_cursor_key(http_queryset)
+        state = self.request.session.get(session_key)
+        if not state or state.get('key') != cursor_key:
+            state = {'key': cursor_key, 'cursors': {}}
+
+        cursor = state['cursors'].get(str(page_start)) if page_start else None
+        if cursor is not None:
+            last_value = order_column._field.to_python(cursor[0])
+            last_pk = cursor[1]
+            lookup = 'gt' if order_dir == '' else 'lt'
+            queryset = queryset.filter(
+                Q(**{'{}__{}'.format(order_name, lookup): last_value}) |
+                Q(**{order_name: last_value, '{}__{}'.format(pk_name, lookup): last_pk})
+            )
+            queryset = queryset[:page_length]
+        else:
+            queryset = queryset[page_start:page_start + page_length]
+
+        data = self.dt_config.query_plan.fetch(queryset, filter_columns)
+
+        if data:
+            cursors = state['cursors']
+            cursors[str(page_start + len(data))] = [str(data[-1][order_name]), data[-1][pk_name]]
+            if len(cursors) > self.keyset_cursor_limit:
+                # 只保留离当前页最近的cursor
+                nearest = sorted(cursors, key=lambda k: abs(int(k) - page_start))
+                state['cursors'] = {k: cursors[k] for k in nearest[:self.keyset_cursor_limit]}
+            self.request.session[session_key] = state
+
+        return data
+
     def get_context_data(self, **kwargs):
         """
         : 将ModelDataTables类添加进context
@@ -172,21 +414,8 @@ class ModelDataTablesMixin(DataTablesMixin):
     def config_datatables_from_model(self, dt_config=None):
         if self.dt_config is not None:
             return
-        try:
-            datatables_class = self.model.datatables_class
-        except AttributeError:
-            raise ImproperlyConfigured('No datatables class configured in {}:{}'
-                                       .format(self.model._meta.app_label, self.model._meta.verbose_name))
-        if isinstance(datatables_class, str):
-            try:
-                datatables_class = import_string(datatables_class)
-            except ImportError:
-                raise ImproperlyConfigured('Error in datatables configured in {}:{}'
-                                           .format(self.model._meta.app_label, self.model._meta.verbose_name))
-        if not issubclass(datatables_class, ModelDataTable):
-            raise ImproperlyConfigured('Improperly configured datatables_class attr in {}:{}'
-                                       .format(self.model._meta.app_label, self.model._meta.verbose_name))
-        self.dt_config = datatables_class
+        # datatables_class在启动时已经被解析和检查
+        self.dt_config = registry.get_datatables_class(self.model)
 
     def get_context_data(self, **kwargs):
         # 注意：这里也需要对kwargs中的dt_config参数进行判断
@@ -200,15 +429,40 @@ class ModelDataTablesMixin(DataTablesMixin):
         self.config_datatables_from_model()
         return super().get_json_context_data(*args, **kwargs)
 
+    def render_to_export_response(self, *args, **kwargs):
+        self.config_datatables_from_model()
+        return super().render_to_export_response(*args, **kwargs)
+
 
 class DataTablesListView(ModelDataTablesMixin, generic.ListView):
+    # 查询数量上限，参考base.middleware.QueryInstrumentationMiddleware
+    query_budget = 8
 
     def get(self, request, *args, **kwargs):
+        if 'export' in request.GET:
+            return self.render_to_export_response(request.GET)
         if request.is_ajax():
             # if not self.dt_config.dt_serverSide:
             return self.render_to_json_response(self.get_json_context_data(request.GET))
         return super().get(request, *args, **kwargs)
 
+    def get_bulk_disable_url(self):
+        """
+        : 列表页面中批量删除按钮使用的url，即与当前页面相同namespace下的bulk_disable
+        :return: str, 没有对应url时返回None，不显示批量删除按钮
+        """
+        resolver_match = self.request.resolver_match
+        if resolver_match is None or not resolver_match.namespace:
+            return None
+        try:
+            return reverse('{}:bulk_disable'.format(resolver_match.namespace))
+        except NoReverseMatch:
+            return None
+
+    def get_context_data(self, **kwargs):
+        kwargs.setdefault('bulk_disable_url', self.get_bulk_disable_url())
+        return super().get_context_data(**kwargs)
+
 
 class InfoboxMixin:
     view_name = None
@@ -233,7 +487,7 @@ class InfoboxMixin:
             infobox_list = view_config.get('INFO_BOXES')
             if infobox_list is None:
                 return {}
-        ret = []
+        querysets = OrderedDict()
         for infobox_name, infobox_value in infobox_list.items():
             try:
                 # infobox_conf = site_config.INFO_BOXES[infobox_name]
@@ -246,9 +500,18 @@ class InfoboxMixin:
                 raise ImproperlyConfigured('info box model not found: {}'.format(infobox_name))
 
             extra_query_object = self.get_extra_query_object(model_name=infobox_name, model=model)
-            count = model.enabled_objects.filter(extra_query_object).count()
+            querysets[infobox_name] = model.enabled_objects.filter(extra_query_object)
+
+        # 所有infobox的计数在一条查询中完成
+        infobox_counts = counts.count_many(querysets)
+        ret = []
+        for infobox_name, infobox_value in infobox_list.items():
             t_name = infobox_value.get('t_name')
-            ret.append((infobox_name, {'related_entity_name': infobox_name, 'count': count, 't_name': t_name}))
+            ret.append((infobox_name, {
+                'related_entity_name': infobox_name,
+                'count': infobox_counts[infobox_name],
+                't_name': t_name
+            }))
 
         return OrderedDict(ret)
 
@@ -267,16 +530,9 @@ class ConfiguredModelFormMixin:
     依赖于FormMixin
     """
     def config_form_from_model(self):
-        try:
-            modelform_class = self.model.modelform_class
-        except AttributeError:
-            modelform_class = None
-        if isinstance(modelform_class, str):
-            try:
-                modelform_class = import_string(modelform_class)
-            except ImportError:
-                pass
-        if isinstance(modelform_class, ModelFormMetaclass):
+        # modelform_class在启动时已经被解析和检查
+        modelform_class = registry.get_modelform_class(self.model)
+        if modelform_class is not None:
             self.form_class = modelform_class
             # 设置self.form_class成功之后，self.fields将失效
             # 避免产生同时设置form_class和fields的错误
@@ -315,6 +571,12 @@ class FormMessageMixin:
     def form_valid(self, form):
         action = '修改' if form.instance.pk else '创建'
         entity_verbose_name = form.instance._meta.verbose_name
+        try:
+            response = super().form_valid(form)
+        except ValidationError as e:
+            # form.save()中加锁后的检查失败(例如并发录入的付款超出待付款金额)
+            form.add_error(None, e)
+            return self.form_invalid(form)
         message = '{}{}成功'.format(
             action,
             entity_verbose_name,
@@ -323,7 +585,7 @@ class FormMessageMixin:
             self.request,
             message
         )
-        return super().form_valid(form)
+        return response
 
 
 class RelatedEntityConstructMixin(ConfiguredModelFormMixin, InfoboxMixin, ModelDataTablesMixin, generic.list.MultipleObjectMixin):
@@ -344,6 +606,17 @@ class RelatedEntityConstructMixin(ConfiguredModelFormMixin, InfoboxMixin, ModelD
     def is_related(self):
         return self.model is not self.main_entity
 
+    def get_main_queryset(self):
+        """
+        : 读取main_object使用的queryset
+        : 根据model的detail_select_related一次读取详情信息需要的关联对象
+        """
+        queryset = self.get_queryset()
+        select_related = registry.get_detail_select_related(self.model)
+        if select_related:
+            queryset = queryset.select_related(*select_related)
+        return queryset
+
     def process_query_args(self):
         """
         : 用于获取url query string中与related entity相关信息
@@ -421,7 +694,7 @@ class RelatedEntityConstructMixin(ConfiguredModelFormMixin, InfoboxMixin, ModelD
         """
         self.main_entity_name = self.model._meta.label
         self.main_entity = self.model
-        self.main_object = self.get_object()
+        self.main_object = self.get_object(self.get_main_queryset())
         if self.process_query_args():
             return True
         self.process_session()
@@ -453,16 +726,11 @@ class RelatedEntityConstructMixin(ConfiguredModelFormMixin, InfoboxMixin, ModelD
         if self.related_entity_config is not None:
             related_entity_config = self.related_entity_config
         else:
-            try:
-                related_entity_config = self.main_entity.get_related_entity_config()
-            except AttributeError:
-                related_entity_config = None
+            # related_entity_config在启动时已经被检查
+            related_entity_config = registry.get_related_entity_config(self.main_entity)
             if related_entity_config is None:
                 raise ImproperlyConfigured('Must configure related entity config for model: {}:{}'
                                            .format(self.main_entity._meta.app_label, self.main_entity._meta.verbose_name))
-            if not isinstance(related_entity_config, dict):
-                raise ImproperlyConfigured('Related entity config for {}:{} must be a dict'
-                                           .format(self.main_entity._meta.app_label, self.main_entity._meta.verbose_name))
 
             # 复制related_entity_config，避免下面的pop()修改View/Model中设置的类属性
             self.related_entity_config = dict(related_entity_config)
@@ -663,6 +931,8 @@ class RelatedEntityConstructMixin(ConfiguredModelFormMixin, InfoboxMixin, ModelD
                 return self.render_to_response(self.get_context_data(dt_config=None))
             else:
                 self.object = None
+                if 'export' in request.GET:
+                    return self.render_to_export_response(request.GET)
                 if request.is_ajax():
                     return self.render_to_json_response(self.get_json_context_data(request.GET))
                 else:
@@ -671,7 +941,10 @@ class RelatedEntityConstructMixin(ConfiguredModelFormMixin, InfoboxMixin, ModelD
                     # 这个在list的情况下是不需要的
                     return self.render_to_response(self.get_context_data(form=None))
         else:
-            self.object = self.get_object()
+            if self.action in self.extra_action_query_budget:
+                set_query_budget(request, self.extra_action_query_budget[self.action])
+            # 非related的情况下，main_object即为当前object，不再重复读取
+            self.object = self.main_object
             return self.render_to_response(self.get_context_data(dt_config=None))
 
     def handle_post(self, request, *args, **kwargs):
@@ -698,6 +971,11 @@ class RelatedEntityConstructMixin(ConfiguredModelFormMixin, InfoboxMixin, ModelD
 
 
 class RelatedEntityView(FormMessageMixin, RelatedEntityConstructMixin, generic.UpdateView):
+    # 查询数量与关联对象的数量无关，POST中的保存不做限制
+    query_budget = {'GET': 12}
+    # main_entity_extra_action页面的查询数量上限，例如{'show_balance': 24}，没有指定的action使用query_budget
+    extra_action_query_budget = {}
+
     def get(self, request, *args, **kwargs):
         if self.construct_related_entity():
             return HttpResponseRedirect(request.path_info)
@@ -708,6 +986,23 @@ class RelatedEntityView(FormMessageMixin, RelatedEntityConstructMixin, generic.U
         return self.handle_post(request, *args, **kwargs)
 
 
+def get_relation(model, accessor):
+    """
+    :param accessor: 关联对象的accessor name，例如'case_set'
+    :return: ForeignObjectRel
+    """
+    for rel in model._meta.related_objects:
+        if rel.get_accessor_name() == accessor:
+            return rel
+    raise ImproperlyConfigured('{} has no relation {}'.format(model._meta.label, accessor))
+
+
+def _filter_enabled(queryset):
+    if any(f.name == 'enabled' for f in queryset.model._meta.concrete_fields):
+        return queryset.filter(enabled=True)
+    return queryset
+
+
 class DisablementMixin:
     """
     : 处理post()请求，将指定object禁用
@@ -715,6 +1010,11 @@ class DisablementMixin:
     """
     success_url = None
     error = None
+    # list of (关联对象的accessor name, 错误信息)
+    # 存在enabled的关联对象时不能禁用，例如('case_set', '不能删除该客户：该客户具有关联的案件')
+    dependency_guards = ()
+    # list of 关联对象的accessor name，与object一起禁用，例如('transfer_charge', )
+    cascade_disable = ()
 
     def process_disable(self, request, *args, **kwargs):
         self.object = self.get_object()
@@ -737,9 +1037,69 @@ class DisablementMixin:
 
         return HttpResponseRedirect(redirect_url)
 
+    def process_bulk_disable(self, request):
+        """
+        : 禁用POST参数pk指定的多个object(例如DataTables中选中的行)
+        : 不满足dependency_guards的object不会被禁用，在errors中返回
+        :return: JsonResponse, {"disabled": [pk], "errors": [{"pk": pk, "message": 错误信息}]}
+        """
+        model = self.get_queryset().model
+        if not any(f.name == 'enabled' for f in model._meta.concrete_fields):
+            return HttpResponseBadRequest('该对象不能被删除')
+        try:
+            pks = [model._meta.pk.to_python(pk) for pk in request.POST.getlist('pk')]
+        except ValidationError:
+            return HttpResponseBadRequest('invalid pk')
+        queryset = self.get_queryset().filter(pk__in=pks)
+        errors = self.get_bulk_errors(queryset)
+        disabled = self.bulk_disable(queryset.exclude(pk__in=list(errors)))
+        return JsonResponse({
+            'disabled': disabled,
+            'errors': [{'pk': pk, 'message': message} for pk, message in errors.items()],
+        })
+
     def disable(self):
-        self.object.enabled = False
-        self.object.save()
+        with transaction.atomic():
+            queryset = type(self.object)._default_manager.filter(pk=self.object.pk)
+            for accessor in self.cascade_disable:
+                for obj in self.get_cascade_queryset(accessor, queryset):
+                    obj.enabled = False
+                    obj.save()
+            self.object.enabled = False
+            self.object.save()
+
+    def bulk_disable(self, queryset):
+        """
+        : 与disable()相同，但是使用UPDATE语句禁用queryset以及cascade_disable中的关联对象
+        :return: list of 被禁用的pk
+        """
+        with transaction.atomic():
+            for accessor in self.cascade_disable:
+                self.disable_queryset(self.get_cascade_queryset(accessor, queryset))
+            return self.disable_queryset(queryset)
+
+    def disable_queryset(self, queryset):
+        """
+        : 使用一条UPDATE语句禁用queryset中enabled的对象
+        : update()不发送post_save，发送utils.signals.post_bulk_disable并使model的缓存失效
+        :return: list of 被禁用的pk
+        """
+        model = queryset.model
+        pks = list(queryset.filter(enabled=True).values_list('pk', flat=True))
+        if pks:
+            model._default_manager.filter(pk__in=pks, enabled=True).update(enabled=False)
+            signals.post_bulk_disable.send(sender=model, pks=pks)
+            caching.bump_version(model)
+        return pks
+
+    def get_cascade_queryset(self, accessor, queryset):
+        """
+        : queryset中的object通过accessor关联的enabled对象
+        """
+        rel = get_relation(queryset.model, accessor)
+        return _filter_enabled(rel.related_model._default_manager.filter(
+            **{'{}__in'.format(rel.field.name): queryset}
+        ))
 
     def validate(self):
         if not hasattr(self.object, 'enabled'):
@@ -747,6 +1107,54 @@ class DisablementMixin:
                 '该对象不能被删除',
                 code='invalid'
             )
+        self.check_dependency_guards()
+
+    def get_dependency_guards(self):
+        return self.dependency_guards
+
+    def get_guard_queryset(self, accessor, model=None):
+        """
+        : accessor对应的关联对象中enabled的部分，通过OuterRef与外层查询关联
+        """
+        rel = get_relation(model or type(self.object), accessor)
+        return _filter_enabled(
+            rel.related_model._default_manager.filter(**{rel.field.name: OuterRef(rel.field_name)})
+        )
+
+    def get_guard_annotations(self, model):
+        """
+        : 每个关联关系是一个EXISTS子查询，找到第一条enabled的记录即停止
+        """
+        return OrderedDict(
+            ('guard_{}'.format(i), Exists(self.get_guard_queryset(accessor, model)))
+            for i, (accessor, message) in enumerate(self.get_dependency_guards())
+        )
+
+    def get_bulk_errors(self, queryset):
+        """
+        : 使用一条查询检查queryset中所有object的dependency_guards
+        :return: dict, pk -> 按照dependency_guards的顺序，第一个存在关联对象的错误信息
+        """
+        guards = self.get_dependency_guards()
+        if not guards:
+            return {}
+        annotations = self.get_guard_annotations(queryset.model)
+        errors = {}
+        for row in queryset.annotate(**annotations).values_list('pk', *annotations):
+            for exists, (accessor, message) in zip(row[1:], guards):
+                if exists:
+                    errors[row[0]] = message
+                    break
+        return errors
+
+    def check_dependency_guards(self):
+        """
+        :raise ValidationError: 按照dependency_guards的顺序，第一个存在关联对象的错误信息
+        """
+        queryset = type(self.object)._default_manager.filter(pk=self.object.pk)
+        errors = self.get_bulk_errors(queryset)
+        if self.object.pk in errors:
+            raise ValidationError(errors[self.object.pk], code='invalid')
 
     def clean(self):
         try:
@@ -773,6 +1181,93 @@ class DisablementView(DisablementMixin, generic.detail.SingleObjectMixin,
                       generic.View):
     """
     : 直接继承自View，使得仅支持POST方法
+    : url中没有pk_url_kwarg时，禁用POST参数pk指定的多个object
     """
     def post(self, request, *args, **kwargs):
+        if self.pk_url_kwarg not in kwargs:
+            return self.process_bulk_disable(request)
         return self.process_disable(request, *args, **kwargs)
+
+
+class RemoteChoicesView(JsonResponseMixin, generic.View):
+    """
+    : utils.widgets.RemoteSelect使用的选项搜索
+    : 返回select2 ajax格式的数据: {"results": [{"id": .., "text": ..}], "pagination": {"more": bool}}
+    """
+    paginate_by = 20
+
+    def get(self, request, token):
+        queryset, search_fields = widgets.get_registered_queryset(token)
+        if queryset is None:
+            raise Http404('Choices expired, please reload the page')
+        term = request.GET.get('term', '').strip()
+        if term:
+            queryset = self.filter_queryset(queryset, term, search_fields)
+        if not queryset.ordered:
+            queryset = queryset.order_by('pk')
+        try:
+            page = max(int(request.GET.get('page', 1)), 1)
+        except ValueError:
+            page = 1
+        start = (page - 1) * self.paginate_by
+        # 多读取一行用于判断是否还有下一页
+        objects = list(queryset[start:start + self.paginate_by + 1])
+        return self.render_to_json_response({
+            'results': [{'id': obj.pk, 'text': str(obj)} for obj in objects[:self.paginate_by]],
+            'pagination': {'more': len(objects) > self.paginate_by},
+        })
+
+    def filter_queryset(self, queryset, term, search_fields=None):
+        """
+        : 指定了search_fields时进行icontains查询，否则与model的DataTables全局搜索相同
+        """
+        if search_fields:
+            q = Q()
+            for field in search_fields:
+                q |= Q(**{'{}__icontains'.format(field): term})
+            return queryset.filter(q)
+        dt_config = registry.get_datatables_class(queryset.model)
+        if dt_config.search_index:
+            return search.filter_queryset(queryset, term)
+        q = dt_config.get_search_planner().get_q_object(term)
+        if q is None:
+            return queryset
+        return queryset.filter(q)
+
+
+class StaffRequiredMixin(UserPassesTestMixin):
+    raise_exception = True
+
+    def test_func(self):
+        return self.request.user.is_staff
+
+
+class RequestProfileListView(StaffRequiredMixin, generic.ListView):
+    """
+    : 最近的请求profile，参考base.middleware.ProfilingMiddleware
+    """
+    model = RequestProfile
+    paginate_by = 50
+    template_name = 'utils/requestprofile_list.html'
+
+    def get_queryset(self):
+        # 列表中不需要读取profile和queries
+        return super().get_queryset().defer('profile', 'queries').select_related('user')
+
+
+class RequestProfileDownloadView(StaffRequiredMixin, generic.detail.SingleObjectMixin, generic.View):
+    """
+    : 下载profile，?queries时下载json格式的查询记录
+    """
+    model = RequestProfile
+
+    def get(self, request, *args, **kwargs):
+        profile = self.get_object()
+        if 'queries' in request.GET:
+            response = HttpResponse(profile.queries, content_type='application/json')
+            filename = 'queries-{}.json'.format(profile.pk)
+        else:
+            response = HttpResponse(bytes(profile.profile), content_type='application/octet-stream')
+            filename = profile.get_filename()
+        response['Content-Disposition'] = 'attachment; filename="{}"'.format(filename)
+        return response
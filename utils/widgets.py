@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+
+"""
+远程加载选项的select widget
+
+ModelChoiceField使用RemoteSelect时，只渲染已选择的option，
+其余选项由select2通过ajax从RemoteChoicesView分页获取
+
+可以搜索的查询范围需要先在form模块中通过register_scope()声明，
+form或者view中再通过set_scope()选择范围(以及声明过的参数，例如按照main_object筛选)
+token中只签名model label、范围名称以及参数，RemoteChoicesView根据声明重新构造queryset，
+未声明的model、范围或者参数一律拒绝，所以即使token被伪造也只能查询已声明的范围
+不依赖服务端的cache，多进程部署时任意进程都可以处理搜索请求
+"""
+
+from django import forms
+from django.conf import settings
+from django.core import signing
+from django.core.exceptions import ImproperlyConfigured, ValidationError
+from django.forms.models import ModelChoiceIterator
+from django.urls import reverse
+
+# token的有效时间(秒)，超过这个时间没有刷新的表单页面无法继续搜索
+REMOTE_CHOICES_TIMEOUT = getattr(settings, 'REMOTE_CHOICES_TIMEOUT', 60 * 60 * 24)
+
+_TOKEN_SALT = 'utils.widgets.RemoteSelect'
+
+# (model label, 范围名称) -> (model, get_queryset, params, search_fields)
+_scopes = {}
+
+
+def register_scope(model, name='enabled', get_queryset=None, params=(), search_fields=None):
+    """
+    : 声明RemoteSelect可以使用的查询范围
+    : 多个form模块可以重复声明相同的范围，但是不能使用同一个名称声明不同的范围
+    :param model: model class
+    :param name: str, 范围名称
+    :param get_queryset: callable, 使用关键字参数(params的子集)返回queryset，
+    :                    为None时返回model.enabled_objects按照参数进行等值筛选的结果
+    :param params: list of str, 允许在token中出现的参数名
+    :param search_fields: list of field path, 为None时使用model的ModelDataTable的全局搜索
+    """
+    key = (model._meta.label, name)
+    scope = (model, get_queryset, frozenset(params), tuple(search_fields) if search_fields else None)
+    if _scopes.setdefault(key, scope) != scope:
+        raise ImproperlyConfigured('Remote choices scope {}:{} is already registered'.format(*key))
+
+
+def get_scope_queryset(label, name, params):
+    """
+    :return: tuple, (queryset, search_fields)，范围或者参数没有声明时返回(None, None)
+    """
+    scope = _scopes.get((label, name))
+    if scope is None or not isinstance(params, dict):
+        return None, None
+    model, get_queryset, allowed_params, search_fields = scope
+    for key, value in params.items():
+        # 参数只能是声明过的名称，值只能是pk之类的简单值
+        if key not in allowed_params or not isinstance(value, (int, str)):
+            return None, None
+    if get_queryset is None:
+        return model.enabled_objects.filter(**params), search_fields
+    return get_queryset(**params), search_fields
+
+
+def set_scope(field, name='enabled', **params):
+    """
+    : 将ModelChoiceField的queryset设置为已声明的查询范围，RemoteSelect渲染时签名这个范围
+    """
+    label = field.queryset.model._meta.label
+    queryset, _ = get_scope_queryset(label, name, params)
+    if queryset is None:
+        raise ImproperlyConfigured('Remote choices scope {}:{} with params {} is not registered'.format(
+            label, name, sorted(params)))
+    field.queryset = queryset
+    field.widget.scope = (name, params)
+
+
+def get_token(label, name, params):
+    return signing.dumps((label, name, params), salt=_TOKEN_SALT)
+
+
+def get_registered_queryset(token):
+    """
+    :return: tuple, (queryset, search_fields)，token签名错误、已过期或者范围未声明时返回(None, None)
+    """
+    try:
+        label, name, params = signing.loads(token, salt=_TOKEN_SALT, max_age=REMOTE_CHOICES_TIMEOUT)
+    except (signing.BadSignature, TypeError, ValueError):
+        return None, None
+    return get_scope_queryset(label, name, params)
+
+
+class RemoteSelect(forms.Select):
+    """
+    : 用于ModelChoiceField，需要通过set_scope()设置查询范围
+    """
+    # (范围名称, 参数)
+    scope = None
+
+    def get_context(self, name, value, attrs):
+        context = super().get_context(name, value, attrs)
+        if isinstance(self.choices, ModelChoiceIterator):
+            if self.scope is None:
+                raise ImproperlyConfigured('RemoteSelect of field "{}" requires set_scope()'.format(name))
+            scope_name, params = self.scope
+            token = get_token(self.choices.queryset.model._meta.label, scope_name, params)
+            context['widget']['attrs']['data-remote-url'] = reverse('utils:remote_choices', kwargs={'token': token})
+        return context
+
+    def optgroups(self, name, value, attrs=None):
+        """
+        : 只生成空选项以及已选择的option
+        """
+        if not isinstance(self.choices, ModelChoiceIterator):
+            return super().optgroups(name, value, attrs)
+        iterator = self.choices
+        field = iterator.field
+        options = []
+        if field.empty_label is not None:
+            options.append(('', field.empty_label))
+        selected = [v for v in value if v not in ('', None)]
+        if selected:
+            try:
+                options.extend(iterator.choice(obj) for obj in iterator.queryset.filter(pk__in=selected))
+            except (ValueError, ValidationError):
+                # 提交的值不是合法的pk
+                pass
+        self.choices = options
+        try:
+            return super().optgroups(name, value, attrs)
+        finally:
+            self.choices = iterator